@@ -0,0 +1,133 @@
+#!/usr/bin/python3
+
+import argparse, glob, io, os, random, sys, tracemalloc
+
+root = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, os.path.join(root, 'projects', '10'))
+sys.path.insert(0, os.path.join(root, 'projects', '11'))
+import JackAnalyzer, JackCompiler
+from JackParser import JackTokenizer, Parser
+from ToolchainBenchmark import _best, generate_jack
+
+# Measures the syntax trees of the shared Jack front end in
+# projects/10/JackParser.py: their memory per 10K lines of Jack, and the
+# time to write both the XML and the VM code of every class from one parse
+# against running the analyzer and the compiler on their own. Also measures
+# the throughput of the analyzer's XML writer, and writing the tokens XML
+# and the tree XML in one pass against two.
+
+def read_sources(directories, generated, seed):
+	texts = []
+	for directory in directories:
+		for path in sorted(glob.glob(os.path.join(directory, '*.jack'))):
+			with open(path) as file:
+				texts.append(file.read())
+	rng = random.Random(seed)
+	for index in range(generated):
+		texts.append(generate_jack(rng, f'Class{index}', 40, 6, 40))
+	return texts
+
+def count_nodes(node):
+	if isinstance(node, (list, tuple)):
+		return sum(count_nodes(item) for item in node)
+	if not hasattr(node, '__slots__'):
+		return 0
+	return 1 + sum(count_nodes(getattr(node, name)) for name in node.__slots__)
+
+def tree_memory(texts):
+	# Bytes the trees of all classes take, and their number of nodes
+	tracemalloc.start()
+	before = tracemalloc.get_traced_memory()[0]
+	trees = [Parser(JackTokenizer(None, text)).parse() for text in texts]
+	size = tracemalloc.get_traced_memory()[0] - before
+	tracemalloc.stop()
+	return size, count_nodes(trees)
+
+def separate_runs(texts):
+	outputs = []
+	for text in texts:
+		xml, vm = io.StringIO(), io.StringIO()
+		JackAnalyzer.CompilationEngine(JackTokenizer(None, text), xml).compile()
+		JackCompiler.CompilationEngine(JackTokenizer(None, text), vm).compile()
+		outputs.append((xml.getvalue(), vm.getvalue()))
+	return outputs
+
+def parse_once(texts):
+	outputs = []
+	for text in texts:
+		tree = Parser(JackTokenizer(None, text)).parse()
+		xml, vm = io.StringIO(), io.StringIO()
+		JackAnalyzer.CompilationEngine(None, xml).visit(tree)
+		JackCompiler.CompilationEngine(None, vm).visit(tree)
+		outputs.append((xml.getvalue(), vm.getvalue()))
+	return outputs
+
+def write_xml(trees):
+	# The lines and characters of XML written
+	lines = size = 0
+	for tree in trees:
+		engine = JackAnalyzer.CompilationEngine(None, io.StringIO())
+		engine.visit(tree)
+		lines += engine.xml.line_count
+		size += engine.xml.size
+	return lines, size
+
+def xml_two_passes(texts):
+	outputs = []
+	for text in texts:
+		tokens_xml, tree_xml = io.StringIO(), io.StringIO()
+		tokens = JackAnalyzer.TokenWriter(JackTokenizer(None, text), JackAnalyzer.XmlWriter(tokens_xml))
+		while tokens.advance():
+			pass
+		tokens.close()
+		JackAnalyzer.CompilationEngine(JackTokenizer(None, text), tree_xml).compile()
+		outputs.append((tokens_xml.getvalue(), tree_xml.getvalue()))
+	return outputs
+
+def xml_one_pass(texts):
+	outputs = []
+	for text in texts:
+		tokens_xml, tree_xml = io.StringIO(), io.StringIO()
+		tokens = JackAnalyzer.TokenWriter(JackTokenizer(None, text), JackAnalyzer.XmlWriter(tokens_xml))
+		tree = Parser(tokens).parse()
+		tokens.close()
+		JackAnalyzer.CompilationEngine(None, tree_xml).visit(tree)
+		outputs.append((tokens_xml.getvalue(), tree_xml.getvalue()))
+	return outputs
+
+def main(argv):
+	parser = argparse.ArgumentParser(description='Measures the memory of the Jack syntax trees, the time of writing XML and VM code from one parse and the throughput of the XML writer.')
+	parser.add_argument('directories', nargs='*', help='directories of .jack files (default: projects/12 and the benchmark programs)')
+	parser.add_argument('--generated', type=int, default=0, help='also parse this many generated classes like those of ToolchainBenchmark.py')
+	parser.add_argument('--repeat', type=int, default=3, help='runs per measurement, the fastest counts')
+	parser.add_argument('--seed', type=int, default=0)
+	args = parser.parse_args(argv)
+
+	directories = args.directories or [os.path.join(root, 'projects', '12')] + sorted(glob.glob(os.path.join(root, 'benchmarks', '*Benchmark')))
+	texts = read_sources(directories, args.generated, args.seed)
+	lines = sum(text.count('\n') for text in texts)
+	if not lines:
+		parser.error('no Jack code found')
+	separate_seconds, separate = _best(lambda: separate_runs(texts), args.repeat)
+	once_seconds, once = _best(lambda: parse_once(texts), args.repeat)
+	# After the runs, so the tokenizer's regular expressions are compiled
+	size, nodes = tree_memory(texts)
+	if separate != once:
+		raise Exception('The output of one parse differs from that of separate runs')
+	trees = [Parser(JackTokenizer(None, text)).parse() for text in texts]
+	xml_seconds, (xml_lines, xml_size) = _best(lambda: write_xml(trees), args.repeat)
+	two_passes_seconds, two_passes = _best(lambda: xml_two_passes(texts), args.repeat)
+	one_pass_seconds, one_pass = _best(lambda: xml_one_pass(texts), args.repeat)
+	if two_passes != one_pass:
+		raise Exception('The XML of one pass differs from that of two passes')
+
+	print(f'{"Jack code":<34} {len(texts):9} classes {lines:9} lines')
+	print(f'{"syntax trees":<34} {size * 10000 / lines:9.0f} bytes per 10K lines ({nodes} nodes, {size / nodes:.0f} bytes each)')
+	print(f'{"analyzer and compiler":<34} {separate_seconds * 1000:9.1f} ms')
+	print(f'{"one parse, XML and VM":<34} {once_seconds * 1000:9.1f} ms ({100 * (once_seconds - separate_seconds) / separate_seconds:+.1f}%)')
+	print(f'{"XML from trees":<34} {xml_seconds * 1000:9.1f} ms {xml_lines / xml_seconds:12.0f} lines/s {xml_size / xml_seconds / 1e6:6.1f} MB/s')
+	print(f'{"tokens and tree XML, two passes":<34} {two_passes_seconds * 1000:9.1f} ms')
+	print(f'{"tokens and tree XML, one pass":<34} {one_pass_seconds * 1000:9.1f} ms ({100 * (one_pass_seconds - two_passes_seconds) / two_passes_seconds:+.1f}%)')
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
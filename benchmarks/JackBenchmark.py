@@ -0,0 +1,71 @@
+#!/usr/bin/python3
+
+import argparse, glob, os, shutil, sys, tempfile, time
+
+root = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, os.path.join(root, 'tools'))
+sys.path.insert(0, os.path.join(root, 'projects', '11'))
+from JackCompiler import compile_file
+from VMEmulator import FunctionStats, VMEmulator, load_program
+
+# Compiles a benchmark program together with the OS and runs it on the VM
+# emulator with all natives disabled, so every OS function is measured as
+# Jack code.
+
+def build(benchmark_directory, os_directory):
+	directory = tempfile.mkdtemp()
+	try:
+		for file in glob.glob(os.path.join(os_directory, '*.jack')) + glob.glob(os.path.join(benchmark_directory, '*.jack')):
+			shutil.copy(file, directory)
+		for file in glob.glob(os.path.join(directory, '*.jack')):
+			compile_file(file)
+		return load_program(directory)
+	finally:
+		shutil.rmtree(directory)
+
+def run(program, max_steps = None):
+	stats = FunctionStats()
+	vm = VMEmulator(program, {}, stats)
+	if not vm.run(max_steps):
+		raise Exception(f'Benchmark did not finish within {max_steps} steps')
+	return vm, stats
+
+def compare_compiled(program, vm, cache = None):
+	# Runs the program compiled to Python by VMCompiler.py and checks that it
+	# leaves the same statics, temp and heap as the VM emulator
+	from VMCompiler import CompiledProgram
+	start = time.time()
+	compiled = CompiledProgram(program, cache)
+	loaded = time.time()
+	compiled.run()
+	finished = time.time()
+	for first, last in ((5, 13), (16, 256), (2048, len(vm.ram))):
+		if compiled.ram[first:last] != vm.ram[first:last]:
+			raise Exception(f'The compiled program leaves different RAM[{first}:{last}]')
+	return loaded - start, finished - loaded
+
+def main(argv):
+	parser = argparse.ArgumentParser(description='Runs a Jack benchmark program with the OS on the VM emulator.')
+	parser.add_argument('benchmark', help='directory with the benchmark .jack files')
+	parser.add_argument('functions', nargs='*', help='functions to report (default: all)')
+	parser.add_argument('--os', default=os.path.join(root, 'projects', '12'), help='directory with the OS .jack files')
+	parser.add_argument('--max-steps', type=int)
+	parser.add_argument('--compiled', action='store_true', help='also run the program compiled to Python and compare the times')
+	args = parser.parse_args(argv)
+
+	program = build(args.benchmark, args.os)
+	start = time.time()
+	vm, stats = run(program, args.max_steps)
+	print(f'{vm.steps} steps')
+	if args.compiled:
+		emulated = time.time() - start
+		load, compiled = compare_compiled(program, vm)
+		print(f'VM emulator {emulated:.3f}s (with stats), compiled {compiled:.3f}s after loading in {load:.3f}s, same RAM')
+	if args.functions:
+		for function in list(stats.calls):
+			if not function in args.functions:
+				del stats.calls[function]
+	stats.report()
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
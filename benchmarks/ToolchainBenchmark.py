@@ -0,0 +1,283 @@
+#!/usr/bin/python3
+
+import argparse, glob, io, json, os, random, shutil, sys, tempfile, time
+
+root = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, os.path.join(root, 'projects', '06'))
+sys.path.insert(0, os.path.join(root, 'projects', '08'))
+sys.path.insert(0, os.path.join(root, 'projects', '11'))
+import HackAssembler, VMTranslator
+from JackCompiler import CompilationEngine, JackTokenizer, compile_file
+
+# Times the stages of the toolchain on large synthetic inputs, generated
+# from a fixed seed so every run sees the same code, and measures the size
+# of the OS in projects/12 after compiling, translating and assembling it.
+# Results can be saved as a baseline and later runs compared against it.
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'ToolchainBaseline.json')
+
+# Synthetic Jack: classes with many methods, deeply nested expressions and
+# long string literals
+
+OPERATORS = ['+', '-', '*', '/', '&', '|', '<', '>', '=']
+
+def _expression(rng, depth, names):
+	if depth == 0 or rng.random() < 0.15:
+		return rng.choice([str(rng.randint(0, 32767)), rng.choice(names), 'true', 'false', 'null'])
+	kind = rng.random()
+	if kind < 0.6:
+		return f'({_expression(rng, depth - 1, names)} {rng.choice(OPERATORS)} {_expression(rng, depth - 1, names)})'
+	if kind < 0.75:
+		return rng.choice(['-', '~']) + _expression(rng, depth - 1, names)
+	if kind < 0.9:
+		return f'Gen0.f({_expression(rng, depth - 1, names)}, {_expression(rng, depth - 1, names)})'
+	return f'arr[{_expression(rng, depth - 1, names)}]'
+
+def _string(rng, length):
+	return ''.join(rng.choice('abcdefghijklmnopqrstuvwxyz ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789.,:;!?') for i in range(length))
+
+def generate_jack(rng, name, methods, depth, string_length):
+	names = ['x', 'y', 'i', 'j', 'a', 'b', 's']
+	lines = [f'class {name} {{', '    field int a, b;', '    static int s;', '']
+	lines.append('    function int f(int x, int y) {')
+	lines.append('        return x + y;')
+	lines.append('    }')
+	lines.append('')
+	for index in range(methods):
+		lines.append(f'    method int m{index}(int x, int y) {{')
+		lines.append('        var int i, j;')
+		lines.append('        var Array arr;')
+		lines.append(f'        let i = {_expression(rng, depth, names)};')
+		lines.append(f'        let arr[i] = {_expression(rng, depth, names)};')
+		lines.append(f'        while ({_expression(rng, depth // 2, names)}) {{')
+		lines.append(f'            let j = {_expression(rng, depth // 2, names)};')
+		lines.append('        }')
+		lines.append(f'        if ({_expression(rng, depth // 2, names)}) {{')
+		lines.append(f'            do Output.printString("{_string(rng, string_length)}");')
+		lines.append('        } else {')
+		lines.append(f'            let s = m{index}(x, {_expression(rng, depth // 2, names)});')
+		lines.append('        }')
+		lines.append(f'        return {_expression(rng, depth, names)};')
+		lines.append('    }')
+		lines.append('')
+	lines.append('}')
+	return '\n'.join(lines) + '\n'
+
+# Synthetic VM code: functions of random stack code with labels, branches
+# and calls
+
+def generate_vm(rng, name, functions, commands):
+	lines = []
+	for index in range(functions):
+		function = f'{name}.f{index}'
+		lines.append(f'function {function} {rng.randint(0, 8)}')
+		labels = 0
+		for command in range(commands):
+			kind = rng.random()
+			if kind < 0.45:
+				segment = rng.choice(['constant', 'constant', 'local', 'argument', 'this', 'that', 'static', 'temp', 'pointer'])
+				limit = {'temp': 7, 'pointer': 1, 'constant': 32767}.get(segment, 8)
+				lines.append(f'push {segment} {rng.randint(0, limit)}')
+			elif kind < 0.65:
+				segment = rng.choice(['local', 'argument', 'this', 'that', 'static', 'temp', 'pointer'])
+				limit = {'temp': 7, 'pointer': 1}.get(segment, 8)
+				lines.append(f'pop {segment} {rng.randint(0, limit)}')
+			elif kind < 0.85:
+				lines.append(rng.choice(['add', 'sub', 'neg', 'eq', 'gt', 'lt', 'and', 'or', 'not']))
+			elif kind < 0.9:
+				labels += 1
+				lines.append(f'label L{labels}')
+			elif kind < 0.95 and labels:
+				lines.append(f'{rng.choice(["goto", "if-goto"])} L{rng.randint(1, labels)}')
+			else:
+				lines.append(f'call {name}.f{rng.randrange(functions)} {rng.randint(0, 3)}')
+		lines.append('return')
+	return '\n'.join(lines) + '\n'
+
+# Synthetic assembly: straight code with labels, jumps and variables
+
+COMPUTATIONS = ['0', '1', '-1', 'D', 'A', '!D', '!A', '-D', '-A', 'D+1', 'A+1', 'D-1', 'A-1', 'D+A', 'D-A', 'A-D', 'D&A', 'D|A',
+	'M', '!M', '-M', 'M+1', 'M-1', 'D+M', 'D-M', 'M-D', 'D&M', 'D|M']
+
+def generate_asm(rng, instructions):
+	lines = []
+	labels = 0
+	for index in range(instructions):
+		kind = rng.random()
+		if kind < 0.05:
+			labels += 1
+			lines.append(f'(LOOP{labels})')
+		elif kind < 0.45:
+			target = rng.random()
+			if target < 0.3:
+				lines.append(f'@{rng.randint(0, 32767)}')
+			elif target < 0.6:
+				lines.append(f'@var{rng.randint(0, 500)}')
+			elif target < 0.8:
+				lines.append(f'@{rng.choice(["SP", "LCL", "ARG", "THIS", "THAT", "R13", "SCREEN", "KBD"])}')
+			else:
+				lines.append(f'@LOOP{rng.randint(1, labels + 1)}')
+		else:
+			destination = rng.choice(['', 'M=', 'D=', 'MD=', 'A=', 'AM=', 'AD=', 'AMD='])
+			jump = rng.choice([''] * 6 + [';JGT', ';JEQ', ';JGE', ';JLT', ';JNE', ';JLE', ';JMP'])
+			lines.append(destination + rng.choice(COMPUTATIONS) + jump)
+	# Define every label that was referenced
+	lines.append(f'(LOOP{labels + 1})')
+	return '\n'.join(lines) + '\n'
+
+# Stages
+
+def _best(function, repeat):
+	# The fastest of `repeat` runs, in seconds, and the result of the last
+	times = []
+	for index in range(repeat):
+		start = time.perf_counter()
+		result = function()
+		times.append(time.perf_counter() - start)
+	return min(times), result
+
+def tokenize(files):
+	count = 0
+	for file in files:
+		tokenizer = JackTokenizer(file)
+		while tokenizer.advance():
+			count += 1
+	return count
+
+def compile_classes(files):
+	commands = 0
+	for file in files:
+		output = io.StringIO()
+		CompilationEngine(JackTokenizer(file), output).compile()
+		commands += output.getvalue().count('\n')
+	return commands
+
+def translate(directory):
+	VMTranslator.translate_directory(directory)
+	with open(os.path.join(directory, os.path.basename(directory) + '.asm')) as file:
+		return sum(1 for line in file if line[0] != '/' and line[0] != '(')
+
+def assemble(asm_file):
+	HackAssembler.translate_file(asm_file)
+	with open(os.path.splitext(asm_file)[0] + '.hack') as file:
+		return sum(1 for line in file)
+
+def os_rom_size(os_directory):
+	# Instructions of the OS with an empty Main.main, built by the toolchain
+	directory = tempfile.mkdtemp()
+	try:
+		build_directory = os.path.join(directory, 'OS')
+		os.mkdir(build_directory)
+		for file in glob.glob(os.path.join(os_directory, '*.jack')):
+			shutil.copy(file, build_directory)
+		for file in glob.glob(os.path.join(build_directory, '*.jack')):
+			compile_file(file)
+		with open(os.path.join(build_directory, 'Main.vm'), 'w') as main_file:
+			main_file.write('function Main.main 0\npush constant 0\nreturn\n')
+		return assemble_directory(build_directory)
+	finally:
+		shutil.rmtree(directory)
+
+def assemble_directory(directory):
+	translate(directory)
+	return assemble(os.path.join(directory, os.path.basename(directory) + '.asm'))
+
+def run(scale, repeat, seed, os_directory):
+	# Returns {benchmark: {'seconds' or 'words': value, ...}}
+	rng = random.Random(seed)
+	directory = tempfile.mkdtemp()
+	results = {}
+	try:
+		jack_files = []
+		for index in range(scale):
+			path = os.path.join(directory, f'Gen{index}.jack')
+			with open(path, 'w') as file:
+				file.write(generate_jack(rng, f'Gen{index}', 40, 10, 200))
+			jack_files.append(path)
+		vm_directory = os.path.join(directory, 'VM')
+		os.mkdir(vm_directory)
+		for index in range(scale):
+			with open(os.path.join(vm_directory, f'Module{index}.vm'), 'w') as file:
+				file.write(generate_vm(rng, f'Module{index}', 50, 100))
+		asm_file = os.path.join(directory, 'Program.asm')
+		with open(asm_file, 'w') as file:
+			file.write(generate_asm(rng, 20000 * scale))
+
+		seconds, tokens = _best(lambda: tokenize(jack_files), repeat)
+		results['JackTokenizer.advance'] = {'seconds': seconds, 'tokens': tokens, 'tokens/s': tokens / seconds}
+		seconds, commands = _best(lambda: compile_classes(jack_files), repeat)
+		results['CompilationEngine.compile'] = {'seconds': seconds, 'tokens': tokens, 'tokens/s': tokens / seconds, 'VM commands': commands}
+		seconds, instructions = _best(lambda: translate(vm_directory), repeat)
+		results['VMTranslator.translate_directory'] = {'seconds': seconds, 'instructions': instructions, 'instructions/s': instructions / seconds}
+		seconds, words = _best(lambda: assemble(asm_file), repeat)
+		results['HackAssembler.translate_file'] = {'seconds': seconds, 'instructions': words, 'instructions/s': words / seconds}
+		results['OS ROM size'] = {'words': os_rom_size(os_directory)}
+	finally:
+		shutil.rmtree(directory)
+	return results
+
+def compare(results, baseline, time_threshold, size_threshold):
+	# Lines describing the regressions against the baseline: more than
+	# time_threshold percent slower or size_threshold percent larger
+	regressions = []
+	for name, result in results.items():
+		if not name in baseline:
+			continue
+		for metric, threshold in (('seconds', time_threshold), ('words', size_threshold)):
+			if metric in result and metric in baseline[name]:
+				old = baseline[name][metric]
+				new = result[metric]
+				if old and 100 * (new - old) / old > threshold:
+					regressions.append(f'{name}: {metric} {old:.4g} -> {new:.4g} ({100 * (new - old) / old:+.1f}%, threshold {threshold}%)')
+	return regressions
+
+def main(argv):
+	parser = argparse.ArgumentParser(description='Times the toolchain stages on generated inputs and compares them against a baseline.')
+	parser.add_argument('--scale', type=int, default=4, help='number of generated Jack classes and VM files; the assembly grows along')
+	parser.add_argument('--repeat', type=int, default=3, help='runs per stage, the fastest counts')
+	parser.add_argument('--seed', type=int, default=0)
+	parser.add_argument('--os', default=os.path.join(root, 'projects', '12'), help='directory with the OS .jack files')
+	parser.add_argument('--baseline', default=DEFAULT_BASELINE, help='baseline file to compare against')
+	parser.add_argument('--save-baseline', action='store_true', help='store the results as the new baseline')
+	parser.add_argument('--time-threshold', type=float, default=10, help='percentage a stage may be slower than the baseline')
+	parser.add_argument('--size-threshold', type=float, default=0, help='percentage the OS may be larger than the baseline')
+	parser.add_argument('--json', metavar='FILE', help='also write the results as JSON')
+	args = parser.parse_args(argv)
+
+	results = run(args.scale, args.repeat, args.seed, args.os)
+	baseline = None
+	if os.path.exists(args.baseline):
+		with open(args.baseline) as file:
+			baseline = json.load(file)
+		if baseline.get('scale') != args.scale or baseline.get('seed') != args.seed:
+			print(f'Baseline was made with --scale {baseline.get("scale")} --seed {baseline.get("seed")}, not comparing')
+			baseline = None
+	for name, result in results.items():
+		old = baseline['results'].get(name, {}) if baseline else {}
+		line = f'{name:<34}'
+		if 'seconds' in result:
+			rate = [metric for metric in result if metric.endswith('/s')][0]
+			line += f' {result["seconds"] * 1000:9.1f} ms {result[rate]:12.0f} {rate}'
+			if 'seconds' in old:
+				line += f' ({100 * (result["seconds"] - old["seconds"]) / old["seconds"]:+.1f}%)'
+		else:
+			line += f' {result["words"]:9} words'
+			if 'words' in old:
+				line += f' ({result["words"] - old["words"]:+})'
+		print(line)
+	if args.json:
+		with open(args.json, 'w') as file:
+			json.dump(results, file, indent = 2)
+	if args.save_baseline:
+		with open(args.baseline, 'w') as file:
+			json.dump({'scale': args.scale, 'seed': args.seed, 'results': results}, file, indent = 2)
+		return
+	if baseline:
+		regressions = compare(results, baseline['results'], args.time_threshold, args.size_threshold)
+		for regression in regressions:
+			print('REGRESSION: ' + regression)
+		if regressions:
+			sys.exit(1)
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -1,6 +1,11 @@
 #!/usr/bin/python3
 
-import os, re, sys
+import argparse, contextlib, json, os, re, sys
+from array import array
+
+def _phase(stats, name):
+	# Times a phase of the run if statistics are collected
+	return stats.phase(name) if stats else contextlib.nullcontext()
 
 class SymbolTable:
 	symbols = {
@@ -30,6 +35,10 @@ class SymbolTable:
 	}
 	nextVariableAddress = 16
 
+	def __init__(self):
+		# Labels and variables are per program, not shared between tables
+		self.symbols = dict(SymbolTable.symbols)
+
 	def register_label(self, label, address):
 		self.symbols[label] = address
 
@@ -118,45 +127,223 @@ class CodeWriter:
 		return "111" + self._encode_opcode(opcode) +  self._encode_destination(destination) + self._encode_jump(jump)
 
 
+OBJECT_VERSION = 1
+
+class ObjectWriter(CodeWriter):
+	# Assembles one module of a program into a relocatable object instead of
+	# .hack code. Label addresses are relative to the start of the module
+	# and listed as relocations; symbols the module doesn't define are left
+	# as 0 and listed as references, for the linker to resolve to a label of
+	# another module or, like the assembler does, to a variable.
+	def __init__(self, symbol_table):
+		CodeWriter.__init__(self, None, symbol_table)
+		self.code = []
+		self.relocations = []
+		self.references = {}
+
+	def _write(self, line):
+		self.code.append(int(line, 2))
+
+	def _encode_a(self, instruction):
+		symbol = instruction[1:]
+		if symbol.isdigit() or symbol in SymbolTable.symbols:
+			return CodeWriter._encode_a(self, instruction)
+		if symbol in self.symbol_table.symbols:
+			self.relocations.append(len(self.code))
+			return "{0:016b}".format(self.symbol_table.symbols[symbol])
+		self.references.setdefault(symbol, []).append(len(self.code))
+		return "{0:016b}".format(0)
+
+	def object(self):
+		return {
+			'format': 'hack-object',
+			'version': OBJECT_VERSION,
+			'code': self.code,
+			'labels': {symbol: address for symbol, address in self.symbol_table.symbols.items() if not symbol in SymbolTable.symbols},
+			'relocations': self.relocations,
+			'references': self.references,
+		}
+
+
 class Parser:
 	def __init__(self, code_writer, symbol_table):
 		self.writer = code_writer
 		self.symbol_table = symbol_table
 
-	def parseFile(self, filename):
+	def parseFile(self, filename, stats = None):
+		with _phase(stats, 'read'):
+			with open(filename) as file:
+				lines = file.readlines()
+		self.parse_lines(lines, stats)
+
+	def parse_lines(self, lines, stats = None):
 		# First pass: register labels in symbol table and keep only instructions
-		instructions = []
-		with open(filename) as file:
-			for line in file.readlines():
+		with _phase(stats, 'parse and resolve labels'):
+			instructions = []
+			labels = 0
+			for line in lines:
 				line = self._strip(line)
 				if len(line):
 					if line[0] == '(':
 						self.symbol_table.register_label(line[1:-1], len(instructions))
+						labels += 1
 					else:
 						instructions.append(line)
 		# Second pass: encode instructions
-		for instruction in instructions:
-			self.writer.encode(instruction)
+		with _phase(stats, 'encode'):
+			for instruction in instructions:
+				self.writer.encode(instruction)
+		if stats:
+			stats.count('lines', len(lines), rate = True)
+			stats.count('instructions', len(instructions), rate = True)
+			stats.count('labels', labels)
+			stats.count('variables', self.symbol_table.nextVariableAddress - 16)
+			stats.count('symbols', len(self.symbol_table.symbols))
 
 	def _strip(self, line):
 		line = re.sub('//.*', '', line)
 		line = re.sub(r'\s', '', line)
 		return line
 
-def translate_file(asm_filename):
+class StreamingAssembler:
+	# Single-pass alternative to Parser: every instruction is encoded as it
+	# is read, into an array of words. A-instructions with a symbol that is
+	# not known yet get a 0 and their address is put on the fixup list of
+	# the symbol, which is patched once the symbol turns out to be a label.
+	# Symbols still on the list at the end are variables, allocated in the
+	# order they were first used like Parser does, so the output is the same.
+	def __init__(self):
+		self.symbol_table = SymbolTable()
+		self.encoder = CodeWriter(None, self.symbol_table)
+		# Not 'H': programs too large for the ROM have labels beyond 65535,
+		# which are written out as they are, like Parser does
+		self.words = array('I')
+		self.fixups = {}
+		self.c_instructions = {}
+		self.lines = 0
+		self.labels = 0
+		# Words patched once their symbol was known
+		self.patched = 0
+
+	def feed(self, line):
+		self.lines += 1
+		line = re.sub(r'\s', '', re.sub('//.*', '', line))
+		if not line:
+			return
+		if line[0] == '(':
+			label = line[1:-1]
+			address = len(self.words)
+			self.symbol_table.register_label(label, address)
+			uses = self.fixups.pop(label, ())
+			for use in uses:
+				self.words[use] = address
+			self.patched += len(uses)
+			self.labels += 1
+		elif line[0] == '@':
+			symbol = line[1:]
+			if symbol.isdigit():
+				self.words.append(int(symbol))
+			elif symbol in self.symbol_table.symbols:
+				self.words.append(self.symbol_table.symbols[symbol])
+			else:
+				self.fixups.setdefault(symbol, []).append(len(self.words))
+				self.words.append(0)
+		else:
+			# Programs repeat a few dozen distinct C-instructions
+			word = self.c_instructions.get(line)
+			if word is None:
+				word = self.c_instructions[line] = int(self.encoder._encode_c(line), 2)
+			self.words.append(word)
+
+	def finish(self):
+		# Resolves the remaining symbols to variables and returns the words
+		for symbol, uses in self.fixups.items():
+			address = self.symbol_table.resolve(symbol)
+			for use in uses:
+				self.words[use] = address
+			self.patched += len(uses)
+		self.fixups = {}
+		return self.words
+
+def assemble_stream(file, stats = None):
+	# The words of the assembly code read from a file object, line by line
+	assembler = StreamingAssembler()
+	# Reading, parsing and encoding are one pass; the variables and the
+	# fixups left for them come after
+	with _phase(stats, 'read, parse and encode'):
+		for line in file:
+			assembler.feed(line)
+	with _phase(stats, 'resolve symbols'):
+		words = assembler.finish()
+	if stats:
+		stats.count('lines', assembler.lines, rate = True)
+		stats.count('instructions', len(words), rate = True)
+		stats.count('labels', assembler.labels)
+		stats.count('variables', assembler.symbol_table.nextVariableAddress - 16)
+		stats.count('symbols', len(assembler.symbol_table.symbols))
+		stats.count('fixups patched', assembler.patched)
+	return words
+
+def _write_words(file, words, stats = None):
+	with _phase(stats, 'write'):
+		file.write(''.join(["{0:016b}\n".format(word) for word in words]))
+	if stats:
+		stats.count('output bytes', 17 * len(words))
+
+def translate_file(asm_filename, stats = None):
 	hack_filename = os.path.splitext(asm_filename)[0] + ".hack"
-	with open(hack_filename, "w") as asm_file:
-		symbol_table = SymbolTable()
-		writer = CodeWriter(asm_file, symbol_table)
-		parser = Parser(writer, symbol_table)
-		parser.parseFile(asm_filename)
+	with open(asm_filename) as asm_file:
+		words = assemble_stream(asm_file, stats)
+	with open(hack_filename, "w") as hack_file:
+		_write_words(hack_file, words, stats)
+	if stats:
+		stats.count('input bytes', os.path.getsize(asm_filename))
+
+def assemble_object(asm_filename, stats = None):
+	object_filename = os.path.splitext(asm_filename)[0] + ".hobj"
+	symbol_table = SymbolTable()
+	writer = ObjectWriter(symbol_table)
+	parser = Parser(writer, symbol_table)
+	parser.parseFile(asm_filename, stats)
+	with _phase(stats, 'write'):
+		with open(object_filename, "w") as object_file:
+			json.dump(writer.object(), object_file)
+	if stats:
+		stats.count('input bytes', os.path.getsize(asm_filename))
+		stats.count('output bytes', os.path.getsize(object_filename))
+
+def _build_stats(parser, args, tool):
+	# A BuildStats of tools/BuildStats.py if the command line asks for
+	# statistics, otherwise None; it is only imported then, so the tool
+	# runs on its own
+	if not args.stats and not args.stats_json:
+		return None
+	sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'tools'))
+	try:
+		import BuildStats
+	except ImportError:
+		parser.error('--stats and --stats-json need tools/BuildStats.py')
+	return BuildStats.BuildStats(tool)
 
 def main(argv):
-	if len(argv) == 1 and os.path.splitext(argv[0])[1] == ".asm":
-		translate_file(argv[0])
-	else:
+	parser = argparse.ArgumentParser(description='Assembles a Hack .asm file into a .hack file.')
+	parser.add_argument('file', help="<filename>.asm, or '-' to assemble standard input to standard output")
+	parser.add_argument('--object', action='store_true', help='write a relocatable <filename>.hobj for tools/HackLinker.py instead')
+	parser.add_argument('--stats', action='store_true', help='report time per phase, sizes and throughput on standard error')
+	parser.add_argument('--stats-json', metavar='FILE', help="write the statistics as JSON to FILE ('-' for standard output)")
+	args = parser.parse_args(argv)
+	if args.file != '-' and os.path.splitext(args.file)[1] != ".asm":
 		print("Usage: HackAssembler.py <filename>.asm")
 		sys.exit(1)
+	stats = _build_stats(parser, args, 'HackAssembler')
+	if args.file == '-':
+		_write_words(sys.stdout, assemble_stream(sys.stdin, stats), stats)
+	elif args.object:
+		assemble_object(args.file, stats)
+	else:
+		translate_file(args.file, stats)
+	if stats:
+		stats.output(args)
 
 if __name__ == '__main__':
-    main(sys.argv[1:])
\ No newline at end of file
+    main(sys.argv[1:])
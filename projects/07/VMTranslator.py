@@ -1,6 +1,10 @@
 #!/usr/bin/python3
 
-import os, re, sys
+import argparse, contextlib, io, os, re, sys
+
+def _phase(stats, name):
+	# Times a phase of the run if statistics are collected
+	return stats.phase(name) if stats else contextlib.nullcontext()
 
 class CodeWriter:
 	def __init__(self, file):
@@ -213,12 +217,20 @@ class Parser:
 	def __init__(self, code_writer):
 		self.writer = code_writer
 
-	def parseFile(self, filename):
-		with open(filename) as file:
-			for line in file.readlines():
+	def parseFile(self, filename, stats = None):
+		with _phase(stats, 'read'):
+			with open(filename) as file:
+				lines = file.readlines()
+		with _phase(stats, 'parse and translate'):
+			commands = 0
+			for line in lines:
 				line = self._strip(line)
 				if len(line):
 					self._parse_line(line)
+					commands += 1
+		if stats:
+			stats.count('lines', len(lines), rate = True)
+			stats.count('commands', commands, rate = True)
 
 	def _strip(self, line):
 		line = re.sub('//.*', '', line)
@@ -256,19 +268,48 @@ class Parser:
 			raise Exception('Unknown command ' + cmd)
 
 
-def translate_file(vm_filename):
+def translate_file(vm_filename, stats = None):
 	asm_filename = os.path.splitext(vm_filename)[0] + ".asm"
-	with open(asm_filename, "w") as asm_file:
-		writer = CodeWriter(asm_file)
-		parser = Parser(writer)
-		parser.parseFile(vm_filename)
+	output = io.StringIO()
+	writer = CodeWriter(output)
+	parser = Parser(writer)
+	parser.parseFile(vm_filename, stats)
+	with _phase(stats, 'write'):
+		with open(asm_filename, "w") as asm_file:
+			asm_file.write(output.getvalue())
+	if stats:
+		lines = output.getvalue().splitlines()
+		stats.count('instructions', sum(1 for line in lines if line and line[0] != '(' and line[0] != '/'))
+		stats.count('labels', sum(1 for line in lines if line[:1] == '('))
+		stats.count('input bytes', os.path.getsize(vm_filename))
+		stats.count('output bytes', len(output.getvalue()))
+
+def _build_stats(parser, args, tool):
+	# A BuildStats of tools/BuildStats.py if the command line asks for
+	# statistics, otherwise None; it is only imported then, so the tool
+	# runs on its own
+	if not args.stats and not args.stats_json:
+		return None
+	sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'tools'))
+	try:
+		import BuildStats
+	except ImportError:
+		parser.error('--stats and --stats-json need tools/BuildStats.py')
+	return BuildStats.BuildStats(tool)
 
 def main(argv):
-	if len(argv) == 1 and os.path.splitext(argv[0])[1] == ".vm":
-		translate_file(argv[0])
-	else:
+	parser = argparse.ArgumentParser(description='Translates VM code into Hack assembly.')
+	parser.add_argument('file', help='<filename>.vm')
+	parser.add_argument('--stats', action='store_true', help='report time per phase, sizes and throughput on standard error')
+	parser.add_argument('--stats-json', metavar='FILE', help="write the statistics as JSON to FILE ('-' for standard output)")
+	args = parser.parse_args(argv)
+	if os.path.splitext(args.file)[1] != ".vm":
 		print("Usage: VMTranslator.py <filename>.vm")
 		sys.exit(1)
+	stats = _build_stats(parser, args, 'VMTranslator')
+	translate_file(args.file, stats)
+	if stats:
+		stats.output(args)
 
 if __name__ == '__main__':
     main(sys.argv[1:])
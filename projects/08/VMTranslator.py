@@ -1,23 +1,36 @@
 #!/usr/bin/python3
 
-import glob, os, re, sys
+import argparse, contextlib, glob, io, os, re, sys
+
+def _phase(stats, name):
+	# Times a phase of the run if statistics are collected
+	return stats.phase(name) if stats else contextlib.nullcontext()
 
 class CodeWriter:
 	def __init__(self, file):
 		self.file = file
 		self.labelNo = 0
-		self.label_prefix = ''
+		self.function = ''
+		self.shared_routines = False
+		# StaticFrames of the whole program, if it has been analysed
+		self.static_frames = None
 
 	def set_filename(self, filename):
 		self.static_prefix = os.path.splitext(os.path.basename(filename))[0] + '.'
 
 	def _get_next_label(self):
+		# Function$$<n>: VM labels can't contain '$', so this can't be the
+		# scoped label of one
 		self.labelNo += 1
-		return self.label_prefix + 'LABEL' + str(self.labelNo)
+		return self.function + '$$' + str(self.labelNo)
 
 	def _get_function_label(self, function):
 		return function
 
+	def _get_scoped_label(self, label):
+		# VM labels are local to their function
+		return self.function + '$' + label
+
 	def write(self, line):
 		self.file.write(line + '\n')
 
@@ -36,6 +49,13 @@ class CodeWriter:
 		self.write('D=M')
 
 	def _push_constant(self, value):
+		if str(value) in ('0', '1'):
+			# The ALU has both constants
+			self.write('@SP')
+			self.write('M=M+1')
+			self.write('A=M-1')
+			self.write('M=' + str(value))
+			return
 		self.write('@' + str(value))
 		self.write('D=A')
 		self._pushd()
@@ -46,6 +66,12 @@ class CodeWriter:
 		self._pushd()
 
 	def _push_segment(self, segmentRegister, address):
+		if int(address) < 2:
+			self.write('@' + segmentRegister)
+			self.write('A=M' if int(address) == 0 else 'A=M+1')
+			self.write('D=M')
+			self._pushd()
+			return
 		self.write('@' + segmentRegister)
 		self.write('D=M')
 		self.write('@' + address)
@@ -53,8 +79,18 @@ class CodeWriter:
 		self.write('D=M')
 		self._pushd()
 
+	def _static_address(self, segment, address):
+		# The fixed address of a local or argument of the current function,
+		# if it has a static frame
+		if self.static_frames and segment in ('local', 'argument'):
+			return self.static_frames.address(self.function, segment, int(address))
+		return None
+
 	def write_push(self, segment, address):
-		if segment == 'constant':
+		fixed = self._static_address(segment, address)
+		if fixed is not None:
+			self._push_register(str(fixed))
+		elif segment == 'constant':
 			self._push_constant(address)
 		elif segment == 'pointer':
 			self._push_register('R' + str(3 + int(address)))
@@ -79,6 +115,12 @@ class CodeWriter:
 		self.write('M=D')
 
 	def _pop_segment(self, segmentRegister, address):
+		if int(address) < 2:
+			self._popd()
+			self.write('@' + segmentRegister)
+			self.write('A=M' if int(address) == 0 else 'A=M+1')
+			self.write('M=D')
+			return
 		# R13 = segment + address
 		self.write('@' + segmentRegister)
 		self.write('D=M')
@@ -93,7 +135,10 @@ class CodeWriter:
 		self.write('M=D')
 
 	def write_pop(self, segment, address):
-		if segment == 'pointer':
+		fixed = self._static_address(segment, address)
+		if fixed is not None:
+			self._pop_register(str(fixed))
+		elif segment == 'pointer':
 			self._pop_register('R' + str(3 + int(address)))
 		elif segment == 'temp':
 			self._pop_register('R' + str(5 + int(address)))
@@ -163,12 +208,12 @@ class CodeWriter:
 		self.write('@SP')
 		self.write('A=M-1')
 		self.write('M=0')
-		self.write_goto(label2)
-		self.write_label(label1)
+		self._write_goto(label2)
+		self._write_label(label1)
 		self.write('@SP')
 		self.write('A=M-1')
 		self.write('M=-1')
-		self.write_label(label2)
+		self._write_label(label2)
 
 	def write_lt(self):
 		label1 = self._get_next_label()
@@ -184,12 +229,12 @@ class CodeWriter:
 		self.write('@SP')
 		self.write('A=M-1')
 		self.write('M=0')
-		self.write_goto(label2)
-		self.write_label(label1)
+		self._write_goto(label2)
+		self._write_label(label1)
 		self.write('@SP')
 		self.write('A=M-1')
 		self.write('M=-1')
-		self.write_label(label2)
+		self._write_label(label2)
 
 	def write_gt(self):
 		label1 = self._get_next_label()
@@ -205,33 +250,69 @@ class CodeWriter:
 		self.write('@SP')
 		self.write('A=M-1')
 		self.write('M=0')
-		self.write_goto(label2)
-		self.write_label(label1)
+		self._write_goto(label2)
+		self._write_label(label1)
 		self.write('@SP')
 		self.write('A=M-1')
 		self.write('M=-1')
-		self.write_label(label2)
+		self._write_label(label2)
 
-	def write_label(self, label):
+	def _write_label(self, label):
 		self.write('(' + label + ')')
 
-	def write_goto(self, label):
+	def _write_goto(self, label):
 		self.write('@' + label)
 		self.write('0;JMP')
 
+	def write_label(self, label):
+		self._write_label(self._get_scoped_label(label))
+
+	def write_goto(self, label):
+		self._write_goto(self._get_scoped_label(label))
+
 	def write_if(self, label):
 		self._popd()
-		self.write('@' + label)
+		self.write('@' + self._get_scoped_label(label))
 		self.write('D;JNE')
 
+	def write_compare_if(self, comparison, negate, label):
+		# eq/lt/gt, optionally not, then if-goto: jump on x - y directly
+		# instead of pushing -1 or 0 and testing that
+		jump = {'eq': 'JEQ', 'lt': 'JLT', 'gt': 'JGT'}[comparison]
+		if negate:
+			jump = {'JEQ': 'JNE', 'JLT': 'JGE', 'JGT': 'JLE'}[jump]
+		self.write('@SP')
+		self.write('M=M-1')
+		self.write('AM=M-1')
+		self.write('D=M')
+		self.write('A=A+1')
+		self.write('D=D-M')
+		self.write('@' + self._get_scoped_label(label))
+		self.write('D;' + jump)
+
 	def _push_segment_address(self, segment):
 		self.write('@' + segment)
 		self.write('D=M')
 		self._pushd()
 
 	def write_call(self, function, arg_count):
-		# Save return address
 		return_addr = self._get_next_label()
+		if self.shared_routines:
+			# R13 = n, R14 = function, D = return address; $CALL does the rest
+			self.write('@' + str(arg_count))
+			self.write('D=A')
+			self.write('@R13')
+			self.write('M=D')
+			self.write('@' + self._get_function_label(function))
+			self.write('D=A')
+			self.write('@R14')
+			self.write('M=D')
+			self.write('@' + return_addr)
+			self.write('D=A')
+			self._write_goto('$CALL')
+			self._write_label(return_addr)
+			return
+		# Save return address
 		self.write('@' + return_addr)
 		self.write('D=A')
 		self._pushd()
@@ -252,17 +333,89 @@ class CodeWriter:
 		self.write('D=M')
 		self.write('@LCL')
 		self.write('M=D')
-		self.write_goto(self._get_function_label(function))
-		self.write_label(return_addr)
+		self._write_goto(self._get_function_label(function))
+		self._write_label(return_addr)
+
+	def write_tail_call(self, function, arg_count):
+		# call immediately followed by return: the callee takes over the
+		# frame of the current function and returns straight to its caller
+		if not self.shared_routines:
+			self.write_call(function, arg_count)
+			self.write_return()
+			return
+		# R13 = n, R14 = function; $TAILCALL does the rest
+		self.write('@' + str(arg_count))
+		self.write('D=A')
+		self.write('@R13')
+		self.write('M=D')
+		self.write('@' + self._get_function_label(function))
+		self.write('D=A')
+		self.write('@R14')
+		self.write('M=D')
+		self._write_goto('$TAILCALL')
+
+	def _write_call_routine(self):
+		self._write_label('$CALL')
+		# Save return address and segment addresses
+		self._pushd()
+		self._push_segment_address('LCL')
+		self._push_segment_address('ARG')
+		self._push_segment_address('THIS')
+		self._push_segment_address('THAT')
+		# ARG = SP-R13-5
+		self.write('@SP')
+		self.write('D=M')
+		self.write('@R13')
+		self.write('D=D-M')
+		self.write('@5')
+		self.write('D=D-A')
+		self.write('@ARG')
+		self.write('M=D')
+		# LCL = SP
+		self.write('@SP')
+		self.write('D=M')
+		self.write('@LCL')
+		self.write('M=D')
+		# goto R14
+		self.write('@R14')
+		self.write('A=M')
+		self.write('0;JMP')
 
 	def write_function(self, function, local_count):
-		self.label_prefix = function + '$'
-		self.write_label(self._get_function_label(function))
+		self.function = function
+		self._write_label(self._get_function_label(function))
+		if self.static_frames and function in self.static_frames.frames:
+			self._write_static_frame(function, local_count)
+			return
 		self.write('D=0')
 		for i in range(local_count):
 			self._pushd()
 
+	def _write_static_frame(self, function, local_count):
+		# The call made the usual frame; copy the arguments out of it and
+		# clear the locals, which don't take up any stack
+		for i in range(self.static_frames.arguments[function]):
+			self.write('@ARG')
+			if i < 2:
+				self.write('A=M' if i == 0 else 'A=M+1')
+			else:
+				self.write('D=M')
+				self.write('@' + str(i))
+				self.write('A=D+A')
+			self.write('D=M')
+			self.write('@' + str(self.static_frames.address(function, 'argument', i)))
+			self.write('M=D')
+		for i in range(local_count):
+			self.write('@' + str(self.static_frames.address(function, 'local', i)))
+			self.write('M=0')
+
 	def write_return(self):
+		if self.shared_routines:
+			self._write_goto('$RETURN')
+		else:
+			self._write_return()
+
+	def _write_return(self):
 		# R13 = LCL
 		self.write('@LCL')
 		self.write('D=M')
@@ -312,7 +465,75 @@ class CodeWriter:
 		self.write('@R14')
 		self.write('A=M')
 		self.write('0;JMP')
-		self.label_prefix = ''
+
+	def _write_tail_call_routine(self):
+		self._write_label('$TAILCALL')
+		# Unless the current function got n arguments too, the saved frame
+		# has to move: push a copy of it, to be moved down with the arguments
+		self.write('@LCL')
+		self.write('D=M')
+		self.write('@ARG')
+		self.write('D=D-M')
+		self.write('@5')
+		self.write('D=D-A')
+		self.write('@R13')
+		self.write('D=D-M')
+		self.write('@$TAILCALL$ARGUMENTS')
+		self.write('D;JEQ')
+		self.write('@LCL')
+		self.write('D=M')
+		self.write('@5')
+		self.write('D=D-A')
+		self.write('@R15')
+		self.write('M=D')
+		for i in range(5):
+			self.write('@R15')
+			self.write('M=M+1')
+			self.write('A=M-1')
+			self.write('D=M')
+			self._pushd()
+		# R13 = n+5, LCL = ARG+n+5
+		self.write('@5')
+		self.write('D=A')
+		self.write('@R13')
+		self.write('MD=D+M')
+		self.write('@ARG')
+		self.write('D=D+M')
+		self.write('@LCL')
+		self.write('M=D')
+		# Move the top R13 words of the stack down to ARG; the destination is
+		# below the source, so copying upwards is safe
+		self._write_label('$TAILCALL$ARGUMENTS')
+		self.write('@SP')
+		self.write('D=M')
+		self.write('@R13')
+		self.write('D=D-M')
+		self.write('@R15')
+		self.write('M=D')
+		self.write('@ARG')
+		self.write('D=M')
+		self.write('@SP')
+		self.write('M=D')
+		self._write_label('$TAILCALL$COPY')
+		self.write('@R13')
+		self.write('MD=M-1')
+		self.write('@$TAILCALL$JUMP')
+		self.write('D;JLT')
+		self.write('@R15')
+		self.write('M=M+1')
+		self.write('A=M-1')
+		self.write('D=M')
+		self._pushd()
+		self._write_goto('$TAILCALL$COPY')
+		# SP = LCL, goto R14
+		self._write_label('$TAILCALL$JUMP')
+		self.write('@LCL')
+		self.write('D=M')
+		self.write('@SP')
+		self.write('M=D')
+		self.write('@R14')
+		self.write('A=M')
+		self.write('0;JMP')
 
 	def write_init(self):
 		self.write('@256')
@@ -321,18 +542,126 @@ class CodeWriter:
 		self.write('M=D')
 		self.write_comment('call Sys.init')
 		self.write_call('Sys.init', 0)
+		# Stop here if Sys.init ever returns
+		self._write_label('$HALT')
+		self._write_goto('$HALT')
+		# With the bootstrap code in place, all calls and returns share
+		# one copy of the frame handling code
+		self._write_call_routine()
+		self._write_label('$RETURN')
+		self._write_return()
+		self._write_tail_call_routine()
+		self.shared_routines = True
+
+class StaticFrames:
+	# Whole-program analysis giving the functions that can never be running
+	# twice at once, that is those not on a cycle of the call graph, fixed
+	# addresses for their locals and arguments. Two such functions share
+	# addresses unless one can call the other, directly or not. The frames
+	# end just below the heap; the stack is left with less room, but frames
+	# of these functions no longer take up any of it.
+	#
+	# A call of a function that isn't defined could lead to any function,
+	# so it counts as a call of all of them.
+
+	def __init__(self, files, end = 2048):
+		# files: lists of the lines of all .vm files of the program
+		self.locals = {}
+		self.arguments = {}
+		self.callees = {}
+		function = None
+		for lines in files:
+			for line in lines:
+				tokens = re.sub('//.*', '', line).split()
+				if not tokens:
+					continue
+				if tokens[0] == 'function':
+					function = tokens[1]
+					self.locals[function] = int(tokens[2])
+					self.arguments[function] = 0
+					self.callees[function] = set()
+				elif tokens[0] == 'call':
+					self.callees[function].add(tokens[1])
+				elif tokens[0] in ('push', 'pop') and tokens[1] == 'argument':
+					self.arguments[function] = max(self.arguments[function], int(tokens[2]) + 1)
+		for callees in self.callees.values():
+			if callees - self.locals.keys():
+				callees.update(self.locals)
+		reach = {function: self._reachable(function) for function in self.callees}
+		self.recursive = sorted(function for function in reach if function in reach[function])
+		qualified = [function for function in reach if not function in reach[function]]
+
+		# Each frame goes above the frames of all functions that can call it;
+		# those can't call each other in a cycle, so this ends
+		callers = {function: [caller for caller in qualified if function in reach[caller]] for function in qualified}
+		offsets = {}
+		def offset(function):
+			if not function in offsets:
+				offsets[function] = max((offset(caller) + self._size(caller) for caller in callers[function]), default = 0)
+			return offsets[function]
+		self.size = max((offset(function) + self._size(function) for function in qualified), default = 0)
+		self.base = end - self.size
+		self.frames = {function: self.base + offset(function) for function in qualified}
+
+	def _reachable(self, function):
+		# The functions a call of function can lead to
+		seen = set()
+		todo = list(self.callees[function])
+		while todo:
+			callee = todo.pop()
+			if not callee in seen:
+				seen.add(callee)
+				todo.extend(self.callees.get(callee, ()))
+		return seen
+
+	def _size(self, function):
+		return self.locals[function] + self.arguments[function]
+
+	def address(self, function, segment, index):
+		if not function in self.frames:
+			return None
+		if segment == 'local':
+			return self.frames[function] + index
+		return self.frames[function] + self.locals[function] + index
+
+	def report(self, file = sys.stdout):
+		file.write(f'{len(self.frames)} of {len(self.locals)} functions have static frames, {self.size} words at {self.base}..{self.base + self.size - 1}\n')
+		for function in sorted(self.frames):
+			file.write(f'  {function:40} {self.frames[function]:5} {self.locals[function]:3} locals {self.arguments[function]:3} arguments\n')
+		if self.recursive:
+			file.write('Recursive: ' + ', '.join(self.recursive) + '\n')
 
 class Parser:
+	comparisons = ['eq', 'lt', 'gt']
+
 	def __init__(self, code_writer):
 		self.writer = code_writer
-
-	def parseFile(self, filename):
+		# A comparison, and a not after it, held back in case an if-goto
+		# follows that they can be fused with; or a call, in case a return
+		# follows
+		self.pending = []
+
+	def parseFile(self, filename, stats = None):
+		with _phase(stats, 'read'):
+			with open(filename) as file:
+				lines = file.readlines()
+		self.parse_lines(filename, lines, stats)
+
+	def parse_lines(self, filename, lines, stats = None):
+		# Translates the lines of a .vm file; the file name sets the prefix
+		# of its statics
 		self.writer.set_filename(filename)
-		with open(filename) as file:
-			for line in file.readlines():
+		with _phase(stats, 'parse and translate'):
+			commands = 0
+			for line in lines:
 				line = self._strip(line)
 				if len(line):
 					self._parse_line(line)
+					commands += 1
+			self._flush()
+		if stats:
+			stats.count('lines', len(lines), rate = True)
+			stats.count('commands', commands, rate = True)
 
 	def _strip(self, line):
 		line = re.sub('//.*', '', line)
@@ -340,6 +669,42 @@ class Parser:
 		return line
 
 	def _parse_line(self, line):
+		tokens = line.split()
+		if self.pending:
+			first = self.pending[0].split()
+			if first[0] == 'call' and tokens[0] == 'return':
+				self._write_fused(line)
+				self.writer.write_tail_call(first[1], int(first[2]))
+				return
+			if first[0] in self.comparisons:
+				if tokens[0] == 'not' and len(self.pending) == 1:
+					self.pending.append(line)
+					return
+				if tokens[0] == 'if-goto':
+					negate = len(self.pending) == 2
+					self._write_fused(line)
+					self.writer.write_compare_if(first[0], negate, tokens[1])
+					return
+			self._flush()
+		if tokens[0] in self.comparisons or tokens[0] == 'call':
+			self.pending.append(line)
+			return
+		self._translate(line)
+
+	def _write_fused(self, line):
+		# The comments of the pending commands and the one fused with them
+		for pending in self.pending:
+			self.writer.write_comment(pending)
+		self.writer.write_comment(line)
+		self.pending = []
+
+	def _flush(self):
+		pending = self.pending
+		self.pending = []
+		for line in pending:
+			self._translate(line)
+
+	def _translate(self, line):
 		self.writer.write_comment(line)
 		tokens = line.split()
 		cmd = tokens[0]
@@ -382,31 +747,87 @@ class Parser:
 			raise Exception('Unknown command ' + cmd)
 
 
-def translate_file(vm_filename):
-	asm_filename = os.path.splitext(vm_filename)[0] + ".asm"
-	with open(asm_filename, "w") as asm_file:
-		writer = CodeWriter(asm_file)
-		parser = Parser(writer)
-		parser.parseFile(vm_filename)
+def _count_output(stats, asm):
+	# Instructions, labels and functions of the translated code
+	lines = asm.splitlines()
+	stats.count('instructions', sum(1 for line in lines if line and line[0] != '(' and line[0] != '/'))
+	stats.count('labels', sum(1 for line in lines if line[:1] == '('))
+	stats.count('functions', sum(1 for line in lines if line.startswith('// function ')))
+	stats.count('output bytes', len(asm))
 
-def translate_directory(directory):
+def translate_file(vm_filename, stats = None):
+	asm_filename = os.path.splitext(vm_filename)[0] + ".asm"
+	output = io.StringIO()
+	writer = CodeWriter(output)
+	parser = Parser(writer)
+	parser.parseFile(vm_filename, stats)
+	with _phase(stats, 'write'):
+		with open(asm_filename, "w") as asm_file:
+			asm_file.write(output.getvalue())
+	if stats:
+		stats.count('input bytes', os.path.getsize(vm_filename))
+		_count_output(stats, output.getvalue())
+
+def translate_directory(directory, stats = None, static_frames = False):
+	# Returns the StaticFrames of the program if static_frames is set
 	asm_filename = directory + '/' + os.path.basename(directory) + '.asm'
-	with open(asm_filename, "w") as asm_file:
-		writer = CodeWriter(asm_file)
-		writer.write_init()
-		parser = Parser(writer)
-		for file in glob.glob(directory + "/*.vm"):
-			writer.write_comment('file ' + file)
-			parser.parseFile(file)
+	output = io.StringIO()
+	writer = CodeWriter(output)
+	if static_frames:
+		with _phase(stats, 'call graph'):
+			sources = []
+			for file in sorted(glob.glob(directory + "/*.vm")):
+				with open(file) as source:
+					sources.append(source.readlines())
+			writer.static_frames = StaticFrames(sources)
+		if stats:
+			stats.count('static frames', len(writer.static_frames.frames))
+	writer.write_init()
+	parser = Parser(writer)
+	for file in sorted(glob.glob(directory + "/*.vm")):
+		writer.write_comment('file ' + file)
+		parser.parseFile(file, stats)
+		if stats:
+			stats.count('input bytes', os.path.getsize(file))
+	with _phase(stats, 'write'):
+		with open(asm_filename, "w") as asm_file:
+			asm_file.write(output.getvalue())
+	if stats:
+		_count_output(stats, output.getvalue())
+	return writer.static_frames
+
+def _build_stats(parser, args, tool):
+	# A BuildStats of tools/BuildStats.py if the command line asks for
+	# statistics, otherwise None; it is only imported then, so the tool
+	# runs on its own
+	if not args.stats and not args.stats_json:
+		return None
+	sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'tools'))
+	try:
+		import BuildStats
+	except ImportError:
+		parser.error('--stats and --stats-json need tools/BuildStats.py')
+	return BuildStats.BuildStats(tool)
 
 def main(argv):
-	if len(argv) == 1 and os.path.isdir(argv[0]):
-		translate_directory(argv[0])
-	elif len(argv) == 1 and os.path.splitext(argv[0])[1] == ".vm":
-		translate_file(argv[0])
+	parser = argparse.ArgumentParser(description='Translates VM code into Hack assembly.')
+	parser.add_argument('path', help='<filename>.vm | <directory>')
+	parser.add_argument('--static-frames', action='store_true', help='give functions that are never running twice at once fixed addresses for their locals and arguments (directories only) and report which')
+	parser.add_argument('--stats', action='store_true', help='report time per phase, sizes and throughput on standard error')
+	parser.add_argument('--stats-json', metavar='FILE', help="write the statistics as JSON to FILE ('-' for standard output)")
+	args = parser.parse_args(argv)
+	stats = _build_stats(parser, args, 'VMTranslator')
+	if os.path.isdir(args.path):
+		frames = translate_directory(args.path, stats, args.static_frames)
+		if frames:
+			frames.report()
+	elif os.path.splitext(args.path)[1] == ".vm":
+		translate_file(args.path, stats)
 	else:
 		print("Usage: VMTranslator.py <filename>.vm | <directory>")
 		sys.exit(1)
+	if stats:
+		stats.output(args)
 
 if __name__ == '__main__':
     main(sys.argv[1:])
@@ -0,0 +1,75 @@
+#!/usr/bin/python3
+
+import os, re, shutil, sys, tempfile, unittest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'tools'))
+from VMTranslator import translate_directory
+from CPUEmulator import Computer, assemble
+
+# User labels named like the labels the translator makes for comparisons,
+# fused branches and return addresses
+SYS = '''
+function Sys.init 0
+push constant 3
+push constant 3
+eq
+pop temp 0
+goto LABEL2
+label LABEL1
+push constant 99
+pop temp 1
+goto LABEL3
+label LABEL2
+push constant 1
+push constant 2
+lt
+if-goto LABEL1
+push constant 7
+pop temp 1
+label LABEL3
+push constant 5
+call Sys.double 1
+pop temp 2
+label LABEL4
+goto LABEL4
+function Sys.double 0
+push argument 0
+push argument 0
+gt
+if-goto LABEL1
+push argument 0
+push argument 0
+add
+return
+label LABEL1
+push constant 0
+return
+'''
+
+class LabelTest(unittest.TestCase):
+
+	def setUp(self):
+		self.directory = tempfile.mkdtemp()
+		self.program = os.path.join(self.directory, 'Program')
+		os.mkdir(self.program)
+		with open(os.path.join(self.program, 'Sys.vm'), 'w') as file:
+			file.write(SYS)
+		translate_directory(self.program)
+		self.asm = os.path.join(self.program, 'Program.asm')
+
+	def tearDown(self):
+		shutil.rmtree(self.directory)
+
+	def test_labels_are_defined_once(self):
+		with open(self.asm) as file:
+			labels = re.findall(r'^\((.*)\)$', file.read(), re.MULTILINE)
+		self.assertEqual(sorted(set(labels)), sorted(labels))
+
+	def test_user_labels_named_like_generated_ones(self):
+		computer = Computer(assemble(self.asm)[0])
+		computer.run(2000)
+		self.assertEqual(computer.ram[5:8], [0xFFFF, 99, 10])
+
+if __name__ == '__main__':
+	unittest.main()
@@ -1,347 +1,356 @@
 #!/usr/bin/python3
 
-import glob, os, re, sys
+import argparse, contextlib, glob, os, sys
+
+from JackParser import JackTokenizer, Parser, TokenType, Visitor
+
+def _phase(stats, name):
+	# Times a phase of the run if statistics are collected
+	return stats.phase(name) if stats else contextlib.nullcontext()
 
 # Set to True to only output tokens (project 10 stage 1)
 # Set to False to output parse tree (project 10 stage 2)
 tokenize_only = False
 
-class TokenType:
-	KEYWORD = 'keyword'
-	SYMBOL = 'symbol'
-	INT_CONST = 'integerConstant'
-	STR_CONST = 'stringConstant'
-	IDENTIFIER = 'identifier'
-
-class JackTokenizer:
-	tokens = [
-		{
-			'type': TokenType.STR_CONST,
-			're': r'"(.*?)"'
-		},
-		{
-			'type': TokenType.INT_CONST,
-			're': r'([0-9]+)'
-		},
-		{
-			'type': TokenType.SYMBOL,
-			're': r'([{}()[\]\.,;+\-\*/&|<>=~])'
-		},
-		{
-			'type': TokenType.KEYWORD,
-			're': r'\b(class|constructor|function|method|field|static|var|int|char|boolean|void|true|false|null|this|let|do|if|else|while|return)\b'
-		},
-		{
-			'type': TokenType.IDENTIFIER,
-			're': r'([a-zA-Z_][a-zA-Z_0-9]*)'
-		}
-	]
-
-	def __init__(self, filename):
-		with open(filename, "r") as input_file:
-			self.input = input_file.read()
-		self.pos = 0
+class XmlWriter:
+	# Streams indented XML lines to a file. Lines are collected and written
+	# in chunks of buffer_size lines, the indent of each depth is made only
+	# once and tokens are escaped in a single pass.
+	escapes = str.maketrans({'&': '&amp;', '<': '&lt;', '>': '&gt;'})
+	# The indents of the usual depths; each writer extends its own copy
+	indents = tuple('  ' * depth for depth in range(32))
+
+	def __init__(self, output_file, buffer_size = 4096):
+		self.output_file = output_file
+		self.buffer_size = buffer_size
+		self.buffer = []
+		self.indents = list(XmlWriter.indents)
+		self.depth = 0
+		self.line_count = 0
+		self.size = 0
+
+	def write(self, line):
+		self.buffer.append(self.indents[self.depth] + line)
+		if len(self.buffer) >= self.buffer_size:
+			self.flush()
+
+	def start_tag(self, name):
+		self.write(f'<{name}>')
+		self.depth += 1
+		if self.depth == len(self.indents):
+			self.indents.append('  ' * self.depth)
+
+	def end_tag(self, name):
+		self.depth -= 1
+		self.write(f'</{name}>')
+
+	def token(self, token_type, token):
+		self.write(f'<{token_type}> {token.translate(self.escapes)} </{token_type}>')
+
+	def flush(self):
+		if self.buffer:
+			text = '\n'.join(self.buffer) + '\n'
+			self.output_file.write(text)
+			self.line_count += len(self.buffer)
+			self.size += len(text)
+			self.buffer.clear()
+
+class TokenWriter:
+	# Hands the tokens of a tokenizer on to the parser and writes each to
+	# the tokens XML on the way, so both XML files come from one pass
+	def __init__(self, tokenizer, xml):
+		self.tokenizer = tokenizer
+		self.xml = xml
+		self.xml.start_tag('tokens')
 
 	def get_token(self):
-		return self.token
+		return self.tokenizer.get_token()
 
 	def get_token_type(self):
-		return self.token_type
+		return self.tokenizer.get_token_type()
 
 	def advance(self):
-		whitespace_or_comments = re.match(r'(\s+|//.*?\n|/\*.*?\*/)+', self.input[self.pos:], re.DOTALL)
-		if whitespace_or_comments:
-			self.pos += len(whitespace_or_comments.group(0))
+		if self.tokenizer.advance():
+			self.xml.token(self.tokenizer.get_token_type(), self.tokenizer.get_token())
+			return True
+		return False
 
-		if self.pos >= len(self.input):
-			return False
-		else:
-			for token in self.tokens:
-				m = re.match(token['re'], self.input[self.pos:])
-				if m:
-					self.token_type = token['type']
-					self.token = m.group(1)
-					self.pos += len(m.group(0))
-					return True
-			raise Exception("Unexpected token: " + self.input[self.pos:])
-
-def escapeXml(xml):
-	return str(xml).replace('&', '&amp;').replace('>', '&gt;').replace('<', '&lt;')
-
-class CompilationEngine:
-	types = ['int', 'char', 'boolean']
-	keyword_constants = ['true', 'false', 'null', 'this']
-	operators = ['+', '-', '*', '/', '&', '|', '<', '>', '=']
-	unary_ops = ['-', '~']
-	indent = ''
+	def close(self):
+		self.xml.end_tag('tokens')
+		self.xml.flush()
+
+class CompilationEngine(Visitor):
+	# Writes the XML of the tokens of a class or of its syntax tree from
+	# JackParser.py, with the tokens the tree leaves out written back in
 
 	def __init__(self, tokenizer, output_file):
 		self.tokenizer = tokenizer
-		self.output_file = output_file
-
-	def write(self, line):
-		self.output_file.write('{}{}\n'.format(self.indent, line))
-
-	def write_start_tag(self, name):
-		self.write('<{}>'.format(name))
-		self.indent += '  '
-
-	def write_end_tag(self, name):
-		self.indent = self.indent[:-2]
-		self.write('</{}>'.format(name))
+		self.xml = XmlWriter(output_file)
 
 	def compile(self):
 		if tokenize_only:
-			self.write_start_tag('tokens')
-			while self.tokenizer.advance():
-					self.write('<{0}> {1} </{0}>'.format(self.tokenizer.get_token_type(), escapeXml(self.tokenizer.get_token())))
-			self.write_end_tag('tokens')
+			tokens = TokenWriter(self.tokenizer, self.xml)
+			while tokens.advance():
+				pass
+			tokens.close()
 		else:
-			self.tokenizer.advance()
-			self.compile_class()
-
-	def compile_class(self):
-		self.write_start_tag('class')
-		self.eat(TokenType.KEYWORD, 'class')
-		self.eat(TokenType.IDENTIFIER)
-		self.eat(TokenType.SYMBOL, '{')
-		while self.token() == 'static' or self.token() == 'field':
-			self.compile_class_var_dec()
-		while self.token() == 'constructor' or self.token() == 'function' or self.token() == 'method':
-			self.compile_subroutine_dec()
-		self.eat(TokenType.SYMBOL, '}')
-		self.write_end_tag('class')
-
-	def compile_class_var_dec(self):
-		self.write_start_tag('classVarDec')
-		self.eat(TokenType.KEYWORD)        # static|field
-		self.eat_type()
-		self.eat(TokenType.IDENTIFIER)     # name
-		while self.token_type() == TokenType.SYMBOL and self.token() == ',':
-			self.eat(TokenType.SYMBOL, ',')
-			self.eat(TokenType.IDENTIFIER) # name
-		self.eat(TokenType.SYMBOL, ';')
-		self.write_end_tag('classVarDec')
-
-	def compile_subroutine_dec(self):
-		self.write_start_tag('subroutineDec')
-		self.eat(TokenType.KEYWORD)        # constructor|function|method
-		self.eat_type()
-		self.eat(TokenType.IDENTIFIER)     # name
-		self.eat(TokenType.SYMBOL, '(')
-		self.compile_parameter_list()
-		self.eat(TokenType.SYMBOL, ')')
-		self.compile_subroutine_body()
-		self.write_end_tag('subroutineDec')
-
-	def compile_parameter_list(self):
-		self.write_start_tag('parameterList')
-		if self.token_type() == TokenType.KEYWORD:
-			self.eat(TokenType.KEYWORD)    # type
-			self.eat(TokenType.IDENTIFIER) # name
-			while self.token_type() == TokenType.SYMBOL and self.token() == ',':
-				self.eat(TokenType.SYMBOL, ',')
-				self.eat_type()
-				self.eat(TokenType.IDENTIFIER) # name
-		self.write_end_tag('parameterList')
-
-	def compile_subroutine_body(self):
-		self.write_start_tag('subroutineBody')
-		self.eat(TokenType.SYMBOL, '{')
-		while self.token_type() == TokenType.KEYWORD and self.token() == 'var':
-			self.compile_var_dec()
-		self.compile_statements()
-		self.eat(TokenType.SYMBOL, '}')
-		self.write_end_tag('subroutineBody')
-
-	def compile_var_dec(self):
-		self.write_start_tag('varDec')
-		self.eat(TokenType.KEYWORD)        # var
-		self.eat_type()
-		self.eat(TokenType.IDENTIFIER)     # name
-		while self.token_type() == TokenType.SYMBOL and self.token() == ',':
-			self.eat(TokenType.SYMBOL, ',')
-			self.eat(TokenType.IDENTIFIER) # name
-		self.eat(TokenType.SYMBOL, ';')
-		self.write_end_tag('varDec')
-
-	def compile_statements(self):
-		self.write_start_tag('statements')
-		while self.token_type() == TokenType.KEYWORD:
-			if self.token() == 'let':
-				self.compile_let_statement()
-			elif self.token() == 'if':
-				self.compile_if_statement()
-			elif self.token() == 'while':
-				self.compile_while_statement()
-			elif self.token() == 'do':
-				self.compile_do_statement()
-			elif self.token() == 'return':
-				self.compile_return_statement()
-			else:
-				break
-		self.write_end_tag('statements')
-
-	def compile_let_statement(self):
-		self.write_start_tag('letStatement')
-		self.eat(TokenType.KEYWORD)      # let
-		self.eat(TokenType.IDENTIFIER)   # name
-		if self.token_type() == TokenType.SYMBOL and self.token() == '[':
-			self.eat(TokenType.SYMBOL, '[')
-			self.compile_expression()
-			self.eat(TokenType.SYMBOL, ']')
-		self.eat(TokenType.SYMBOL, '=')
-		self.compile_expression()        # value
-		self.eat(TokenType.SYMBOL, ';')
-		self.write_end_tag('letStatement')
-
-	def compile_if_statement(self):
-		self.write_start_tag('ifStatement')
-		self.eat(TokenType.KEYWORD)      # if
-		self.eat(TokenType.SYMBOL, '(')
-		self.compile_expression()        # condition
-		self.eat(TokenType.SYMBOL, ')')
-		self.eat(TokenType.SYMBOL, '{')
-		self.compile_statements()
-		self.eat(TokenType.SYMBOL, '}')
-		if self.token_type() == TokenType.KEYWORD and self.token() == 'else':
-			self.eat(TokenType.KEYWORD)  # else
-			self.eat(TokenType.SYMBOL, '{')
-			self.compile_statements()
-			self.eat(TokenType.SYMBOL, '}')
-		self.write_end_tag('ifStatement')
-
-	def compile_while_statement(self):
-		self.write_start_tag('whileStatement')
-		self.eat(TokenType.KEYWORD)      # while
-		self.eat(TokenType.SYMBOL, '(')
-		self.compile_expression()        # condition
-		self.eat(TokenType.SYMBOL, ')')
-		self.eat(TokenType.SYMBOL, '{')
-		self.compile_statements()
-		self.eat(TokenType.SYMBOL, '}')
-		self.write_end_tag('whileStatement')
-
-	def compile_do_statement(self):
-		self.write_start_tag('doStatement')
-		self.eat(TokenType.KEYWORD)      # do
-		self.eat(TokenType.IDENTIFIER)   # subroutineName or classname/varname
-		if self.token_type() == TokenType.SYMBOL and self.token() == '.':
-			self.eat(TokenType.SYMBOL, '.')
-			self.eat(TokenType.IDENTIFIER)   # subroutineName
-		self.eat(TokenType.SYMBOL, '(')
-		self.compile_expression_list()
-		self.eat(TokenType.SYMBOL, ')')
-		self.eat(TokenType.SYMBOL, ';')
-		self.write_end_tag('doStatement')
-
-	def compile_return_statement(self):
-		self.write_start_tag('returnStatement')
-		self.eat(TokenType.KEYWORD)      # return
-		if self.token_type() != TokenType.SYMBOL or self.token() != ';':
-			self.compile_expression()
-		self.eat(TokenType.SYMBOL, ';')
-		self.write_end_tag('returnStatement')
-
-	def compile_expression_list(self):
-		self.write_start_tag('expressionList')
-		if not (self.token_type() == TokenType.SYMBOL and self.token() == ')'):
-			self.compile_expression()
-			while self.token_type() == TokenType.SYMBOL and self.token() == ',':
-				self.eat(TokenType.SYMBOL, ',')
-				self.compile_expression()
-		self.write_end_tag('expressionList')
-
-	def compile_expression(self):
-		self.write_start_tag('expression')
-		self.compile_term()
-		if self.token_type() == TokenType.SYMBOL and self.token() in self.operators:
-			self.eat(TokenType.SYMBOL)
-			self.compile_term()
-		self.write_end_tag('expression')
-
-	def compile_term(self):
-		self.write_start_tag('term')
-		if self.token_type() == TokenType.INT_CONST:
-			self.eat(TokenType.INT_CONST)
-		elif self.token_type() == TokenType.STR_CONST:
-			self.eat(TokenType.STR_CONST)
-		elif self.token_type() == TokenType.KEYWORD and self.token() in self.keyword_constants:
-			self.eat(TokenType.KEYWORD)
-		elif self.token_type() == TokenType.SYMBOL and self.token() in self.unary_ops:
-			self.eat(TokenType.SYMBOL)
-			self.compile_term()
-		elif self.token_type() == TokenType.SYMBOL and self.token() == '(':
-			self.eat(TokenType.SYMBOL, '(')
-			self.compile_expression()
-			self.eat(TokenType.SYMBOL, ')')
-		elif self.token_type() == TokenType.IDENTIFIER:
-			self.eat(TokenType.IDENTIFIER)
-			if self.token_type() == TokenType.SYMBOL and self.token() == '[':
-				self.eat(TokenType.SYMBOL, '[')
-				self.compile_expression()
-				self.eat(TokenType.SYMBOL, ']')
-			elif self.token_type() == TokenType.SYMBOL and self.token() == '(':
-				# Subroutine call
-				self.eat(TokenType.SYMBOL, '(')
-				self.compile_expression_list()
-				self.eat(TokenType.SYMBOL, ')')
-			elif self.token_type() == TokenType.SYMBOL and self.token() == '.':
-				# Subroutine call
-				self.eat(TokenType.SYMBOL, '.')
-				self.eat(TokenType.IDENTIFIER)
-				self.eat(TokenType.SYMBOL, '(')
-				self.compile_expression_list()
-				self.eat(TokenType.SYMBOL, ')')
-		self.write_end_tag('term')
-
-	def compile_subroutine_call(self):
-		self.write_start_tag('subroutineCall')
-		self.eat(TokenType.IDENTIFIER)      # subroutineName or className
-		if self.token() == '.':
-			self.eat(TokenType.SYMBOL, '.')
-			self.eat(TokenType.IDENTIFIER)  # varName
-		self.eat(TokenType.SYMBOL, '(')
-		self.compile_expression_list()
-		self.eat(TokenType.SYMBOL, ')')
-		self.write_end_tag('subroutineCall')
-
-	def eat_type(self):
-		if self.token_type() == TokenType.KEYWORD and (self.token() == 'void' or self.token() in self.types):
-			self.eat(TokenType.KEYWORD)
+			self.visit(Parser(self.tokenizer).parse())
+
+	def visit_Class(self, node):
+		self.xml.start_tag('class')
+		self.write_keyword('class')
+		self.xml.token(TokenType.IDENTIFIER, node.name)
+		self.write_symbol('{')
+		self.visit_all(node.class_var_decs)
+		self.visit_all(node.subroutines)
+		self.write_symbol('}')
+		self.xml.end_tag('class')
+		self.xml.flush()
+
+	def visit_ClassVarDec(self, node):
+		self.xml.start_tag('classVarDec')
+		self.write_keyword(node.kind)
+		self.write_type(node.type)
+		self.write_names(node.names)
+		self.write_symbol(';')
+		self.xml.end_tag('classVarDec')
+
+	def visit_Subroutine(self, node):
+		self.xml.start_tag('subroutineDec')
+		self.write_keyword(node.kind)
+		self.write_type(node.return_type)
+		self.xml.token(TokenType.IDENTIFIER, node.name)
+		self.write_symbol('(')
+		self.xml.start_tag('parameterList')
+		for i, (typ, name) in enumerate(node.parameters):
+			if i:
+				self.write_symbol(',')
+			self.write_type(typ)
+			self.xml.token(TokenType.IDENTIFIER, name)
+		self.xml.end_tag('parameterList')
+		self.write_symbol(')')
+		self.xml.start_tag('subroutineBody')
+		self.write_symbol('{')
+		self.visit_all(node.var_decs)
+		self.write_statements(node.statements)
+		self.write_symbol('}')
+		self.xml.end_tag('subroutineBody')
+		self.xml.end_tag('subroutineDec')
+
+	def visit_VarDec(self, node):
+		self.xml.start_tag('varDec')
+		self.write_keyword('var')
+		self.write_type(node.type)
+		self.write_names(node.names)
+		self.write_symbol(';')
+		self.xml.end_tag('varDec')
+
+	def write_statements(self, statements):
+		self.xml.start_tag('statements')
+		self.visit_all(statements)
+		self.xml.end_tag('statements')
+
+	def write_block(self, statements):
+		self.write_symbol('{')
+		self.write_statements(statements)
+		self.write_symbol('}')
+
+	def visit_LetStatement(self, node):
+		self.xml.start_tag('letStatement')
+		self.write_keyword('let')
+		self.xml.token(TokenType.IDENTIFIER, node.name)
+		if node.index:
+			self.write_symbol('[')
+			self.visit(node.index)
+			self.write_symbol(']')
+		self.write_symbol('=')
+		self.visit(node.value)
+		self.write_symbol(';')
+		self.xml.end_tag('letStatement')
+
+	def visit_IfStatement(self, node):
+		self.xml.start_tag('ifStatement')
+		self.write_keyword('if')
+		self.write_symbol('(')
+		self.visit(node.condition)
+		self.write_symbol(')')
+		self.write_block(node.statements)
+		if node.else_statements is not None:
+			self.write_keyword('else')
+			self.write_block(node.else_statements)
+		self.xml.end_tag('ifStatement')
+
+	def visit_WhileStatement(self, node):
+		self.xml.start_tag('whileStatement')
+		self.write_keyword('while')
+		self.write_symbol('(')
+		self.visit(node.condition)
+		self.write_symbol(')')
+		self.write_block(node.statements)
+		self.xml.end_tag('whileStatement')
+
+	def visit_DoStatement(self, node):
+		self.xml.start_tag('doStatement')
+		self.write_keyword('do')
+		self.write_subroutine_call(node.call)
+		self.write_symbol(';')
+		self.xml.end_tag('doStatement')
+
+	def visit_ReturnStatement(self, node):
+		self.xml.start_tag('returnStatement')
+		self.write_keyword('return')
+		if node.value:
+			self.visit(node.value)
+		self.write_symbol(';')
+		self.xml.end_tag('returnStatement')
+
+	def visit_Expression(self, node):
+		self.xml.start_tag('expression')
+		self.visit(node.terms[0])
+		for operator, term in zip(node.operators, node.terms[1:]):
+			self.write_symbol(operator)
+			self.visit(term)
+		self.xml.end_tag('expression')
+
+	# Every term is written in a term element
+
+	def visit_IntegerConstant(self, node):
+		self.write_term(TokenType.INT_CONST, node.value)
+
+	def visit_StringConstant(self, node):
+		self.write_term(TokenType.STR_CONST, node.value)
+
+	def visit_KeywordConstant(self, node):
+		self.write_term(TokenType.KEYWORD, node.keyword)
+
+	def visit_Variable(self, node):
+		self.write_term(TokenType.IDENTIFIER, node.name)
+
+	def visit_ArrayElement(self, node):
+		self.xml.start_tag('term')
+		self.xml.token(TokenType.IDENTIFIER, node.name)
+		self.write_symbol('[')
+		self.visit(node.index)
+		self.write_symbol(']')
+		self.xml.end_tag('term')
+
+	def visit_SubroutineCall(self, node):
+		self.xml.start_tag('term')
+		self.write_subroutine_call(node)
+		self.xml.end_tag('term')
+
+	def visit_UnaryOp(self, node):
+		self.xml.start_tag('term')
+		self.write_symbol(node.operator)
+		self.visit(node.term)
+		self.xml.end_tag('term')
+
+	def visit_ParenthesizedExpression(self, node):
+		self.xml.start_tag('term')
+		self.write_symbol('(')
+		self.visit(node.expression)
+		self.write_symbol(')')
+		self.xml.end_tag('term')
+
+	def write_subroutine_call(self, node):
+		if node.target:
+			self.xml.token(TokenType.IDENTIFIER, node.target)
+			self.write_symbol('.')
+		self.xml.token(TokenType.IDENTIFIER, node.name)
+		self.write_symbol('(')
+		self.xml.start_tag('expressionList')
+		for i, argument in enumerate(node.arguments):
+			if i:
+				self.write_symbol(',')
+			self.visit(argument)
+		self.xml.end_tag('expressionList')
+		self.write_symbol(')')
+
+	def write_term(self, token_type, token):
+		self.xml.start_tag('term')
+		self.xml.token(token_type, token)
+		self.xml.end_tag('term')
+
+	def write_type(self, typ):
+		if typ == 'void' or typ in Parser.types:
+			self.write_keyword(typ)
 		else:
-			self.eat(TokenType.IDENTIFIER)
+			self.xml.token(TokenType.IDENTIFIER, typ)
 
-	def eat(self, token_type, token = False):
-		if self.token_type() != token_type:
-			raise Exception("Unexpected token type: " + self.token())
-		if token and self.token() != token:
-			raise Exception("Unexpected token: " + self.token())
-		self.write('<{0}> {1} </{0}>'.format(self.token_type(), escapeXml(self.token())))
-		self.tokenizer.advance()
+	def write_names(self, names):
+		for i, name in enumerate(names):
+			if i:
+				self.write_symbol(',')
+			self.xml.token(TokenType.IDENTIFIER, name)
 
-	def token_type(self):
-		return self.tokenizer.get_token_type()
-
-	def token(self):
-		return self.tokenizer.get_token()
+	def write_keyword(self, keyword):
+		self.xml.token(TokenType.KEYWORD, keyword)
 
+	def write_symbol(self, symbol):
+		self.xml.token(TokenType.SYMBOL, symbol)
 
-def analyze_file(jack_filename):
-	xml_filename = os.path.splitext(jack_filename)[0] + ".xml"
-	with open(xml_filename, "w") as xml_file:
+def analyze_file(jack_filename, stats = None, tokens = False):
+	# Writes <name>.xml and, with tokens, the tokens to <name>T.xml as well
+	base = os.path.splitext(jack_filename)[0]
+	with _phase(stats, 'read'):
 		tokenizer = JackTokenizer(jack_filename)
-		CompilationEngine(tokenizer, xml_file).compile()
+	with open(base + ".xml", "w") as xml_file, contextlib.ExitStack() as files:
+		engine = CompilationEngine(tokenizer, xml_file)
+		writers = [engine.xml]
+		if tokenize_only:
+			with _phase(stats, 'tokenize and write'):
+				engine.compile()
+		else:
+			source = tokenizer
+			if tokens:
+				source = TokenWriter(tokenizer, XmlWriter(files.enter_context(open(base + "T.xml", "w"))))
+				writers.append(source.xml)
+			# Tokenizing and parsing are one pass, the XML is written from the tree
+			with _phase(stats, 'tokenize and parse'):
+				tree = Parser(source).parse()
+				if tokens:
+					source.close()
+			with _phase(stats, 'write'):
+				engine.visit(tree)
+	if stats:
+		stats.count('classes')
+		stats.count('lines', tokenizer.input.count('\n'), rate = True)
+		stats.count('tokens', tokenizer.count, rate = True)
+		stats.count('XML lines', sum(writer.line_count for writer in writers))
+		stats.count('input bytes', len(tokenizer.input))
+		stats.count('output bytes', sum(writer.size for writer in writers))
+
+def _build_stats(parser, args, tool):
+	# A BuildStats of tools/BuildStats.py if the command line asks for
+	# statistics, otherwise None; it is only imported then, so the tool
+	# runs on its own
+	if not args.stats and not args.stats_json:
+		return None
+	sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'tools'))
+	try:
+		import BuildStats
+	except ImportError:
+		parser.error('--stats and --stats-json need tools/BuildStats.py')
+	return BuildStats.BuildStats(tool)
 
 def main(argv):
-	if len(argv) == 1 and os.path.isdir(argv[0]):
-		for file in glob.glob(argv[0] + "/*.jack"):
-			analyze_file(file)
-	elif len(argv) == 1 and os.path.splitext(argv[0])[1] == ".jack":
-		analyze_file(argv[0])
+	parser = argparse.ArgumentParser(description='Parses Jack classes into XML.')
+	parser.add_argument('path', help='<filename>.jack | <directory>')
+	parser.add_argument('--tokens', action='store_true', help='also write the tokens to <filename>T.xml, in the same pass')
+	parser.add_argument('--stats', action='store_true', help='report time per phase, sizes and throughput on standard error')
+	parser.add_argument('--stats-json', metavar='FILE', help="write the statistics as JSON to FILE ('-' for standard output)")
+	args = parser.parse_args(argv)
+	stats = _build_stats(parser, args, 'JackAnalyzer')
+	if os.path.isdir(args.path):
+		for file in glob.glob(args.path + "/*.jack"):
+			analyze_file(file, stats, args.tokens)
+	elif os.path.splitext(args.path)[1] == ".jack":
+		analyze_file(args.path, stats, args.tokens)
 	else:
 		print("Usage: JackAnalyzer.py <filename>.jack | <directory>")
 		sys.exit(1)
+	if stats:
+		stats.output(args)
 
 if __name__ == '__main__':
     main(sys.argv[1:])
@@ -0,0 +1,419 @@
+#!/usr/bin/python3
+
+import re, sys
+
+# The front end shared by JackAnalyzer.py and JackCompiler.py: the
+# tokenizer and a recursive-descent parser building a syntax tree of one
+# class, which the XML and VM writers then walk as visitors. The tree is
+# compact: nodes have __slots__, names and keywords are interned, and the
+# tokens the grammar implies (keywords of statements, brackets, commas and
+# semicolons) are not kept.
+
+class TokenType:
+	KEYWORD = 'keyword'
+	SYMBOL = 'symbol'
+	INT_CONST = 'integerConstant'
+	STR_CONST = 'stringConstant'
+	IDENTIFIER = 'identifier'
+
+class JackTokenizer:
+	tokens = [
+		{
+			'type': TokenType.STR_CONST,
+			're': r'"(.*?)"'
+		},
+		{
+			'type': TokenType.INT_CONST,
+			're': r'([0-9]+)'
+		},
+		{
+			'type': TokenType.SYMBOL,
+			're': r'([{}()[\]\.,;+\-\*/&|<>=~])'
+		},
+		{
+			'type': TokenType.KEYWORD,
+			're': r'\b(class|constructor|function|method|field|static|var|int|char|boolean|void|true|false|null|this|let|do|if|else|while|return)\b'
+		},
+		{
+			'type': TokenType.IDENTIFIER,
+			're': r'([a-zA-Z_][a-zA-Z_0-9]*)'
+		}
+	]
+
+	def __init__(self, filename, text = None):
+		# Tokenizes the given text instead of the file if there is one
+		if text is None:
+			with open(filename, "r") as input_file:
+				text = input_file.read()
+		self.input = text
+		self.pos = 0
+		self.count = 0
+
+	def get_token(self):
+		return self.token
+
+	def get_token_type(self):
+		return self.token_type
+
+	def advance(self):
+		whitespace_or_comments = re.match(r'(\s+|//.*?\n|/\*.*?\*/)+', self.input[self.pos:], re.DOTALL)
+		if whitespace_or_comments:
+			self.pos += len(whitespace_or_comments.group(0))
+
+		if self.pos >= len(self.input):
+			return False
+		else:
+			for token in self.tokens:
+				m = re.match(token['re'], self.input[self.pos:])
+				if m:
+					self.token_type = token['type']
+					self.token = m.group(1)
+					self.pos += len(m.group(0))
+					self.count += 1
+					return True
+			raise Exception("Unexpected token: " + self.input[self.pos:])
+
+# Syntax tree. Types are kept as their token; a type that is a keyword
+# (int, char, boolean, void) is one of Parser.types.
+
+class Class:
+	__slots__ = ('name', 'class_var_decs', 'subroutines')
+	def __init__(self, name, class_var_decs, subroutines):
+		self.name = name
+		self.class_var_decs = class_var_decs
+		self.subroutines = subroutines
+
+class ClassVarDec:
+	# kind is static or field
+	__slots__ = ('kind', 'type', 'names')
+	def __init__(self, kind, type, names):
+		self.kind = kind
+		self.type = type
+		self.names = names
+
+class Subroutine:
+	# kind is constructor, function or method; parameters are (type, name)
+	__slots__ = ('kind', 'return_type', 'name', 'parameters', 'var_decs', 'statements')
+	def __init__(self, kind, return_type, name, parameters, var_decs, statements):
+		self.kind = kind
+		self.return_type = return_type
+		self.name = name
+		self.parameters = parameters
+		self.var_decs = var_decs
+		self.statements = statements
+
+class VarDec:
+	__slots__ = ('type', 'names')
+	def __init__(self, type, names):
+		self.type = type
+		self.names = names
+
+class LetStatement:
+	# index is None unless an array element is assigned
+	__slots__ = ('name', 'index', 'value')
+	def __init__(self, name, index, value):
+		self.name = name
+		self.index = index
+		self.value = value
+
+class IfStatement:
+	# else_statements is None without an else
+	__slots__ = ('condition', 'statements', 'else_statements')
+	def __init__(self, condition, statements, else_statements):
+		self.condition = condition
+		self.statements = statements
+		self.else_statements = else_statements
+
+class WhileStatement:
+	__slots__ = ('condition', 'statements')
+	def __init__(self, condition, statements):
+		self.condition = condition
+		self.statements = statements
+
+class DoStatement:
+	__slots__ = ('call',)
+	def __init__(self, call):
+		self.call = call
+
+class ReturnStatement:
+	# value is None for return;
+	__slots__ = ('value',)
+	def __init__(self, value):
+		self.value = value
+
+class Expression:
+	# terms[0] operators[0] terms[1] ..., evaluated left to right
+	__slots__ = ('terms', 'operators')
+	def __init__(self, terms, operators):
+		self.terms = terms
+		self.operators = operators
+
+class IntegerConstant:
+	__slots__ = ('value',)
+	def __init__(self, value):
+		self.value = value
+
+class StringConstant:
+	__slots__ = ('value',)
+	def __init__(self, value):
+		self.value = value
+
+class KeywordConstant:
+	# true, false, null or this
+	__slots__ = ('keyword',)
+	def __init__(self, keyword):
+		self.keyword = keyword
+
+class Variable:
+	__slots__ = ('name',)
+	def __init__(self, name):
+		self.name = name
+
+class ArrayElement:
+	__slots__ = ('name', 'index')
+	def __init__(self, name, index):
+		self.name = name
+		self.index = index
+
+class SubroutineCall:
+	# target is the class or variable before the dot, or None
+	__slots__ = ('target', 'name', 'arguments')
+	def __init__(self, target, name, arguments):
+		self.target = target
+		self.name = name
+		self.arguments = arguments
+
+class UnaryOp:
+	__slots__ = ('operator', 'term')
+	def __init__(self, operator, term):
+		self.operator = operator
+		self.term = term
+
+class ParenthesizedExpression:
+	__slots__ = ('expression',)
+	def __init__(self, expression):
+		self.expression = expression
+
+class Visitor:
+	# Calls the visit_<node class> method of the visitor for a node
+
+	def visit(self, node):
+		return getattr(self, 'visit_' + node.__class__.__name__)(node)
+
+	def visit_all(self, nodes):
+		for node in nodes:
+			self.visit(node)
+
+class Parser:
+	types = ['int', 'char', 'boolean']
+	keyword_constants = ['true', 'false', 'null', 'this']
+	operators = ['+', '-', '*', '/', '&', '|', '<', '>', '=']
+	unary_ops = ['-', '~']
+	statements = ['let', 'if', 'while', 'do', 'return']
+
+	def __init__(self, tokenizer):
+		self.tokenizer = tokenizer
+
+	def parse(self):
+		# The Class of the tokenizer's input
+		self.tokenizer.advance()
+		return self.parse_class()
+
+	def parse_class(self):
+		self.eat(TokenType.KEYWORD, 'class')
+		name = self.eat_identifier()
+		self.eat_symbol('{')
+		class_var_decs = []
+		while self.token() == 'static' or self.token() == 'field':
+			class_var_decs.append(self.parse_class_var_dec())
+		subroutines = []
+		while self.token() == 'constructor' or self.token() == 'function' or self.token() == 'method':
+			subroutines.append(self.parse_subroutine_dec())
+		self.eat_symbol('}')
+		return Class(name, class_var_decs, subroutines)
+
+	def parse_class_var_dec(self):
+		kind = self.eat(TokenType.KEYWORD)  # static|field
+		typ = self.eat_type()
+		names = self.parse_names()
+		self.eat_symbol(';')
+		return ClassVarDec(kind, typ, names)
+
+	def parse_subroutine_dec(self):
+		kind = self.eat(TokenType.KEYWORD)  # constructor|function|method
+		return_type = self.eat_type()
+		name = self.eat_identifier()
+		self.eat_symbol('(')
+		parameters = self.parse_parameter_list()
+		self.eat_symbol(')')
+		self.eat_symbol('{')
+		var_decs = []
+		while self.try_eat_keyword('var'):
+			typ = self.eat_type()
+			var_decs.append(VarDec(typ, self.parse_names()))
+			self.eat_symbol(';')
+		statements = self.parse_statements()
+		self.eat_symbol('}')
+		return Subroutine(kind, return_type, name, parameters, var_decs, statements)
+
+	def parse_names(self):
+		names = [self.eat_identifier()]
+		while self.try_eat_symbol(','):
+			names.append(self.eat_identifier())
+		return names
+
+	def parse_parameter_list(self):
+		parameters = []
+		if self.token() != ')':
+			typ = self.eat_type()
+			parameters.append((typ, self.eat_identifier()))
+			while self.try_eat_symbol(','):
+				typ = self.eat_type()
+				parameters.append((typ, self.eat_identifier()))
+		return parameters
+
+	def parse_statements(self):
+		statements = []
+		while self.token_type() == TokenType.KEYWORD and self.token() in self.statements:
+			statement = self.eat(TokenType.KEYWORD)
+			if statement == 'let':
+				statements.append(self.parse_let_statement())
+			elif statement == 'if':
+				statements.append(self.parse_if_statement())
+			elif statement == 'while':
+				statements.append(self.parse_while_statement())
+			elif statement == 'do':
+				statements.append(DoStatement(self.parse_subroutine_call(self.eat_identifier())))
+				self.eat_symbol(';')
+			else:
+				statements.append(self.parse_return_statement())
+		return statements
+
+	def parse_let_statement(self):
+		name = self.eat_identifier()
+		index = None
+		if self.try_eat_symbol('['):
+			index = self.parse_expression()
+			self.eat_symbol(']')
+		self.eat_symbol('=')
+		value = self.parse_expression()
+		self.eat_symbol(';')
+		return LetStatement(name, index, value)
+
+	def parse_block(self):
+		self.eat_symbol('{')
+		statements = self.parse_statements()
+		self.eat_symbol('}')
+		return statements
+
+	def parse_if_statement(self):
+		self.eat_symbol('(')
+		condition = self.parse_expression()
+		self.eat_symbol(')')
+		statements = self.parse_block()
+		else_statements = None
+		if self.try_eat_keyword('else'):
+			else_statements = self.parse_block()
+		return IfStatement(condition, statements, else_statements)
+
+	def parse_while_statement(self):
+		self.eat_symbol('(')
+		condition = self.parse_expression()
+		self.eat_symbol(')')
+		return WhileStatement(condition, self.parse_block())
+
+	def parse_return_statement(self):
+		value = None
+		if self.token_type() != TokenType.SYMBOL or self.token() != ';':
+			value = self.parse_expression()
+		self.eat_symbol(';')
+		return ReturnStatement(value)
+
+	def parse_subroutine_call(self, name):
+		# After the first identifier of the call
+		target = None
+		if self.try_eat_symbol('.'):
+			target = name
+			name = self.eat_identifier()
+		self.eat_symbol('(')
+		arguments = []
+		if not (self.token_type() == TokenType.SYMBOL and self.token() == ')'):
+			arguments.append(self.parse_expression())
+			while self.try_eat_symbol(','):
+				arguments.append(self.parse_expression())
+		self.eat_symbol(')')
+		return SubroutineCall(target, name, arguments)
+
+	def parse_expression(self):
+		terms = [self.parse_term()]
+		operators = []
+		while self.token_type() == TokenType.SYMBOL and self.token() in self.operators:
+			operators.append(self.eat(TokenType.SYMBOL))
+			terms.append(self.parse_term())
+		return Expression(terms, operators)
+
+	def parse_term(self):
+		token_type = self.token_type()
+		if token_type == TokenType.INT_CONST:
+			return IntegerConstant(self.eat(TokenType.INT_CONST))
+		if token_type == TokenType.STR_CONST:
+			return StringConstant(self.eat(TokenType.STR_CONST))
+		if token_type == TokenType.KEYWORD and self.token() in self.keyword_constants:
+			return KeywordConstant(self.eat(TokenType.KEYWORD))
+		if token_type == TokenType.SYMBOL and self.token() in self.unary_ops:
+			operator = self.eat(TokenType.SYMBOL)
+			return UnaryOp(operator, self.parse_term())
+		if self.try_eat_symbol('('):
+			expression = self.parse_expression()
+			self.eat_symbol(')')
+			return ParenthesizedExpression(expression)
+		name = self.eat_identifier()
+		if self.token_type() == TokenType.SYMBOL and (self.token() == '.' or self.token() == '('):
+			return self.parse_subroutine_call(name)
+		if self.try_eat_symbol('['):
+			index = self.parse_expression()
+			self.eat_symbol(']')
+			return ArrayElement(name, index)
+		return Variable(name)
+
+	def eat_type(self):
+		if self.token_type() == TokenType.KEYWORD and (self.token() == 'void' or self.token() in self.types):
+			return self.eat(TokenType.KEYWORD)
+		else:
+			return self.eat_identifier()
+
+	def eat_identifier(self):
+		return self.eat(TokenType.IDENTIFIER)
+
+	def try_eat_symbol(self, symbol):
+		return self.try_eat(TokenType.SYMBOL, symbol)
+
+	def eat_symbol(self, symbol):
+		self.eat(TokenType.SYMBOL, symbol)
+
+	def try_eat_keyword(self, keyword):
+		return self.try_eat(TokenType.KEYWORD, keyword)
+
+	def try_eat(self, token_type, token):
+		if self.token_type() == token_type and self.token() == token:
+			self.tokenizer.advance()
+			return True
+		else:
+			return False
+
+	def eat(self, token_type, token = False):
+		if self.token_type() != token_type:
+			raise Exception("Unexpected token type: " + self.token())
+		if token and self.token() != token:
+			raise Exception("Unexpected token: " + self.token())
+		token = self.token()
+		self.tokenizer.advance()
+		# Names, keywords and numbers recur throughout a class; the tree
+		# keeps one copy of each
+		return token if token_type == TokenType.STR_CONST else sys.intern(token)
+
+	def token_type(self):
+		return self.tokenizer.get_token_type()
+
+	def token(self):
+		return self.tokenizer.get_token()
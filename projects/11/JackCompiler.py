@@ -1,65 +1,13 @@
 #!/usr/bin/python3
 
-import glob, os, re, sys
-
-class TokenType:
-	KEYWORD = 'keyword'
-	SYMBOL = 'symbol'
-	INT_CONST = 'integerConstant'
-	STR_CONST = 'stringConstant'
-	IDENTIFIER = 'identifier'
-
-class JackTokenizer:
-	tokens = [
-		{
-			'type': TokenType.STR_CONST,
-			're': r'"(.*?)"'
-		},
-		{
-			'type': TokenType.INT_CONST,
-			're': r'([0-9]+)'
-		},
-		{
-			'type': TokenType.SYMBOL,
-			're': r'([{}()[\]\.,;+\-\*/&|<>=~])'
-		},
-		{
-			'type': TokenType.KEYWORD,
-			're': r'\b(class|constructor|function|method|field|static|var|int|char|boolean|void|true|false|null|this|let|do|if|else|while|return)\b'
-		},
-		{
-			'type': TokenType.IDENTIFIER,
-			're': r'([a-zA-Z_][a-zA-Z_0-9]*)'
-		}
-	]
-
-	def __init__(self, filename):
-		with open(filename, "r") as input_file:
-			self.input = input_file.read()
-		self.pos = 0
-
-	def get_token(self):
-		return self.token
-
-	def get_token_type(self):
-		return self.token_type
-
-	def advance(self):
-		whitespace_or_comments = re.match(r'(\s+|//.*?\n|/\*.*?\*/)+', self.input[self.pos:], re.DOTALL)
-		if whitespace_or_comments:
-			self.pos += len(whitespace_or_comments.group(0))
-
-		if self.pos >= len(self.input):
-			return False
-		else:
-			for token in self.tokens:
-				m = re.match(token['re'], self.input[self.pos:])
-				if m:
-					self.token_type = token['type']
-					self.token = m.group(1)
-					self.pos += len(m.group(0))
-					return True
-			raise Exception("Unexpected token: " + self.input[self.pos:])
+import argparse, contextlib, glob, io, os, sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '10'))
+from JackParser import JackTokenizer, Parser, Visitor
+
+def _phase(stats, name):
+	# Times a phase of the run if statistics are collected
+	return stats.phase(name) if stats else contextlib.nullcontext()
 
 class Symbol:
 	def __init__(self, typ, segment, seqno):
@@ -92,9 +40,19 @@ class SymbolTable:
 	def count(self, segment):
 		return self.count_per_segment[segment] if segment in self.count_per_segment else 0
 
-class CompilationEngine:
-	types = ['int', 'char', 'boolean']
-	operators = ['+', '-', '*', '/', '&', '|', '<', '>', '=']
+class CompilationEngine(Visitor):
+	# Writes the VM code of a class, walking its syntax tree from
+	# JackParser.py
+	operator_commands = {
+		'&': 'and', '|': 'or', '>': 'gt', '<': 'lt', '=': 'eq', '+': 'add', '-': 'sub',
+		'*': 'call Math.multiply 2', '/': 'call Math.divide 2',
+	}
+	keyword_constants = {
+		'true': ['push constant 1', 'neg'],
+		'false': ['push constant 0'],
+		'null': ['push constant 0'],
+		'this': ['push pointer 0'],
+	}
 
 	def __init__(self, tokenizer, output_file):
 		self.tokenizer = tokenizer
@@ -103,6 +61,8 @@ class CompilationEngine:
 		self.function_symbol_table = SymbolTable()
 		self.label_count = 0
 		self.current_class = ''
+		self.subroutine_count = 0
+		self.most_symbols = 0
 
 	def emit(self, line):
 		self.output_file.write(f'{line}\n')
@@ -115,174 +75,105 @@ class CompilationEngine:
 		return 'L' + str(self.label_count)
 
 	def compile(self):
-		self.tokenizer.advance()
-		self.compile_class()
+		# Parses the tokenizer's class and writes its code; visit writes the
+		# code of a class parsed before
+		self.visit(Parser(self.tokenizer).parse())
 
-	def compile_class(self):
+	def visit_Class(self, node):
 		self.class_symbol_table.reset()
-		self.eat(TokenType.KEYWORD, 'class')
-		self.classname = self.eat(TokenType.IDENTIFIER)
-		self.eat_symbol('{')
-		while self.token() == 'static' or self.token() == 'field':
-			self.compile_class_var_dec()
-		while self.token() == 'constructor' or self.token() == 'function' or self.token() == 'method':
-			self.compile_subroutine_dec()
-		self.eat_symbol('}')
-
-	def compile_class_var_dec(self):
-		kind = self.eat(TokenType.KEYWORD)  # static|field
-		typ = self.eat_type()
-		name = self.eat(TokenType.IDENTIFIER)
-		segment = 'static' if kind == 'static' else 'this'
-		self.class_symbol_table.add(name, typ, segment)
-		while self.try_eat_symbol(','):
-			name = self.eat(TokenType.IDENTIFIER)
-			self.class_symbol_table.add(name, typ, segment)
-		self.eat_symbol(';')
-
-	def compile_subroutine_dec(self):
-		self.function_symbol_table.reset()
-		kind = self.eat(TokenType.KEYWORD)  # constructor|function|method
-		return_type = self.eat_type()
-		name = self.eat(TokenType.IDENTIFIER)
-		self.comment(f'{kind} {return_type} {name}')
-		self.eat_symbol('(')
-		self.compile_parameter_list(kind)
-		self.eat_symbol(')')
-		self.compile_subroutine_body(kind, name)
-		if return_type == 'void':
-			# Dummy return value
-			self.emit('push constant 0')
-		self.emit('return')
+		self.classname = node.name
+		self.visit_all(node.class_var_decs)
+		self.visit_all(node.subroutines)
+
+	def visit_ClassVarDec(self, node):
+		segment = 'static' if node.kind == 'static' else 'this'
+		for name in node.names:
+			self.class_symbol_table.add(name, node.type, segment)
 
-	def compile_parameter_list(self, kind):
-		if kind == 'method':
+	def visit_Subroutine(self, node):
+		self.function_symbol_table.reset()
+		self.comment(f'{node.kind} {node.return_type} {node.name}')
+		if node.kind == 'method':
 			# First argument is "this"
 			self.function_symbol_table.add('this', '', 'argument')
-		if self.token() != ')':
-			typ = self.eat_type()
-			name = self.eat(TokenType.IDENTIFIER)
+		for typ, name in node.parameters:
 			self.function_symbol_table.add(name, typ, 'argument')
-			while self.try_eat_symbol(','):
-				typ = self.eat_type()
-				name = self.eat(TokenType.IDENTIFIER) 
-				self.function_symbol_table.add(name, typ, 'argument')
-
-	def compile_subroutine_body(self, kind, name):
-		self.eat_symbol('{')
-		self.compile_var_declarations()
+		self.visit_all(node.var_decs)
 		local_var_count = self.function_symbol_table.count('local')
-		self.emit(f'function {self.classname}.{name} {local_var_count}')
-		if kind == 'constructor':
+		self.subroutine_count += 1
+		self.most_symbols = max(self.most_symbols, self.function_symbol_table.length())
+		self.emit(f'function {self.classname}.{node.name} {local_var_count}')
+		if node.kind == 'constructor':
 			# Allocate "this"
 			size = self.class_symbol_table.count('this')
 			self.emit(f'push constant {size}')
 			self.emit('call Memory.alloc 1')
 			self.emit('pop pointer 0')
-		elif kind == 'method':
+		elif node.kind == 'method':
 			# First argument is "this"
 			self.emit('push argument 0')
 			self.emit('pop pointer 0')
-		self.compile_statements()
-		self.eat_symbol('}')
-
-	def compile_var_declarations(self):
-		while self.try_eat_keyword('var'):
-			typ = self.eat_type()
-			name = self.eat(TokenType.IDENTIFIER)
-			self.function_symbol_table.add(name, typ, 'local')
-			while self.try_eat_symbol(','):
-				name = self.eat(TokenType.IDENTIFIER)
-				self.function_symbol_table.add(name, typ, 'local')
-			self.eat_symbol(';')
-
-	def compile_statements(self):
-		while self.token_type() == TokenType.KEYWORD:
-			statement = self.eat(TokenType.KEYWORD)
-			if statement == 'let':
-				self.compile_let_statement()
-			elif statement == 'if':
-				self.compile_if_statement()
-			elif statement == 'while':
-				self.compile_while_statement()
-			elif statement == 'do':
-				self.compile_do_statement()
-			elif statement == 'return':
-				self.compile_return_statement()
-			else:
-				break
-
-	def compile_let_statement(self):
-		name = self.eat(TokenType.IDENTIFIER)
-		if self.try_eat_symbol('['):
-			is_array = True
-			self.push_variable(name)
-			self.compile_expression()
-			self.eat_symbol(']')
+		self.visit_all(node.statements)
+
+	def visit_VarDec(self, node):
+		for name in node.names:
+			self.function_symbol_table.add(name, node.type, 'local')
+
+	def visit_LetStatement(self, node):
+		if node.index:
+			self.push_variable(node.name)
+			self.visit(node.index)
 			self.emit('add')  # Save array element address
-		else:
-			is_array = False
-		self.eat_symbol('=')
-		self.compile_expression()
-		self.eat_symbol(';')
-		if is_array:
+			self.visit(node.value)
 			self.emit('pop temp 0')
 			self.emit('pop pointer 1')  # Use saved array element address
 			self.emit('push temp 0')
 			self.emit('pop that 0')
 		else:
-			symbol = self.get_symbol(name)
+			self.visit(node.value)
+			symbol = self.get_symbol(node.name)
 			self.emit(f'pop {symbol.segment} {symbol.seqno}')
 
-	def compile_if_statement(self):
+	def visit_IfStatement(self, node):
 		label1 = self.next_label()
 		label2 = self.next_label()
-		self.eat_symbol('(')
-		self.compile_expression()
-		self.eat_symbol(')')
+		self.visit(node.condition)
 		self.emit('not')
 		self.emit('if-goto ' + label1)
-		self.eat_symbol('{')
-		self.compile_statements()
-		self.eat_symbol('}')
+		self.visit_all(node.statements)
 		self.emit('goto ' + label2)
 		self.emit('label ' + label1)
-		if self.try_eat_keyword('else'):
-			self.eat_symbol('{')
-			self.compile_statements()
-			self.eat_symbol('}')
+		if node.else_statements is not None:
+			self.visit_all(node.else_statements)
 		self.emit('label ' + label2)
 
-	def compile_while_statement(self):
+	def visit_WhileStatement(self, node):
 		label1 = self.next_label()
 		label2 = self.next_label()
 		self.emit('label ' + label1)
-		self.eat_symbol('(')
-		self.compile_expression()
-		self.eat_symbol(')')
+		self.visit(node.condition)
 		self.emit('not')
 		self.emit('if-goto ' + label2)
-		self.eat_symbol('{')
-		self.compile_statements()
-		self.eat_symbol('}')
+		self.visit_all(node.statements)
 		self.emit('goto ' + label1)
 		self.emit('label ' + label2)
 
-	def compile_do_statement(self):
-		name = self.eat(TokenType.IDENTIFIER)
-		self.compile_function_call(name)
-		self.eat_symbol(';')
+	def visit_DoStatement(self, node):
+		self.visit(node.call)
 		# Discard return value
 		self.emit('pop temp 0')
 
-	def compile_return_statement(self):
-		if self.token_type() != TokenType.SYMBOL or self.token() != ';':
-			self.compile_expression()
-		self.eat_symbol(';')
+	def visit_ReturnStatement(self, node):
+		if node.value:
+			self.visit(node.value)
+		else:
+			# Dummy return value
+			self.emit('push constant 0')
+		self.emit('return')
 
-	def compile_function_call(self, name):
-		if self.try_eat_symbol('.'):
-			symbol = self.try_get_symbol(name)
+	def visit_SubroutineCall(self, node):
+		if node.target:
+			symbol = self.try_get_symbol(node.target)
 			if symbol:
 				# Push object pointer (calling a method)
 				self.emit(f'push {symbol.segment} {symbol.seqno}')
@@ -290,97 +181,54 @@ class CompilationEngine:
 				arg_count = 1
 			else:
 				# Don't push "this" (calling a function or constructor)
+				name = node.target
 				arg_count = 0
-			name += '.' + self.eat(TokenType.IDENTIFIER)
+			name += '.' + node.name
 		else:
 			# Push "this" (calling own method)
 			self.emit('push pointer 0')
-			name = self.classname + '.' + name
+			name = self.classname + '.' + node.name
 			arg_count = 1
-		self.eat_symbol('(')
-		arg_count += self.compile_argument_list()
-		self.eat_symbol(')')
+		self.visit_all(node.arguments)
+		arg_count += len(node.arguments)
 		self.emit(f'call {name} {arg_count}')
 
-	def compile_argument_list(self):
-		arg_count = 0
-		if not (self.token_type() == TokenType.SYMBOL and self.token() == ')'):
-			self.compile_expression()
-			arg_count += 1
-			while self.try_eat_symbol(','):
-				arg_count += 1
-				self.compile_expression()
-		return arg_count
-
-	def compile_expression(self):
-		self.compile_term()
-		if self.token_type() == TokenType.SYMBOL and self.token() in self.operators:
-			operator = self.eat(TokenType.SYMBOL)
-			self.compile_term()
-			if operator == '&':
-				self.emit('and')
-			elif operator == '|':
-				self.emit('or')
-			elif operator == '>':
-				self.emit('gt')
-			elif operator == '<':
-				self.emit('lt')
-			elif operator == '=':
-				self.emit('eq')
-			elif operator == '+':
-				self.emit('add')
-			elif operator == '-':
-				self.emit('sub')
-			elif operator == '*':
-				self.emit('call Math.multiply 2')
-			elif operator == '/':
-				self.emit('call Math.divide 2')
-			else:
-				raise Exception("Unexpected operator: " + operator)
-
-	def compile_term(self):
-		if self.token_type() == TokenType.INT_CONST:
-			const = self.eat(TokenType.INT_CONST)
-			self.emit(f'push constant {const}')
-		elif self.token_type() == TokenType.STR_CONST:
-			string = self.eat(TokenType.STR_CONST)
-			self.emit(f'push constant {len(string)}')
-			self.emit('call String.new 1')
-			for c in string:
-				self.emit(f'push constant {ord(c)}')
-				self.emit('call String.appendChar 2')
-		elif self.try_eat_keyword('true'):
-			self.emit('push constant 1')
-			self.emit('neg')
-		elif self.try_eat_keyword('false'):
-			self.emit('push constant 0')
-		elif self.try_eat_keyword('null'):
-			self.emit('push constant 0')
-		elif self.try_eat_keyword('this'):
-			self.emit('push pointer 0')
-		elif self.try_eat_symbol('-'):
-			self.compile_term()
-			self.emit('neg')
-		elif self.try_eat_symbol('~'):
-			self.compile_term()
-			self.emit('not')
-		elif self.try_eat_symbol('('):
-			self.compile_expression()
-			self.eat_symbol(')')
-		elif self.token_type() == TokenType.IDENTIFIER:
-			name = self.eat(TokenType.IDENTIFIER)
-			if self.token_type() == TokenType.SYMBOL and (self.token() == '.' or self.token() == '('):
-				self.compile_function_call(name)
-			else:
-				# Variable
-				self.push_variable(name)
-				if self.try_eat_symbol('['):
-					# Array
-					self.compile_expression()
-					self.eat_symbol(']')
-					self.emit('add')
-					self.emit('pop pointer 1')
-					self.emit('push that 0')
+	def visit_Expression(self, node):
+		self.visit(node.terms[0])
+		for operator, term in zip(node.operators, node.terms[1:]):
+			self.visit(term)
+			self.emit(self.operator_commands[operator])
+
+	def visit_IntegerConstant(self, node):
+		self.emit(f'push constant {node.value}')
+
+	def visit_StringConstant(self, node):
+		self.emit(f'push constant {len(node.value)}')
+		self.emit('call String.new 1')
+		for c in node.value:
+			self.emit(f'push constant {ord(c)}')
+			self.emit('call String.appendChar 2')
+
+	def visit_KeywordConstant(self, node):
+		for line in self.keyword_constants[node.keyword]:
+			self.emit(line)
+
+	def visit_Variable(self, node):
+		self.push_variable(node.name)
+
+	def visit_ArrayElement(self, node):
+		self.push_variable(node.name)
+		self.visit(node.index)
+		self.emit('add')
+		self.emit('pop pointer 1')
+		self.emit('push that 0')
+
+	def visit_UnaryOp(self, node):
+		self.visit(node.term)
+		self.emit('neg' if node.operator == '-' else 'not')
+
+	def visit_ParenthesizedExpression(self, node):
+		self.visit(node.expression)
 
 	def push_variable(self, name):
 		symbol = self.get_symbol(name)
@@ -398,59 +246,62 @@ class CompilationEngine:
 			symbol = self.class_symbol_table.get(name)
 		return symbol
 
-	def eat_type(self):
-		if self.token_type() == TokenType.KEYWORD and (self.token() == 'void' or self.token() in self.types):
-			return self.eat(TokenType.KEYWORD)
-		else:
-			return self.eat(TokenType.IDENTIFIER)
-
-	def try_eat_symbol(self, symbol):
-		return self.try_eat(TokenType.SYMBOL, symbol)
-
-	def eat_symbol(self, symbol):
-		self.eat(TokenType.SYMBOL, symbol)
-
-	def try_eat_keyword(self, keyword):
-		return self.try_eat(TokenType.KEYWORD, keyword)
-
-	def try_eat(self, token_type, token):
-		if self.token_type() == token_type and self.token() == token:
-			self.tokenizer.advance()
-			return True
-		else:
-			return False
-
-	def eat(self, token_type, token = False):
-		if self.token_type() != token_type:
-			raise Exception("Unexpected token type: " + self.token())
-		if token and self.token() != token:
-			raise Exception("Unexpected token: " + self.token())
-		token = self.token()
-		self.tokenizer.advance()
-		return token
-
-	def token_type(self):
-		return self.tokenizer.get_token_type()
-
-	def token(self):
-		return self.tokenizer.get_token()
-
 
-def compile_file(jack_filename):
-	xml_filename = os.path.splitext(jack_filename)[0] + ".vm"
-	with open(xml_filename, "w") as xml_file:
+def compile_file(jack_filename, stats = None):
+	vm_filename = os.path.splitext(jack_filename)[0] + ".vm"
+	output = io.StringIO()
+	with _phase(stats, 'read'):
 		tokenizer = JackTokenizer(jack_filename)
-		CompilationEngine(tokenizer, xml_file).compile()
+	# Tokenizing and parsing are one pass, code generation walks the tree
+	with _phase(stats, 'tokenize and parse'):
+		tree = Parser(tokenizer).parse()
+	with _phase(stats, 'generate'):
+		engine = CompilationEngine(tokenizer, output)
+		engine.visit(tree)
+	with _phase(stats, 'write'):
+		with open(vm_filename, "w") as vm_file:
+			vm_file.write(output.getvalue())
+	if stats:
+		stats.count('classes')
+		stats.count('lines', tokenizer.input.count('\n'), rate = True)
+		stats.count('tokens', tokenizer.count, rate = True)
+		stats.count('subroutines', engine.subroutine_count)
+		stats.set_max('most class symbols', engine.class_symbol_table.length())
+		stats.set_max('most subroutine symbols', engine.most_symbols)
+		stats.count('VM commands', sum(1 for line in output.getvalue().splitlines() if line[:2] != '//'))
+		stats.count('input bytes', len(tokenizer.input))
+		stats.count('output bytes', len(output.getvalue()))
+
+def _build_stats(parser, args, tool):
+	# A BuildStats of tools/BuildStats.py if the command line asks for
+	# statistics, otherwise None; it is only imported then, so the tool
+	# runs on its own
+	if not args.stats and not args.stats_json:
+		return None
+	sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'tools'))
+	try:
+		import BuildStats
+	except ImportError:
+		parser.error('--stats and --stats-json need tools/BuildStats.py')
+	return BuildStats.BuildStats(tool)
 
 def main(argv):
-	if len(argv) == 1 and os.path.isdir(argv[0]):
-		for file in glob.glob(argv[0] + "/*.jack"):
-			compile_file(file)
-	elif len(argv) == 1 and os.path.splitext(argv[0])[1] == ".jack":
-		compile_file(argv[0])
+	parser = argparse.ArgumentParser(description='Compiles Jack classes into VM code.')
+	parser.add_argument('path', help='<filename>.jack | <directory>')
+	parser.add_argument('--stats', action='store_true', help='report time per phase, sizes and throughput on standard error')
+	parser.add_argument('--stats-json', metavar='FILE', help="write the statistics as JSON to FILE ('-' for standard output)")
+	args = parser.parse_args(argv)
+	stats = _build_stats(parser, args, 'JackCompiler')
+	if os.path.isdir(args.path):
+		for file in glob.glob(args.path + "/*.jack"):
+			compile_file(file, stats)
+	elif os.path.splitext(args.path)[1] == ".jack":
+		compile_file(args.path, stats)
 	else:
-		print("Usage: JackAnalyzer.py <filename>.jack | <directory>")
+		print("Usage: JackCompiler.py <filename>.jack | <directory>")
 		sys.exit(1)
+	if stats:
+		stats.output(args)
 
 if __name__ == '__main__':
     main(sys.argv[1:])
@@ -0,0 +1,88 @@
+import contextlib, json, resource, sys, time
+
+# Statistics of one run of a toolchain entry point (HackAssembler.py,
+# VMTranslator.py, JackAnalyzer.py, JackCompiler.py): wall time per phase,
+# counts such as input and output sizes, and the peak memory use. The
+# functions of the entry points take it as an optional `stats` argument.
+
+class BuildStats:
+
+	def __init__(self, tool):
+		self.tool = tool
+		self.phases = {}
+		self.counts = {}
+		self.rates = []
+		self.start = time.perf_counter()
+		self.end = None
+
+	@contextlib.contextmanager
+	def phase(self, name):
+		# Adds the time spent in the with block to the phase
+		start = time.perf_counter()
+		try:
+			yield
+		finally:
+			self.phases[name] = self.phases.get(name, 0) + time.perf_counter() - start
+
+	def count(self, name, value = 1, rate = False):
+		# Adds to a count; counts with rate=True are also reported per second
+		self.counts[name] = self.counts.get(name, 0) + value
+		if rate and not name in self.rates:
+			self.rates.append(name)
+
+	def set_max(self, name, value):
+		self.counts[name] = max(self.counts.get(name, 0), value)
+
+	def finish(self):
+		self.end = time.perf_counter()
+
+	def wall_time(self):
+		return (self.end or time.perf_counter()) - self.start
+
+	def peak_memory(self):
+		# Peak resident set size of the process in bytes (ru_maxrss is in
+		# kilobytes on Linux and in bytes on macOS)
+		peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+		return peak if sys.platform == 'darwin' else peak * 1024
+
+	def as_dict(self):
+		wall = self.wall_time()
+		return {
+			'tool': self.tool,
+			'wall_time': wall,
+			'phases': dict(self.phases),
+			'counts': dict(self.counts),
+			'rates': {name: self.counts[name] / wall for name in self.rates if wall},
+			'peak_memory': self.peak_memory(),
+		}
+
+	def report(self, file = sys.stderr):
+		data = self.as_dict()
+		wall = data['wall_time']
+		file.write(f'{self.tool}: {wall * 1000:.1f} ms\n')
+		for name, seconds in data['phases'].items():
+			share = 100 * seconds / wall if wall else 0
+			file.write(f'  {name:<24} {seconds * 1000:10.1f} ms {share:5.1f}%\n')
+		for name, value in data['counts'].items():
+			file.write(f'  {name:<24} {value:10}\n')
+		for name, value in data['rates'].items():
+			file.write(f'  {name + "/s":<24} {value:10.0f}\n')
+		file.write(f'  {"peak memory":<24} {data["peak_memory"] / 1048576:10.1f} MB\n')
+
+	def output(self, args):
+		# Finishes the run and reports as the --stats and --stats-json
+		# options of the entry points ask
+		self.finish()
+		if args.stats:
+			self.report()
+		if args.stats_json:
+			self.write_json(args.stats_json)
+
+	def write_json(self, path):
+		# '-' writes to standard output
+		text = json.dumps(self.as_dict(), indent = 2) + '\n'
+		if path == '-':
+			sys.stdout.write(text)
+		else:
+			with open(path, 'w') as file:
+				file.write(text)
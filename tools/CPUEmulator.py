@@ -0,0 +1,467 @@
+#!/usr/bin/python3
+
+import argparse, os, sys, time
+
+# Instruction-level emulator of the Hack computer of projects/05. CPU is
+# the reference model of CPU.hdl, one cycle at a time; Computer runs whole
+# .hack programs as fast as plain Python allows.
+
+PROJECTS = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'projects')
+
+SCREEN = 16384
+KBD = 24576
+
+def _alu_expression(control):
+	# The ALU output for the zx nx zy ny f no bits of a C-instruction, as a
+	# Python expression on x (D) and y (A or M)
+	zx, nx, zy, ny, f, no = [(control >> bit) & 1 for bit in range(5, -1, -1)]
+	x = '0' if zx else 'x'
+	if nx:
+		x = f'({x} ^ 65535)'
+	y = '0' if zy else 'y'
+	if ny:
+		y = f'({y} ^ 65535)'
+	out = f'({x} + {y})' if f else f'({x} & {y})'
+	if no:
+		out = f'({out} ^ 65535)'
+	return f'{out} & 65535'
+
+# All 64 ALU functions, including the ones no mnemonic assembles to
+alu = [eval('lambda x, y: ' + _alu_expression(control)) for control in range(64)]
+
+def _jumps(jump, out):
+	if out & 0x8000:
+		return jump & 4
+	if out == 0:
+		return jump & 2
+	return jump & 1
+
+def assemble(path):
+	# The instruction words of an .asm file, assembled by
+	# projects/06/HackAssembler.py, and the ROM addresses of its labels
+	import io
+	sys.path.insert(0, os.path.join(PROJECTS, '06'))
+	from HackAssembler import CodeWriter, Parser, SymbolTable
+
+	class LabelTable(SymbolTable):
+		def __init__(self):
+			SymbolTable.__init__(self)
+			self.labels = {}
+
+		def register_label(self, label, address):
+			SymbolTable.register_label(self, label, address)
+			self.labels[label] = address
+
+	output = io.StringIO()
+	symbol_table = LabelTable()
+	Parser(CodeWriter(output, symbol_table), symbol_table).parseFile(path)
+	return [int(line, 2) for line in output.getvalue().split()], symbol_table.labels
+
+def translate(directory, os_directory = os.path.join(PROJECTS, '12'), static_frames = False):
+	# The assembly code of the .jack files of a directory, compiled together
+	# with the OS classes it doesn't define itself, and its .vm files, as
+	# translated by projects/08/VMTranslator.py (with static frames if set)
+	import glob, shutil, tempfile
+	sys.path.insert(0, os.path.join(PROJECTS, '08'))
+	sys.path.insert(0, os.path.join(PROJECTS, '11'))
+	from JackCompiler import compile_file
+	from VMTranslator import translate_directory
+
+	build_directory = tempfile.mkdtemp()
+	try:
+		program_directory = os.path.join(build_directory, 'Program')
+		os.mkdir(program_directory)
+		for file in sorted(glob.glob(os.path.join(directory, '*.jack')) + glob.glob(os.path.join(directory, '*.vm'))):
+			shutil.copy(file, program_directory)
+		classes = [os.path.splitext(os.path.basename(file))[0] for file in os.listdir(program_directory)]
+		for file in sorted(glob.glob(os.path.join(os_directory, '*.jack'))):
+			if not os.path.splitext(os.path.basename(file))[0] in classes:
+				shutil.copy(file, program_directory)
+		for file in sorted(glob.glob(os.path.join(program_directory, '*.jack'))):
+			compile_file(file)
+		translate_directory(program_directory, static_frames = static_frames)
+		with open(os.path.join(program_directory, 'Program.asm')) as file:
+			return file.read()
+	finally:
+		shutil.rmtree(build_directory)
+
+def build(directory, os_directory = os.path.join(PROJECTS, '12')):
+	# The instruction words and the labels, like assemble(), of the program
+	# translate() makes of a directory
+	import tempfile
+	descriptor, path = tempfile.mkstemp(suffix = '.asm')
+	try:
+		with os.fdopen(descriptor, 'w') as file:
+			file.write(translate(directory, os_directory))
+		return assemble(path)
+	finally:
+		os.remove(path)
+
+def load_program(path):
+	# Instruction words of a .hack or .asm file, or of a directory of .jack
+	# and .vm files (see build())
+	if os.path.isdir(path):
+		return build(path)[0]
+	if os.path.splitext(path)[1] == '.asm':
+		return assemble(path)[0]
+	with open(path) as file:
+		return [int(line, 2) for line in file.read().split()]
+
+class CPU:
+	# The registers of CPU.hdl. cycle() returns the outputs of the chip for
+	# one instruction and M value, then clocks the registers.
+
+	def __init__(self):
+		self.a = 0
+		self.d = 0
+		self.pc = 0
+
+	def cycle(self, instruction, in_m, reset = 0):
+		# (outM, writeM, addressM, pc); outM is only meaningful if writeM is set
+		a = self.a
+		pc = self.pc
+		out = 0
+		write = 0
+		if instruction & 0x8000:
+			out = alu[(instruction >> 6) & 63](self.d, in_m if instruction & 0x1000 else a)
+			write = (instruction >> 3) & 1
+			if instruction & 0x20:
+				self.a = out
+			if instruction & 0x10:
+				self.d = out
+			self.pc = a & 0x7FFF if _jumps(instruction & 7, out) else (pc + 1) & 0x7FFF
+		else:
+			self.a = instruction
+			self.pc = (pc + 1) & 0x7FFF
+		if reset:
+			self.pc = 0
+		return out, write, a & 0x7FFF, pc
+
+class Computer:
+	# ROM, RAM (with the screen and the keyboard register) and the CPU
+	# registers. C-instructions are decoded once, when the program is loaded.
+
+	def __init__(self, program):
+		if len(program) > 32768:
+			raise Exception(f'Program of {len(program)} instructions does not fit in ROM')
+		self.rom = list(program) + [0] * (32768 - len(program))
+		self.decoded = [self._decode(word) for word in self.rom]
+		self.ram = [0] * 32768
+		self.a = 0
+		self.d = 0
+		self.pc = 0
+		self.cycles = 0
+		self.skipped = 0
+
+	def _decode(self, word):
+		if not word & 0x8000:
+			return None
+		return alu[(word >> 6) & 63], word & 0x1000, (word >> 3) & 7, word & 7
+
+	def run(self, cycles):
+		rom = self.rom
+		decoded = self.decoded
+		ram = self.ram
+		a, d, pc = self.a, self.d, self.pc
+		for cycle in range(cycles):
+			word = rom[pc]
+			if word < 0x8000:
+				a = word
+				pc = (pc + 1) & 0x7FFF
+				continue
+			function, uses_m, dest, jump = decoded[pc]
+			address = a & 0x7FFF
+			out = function(d, ram[address] if uses_m else a)
+			if dest & 1:
+				ram[address] = out
+			if jump and (jump & 4 if out & 0x8000 else jump & 2 if out == 0 else jump & 1):
+				pc = address
+			else:
+				pc = (pc + 1) & 0x7FFF
+			if dest & 4:
+				a = out
+			if dest & 2:
+				d = out
+		self.a, self.d, self.pc = a, d, pc
+		self.cycles += cycles
+
+	def profile(self, cycles, profiler):
+		# Like run(), but counts the executions of every instruction in
+		# profiler.counts and calls profiler.jump(target, cycle, ram) on jumps
+		# to the addresses in profiler.watched. Stops early when that returns
+		# True; returns the number of cycles run.
+		rom = self.rom
+		decoded = self.decoded
+		ram = self.ram
+		counts = profiler.counts
+		watched = profiler.watched
+		base = self.cycles
+		a, d, pc = self.a, self.d, self.pc
+		executed = cycles
+		for cycle in range(cycles):
+			counts[pc] += 1
+			word = rom[pc]
+			if word < 0x8000:
+				a = word
+				pc = (pc + 1) & 0x7FFF
+				continue
+			function, uses_m, dest, jump = decoded[pc]
+			address = a & 0x7FFF
+			out = function(d, ram[address] if uses_m else a)
+			if dest & 1:
+				ram[address] = out
+			if dest & 4:
+				a = out
+			if dest & 2:
+				d = out
+			if jump and (jump & 4 if out & 0x8000 else jump & 2 if out == 0 else jump & 1):
+				pc = address
+				if pc in watched and profiler.jump(pc, base + cycle + 1, ram):
+					executed = cycle + 1
+					break
+			else:
+				pc = (pc + 1) & 0x7FFF
+		self.a, self.d, self.pc = a, d, pc
+		self.cycles += executed
+		return executed
+
+	def run_skipping(self, cycles):
+		# Like run(), but skips ahead over loops that can't end by themselves
+		# or whose end can be computed. Ends in the same state as run() would.
+		# self.skipped counts the cycles that were not executed one by one.
+		end = self.cycles + cycles
+		# Loops that are not counting loops, and when to check again whether
+		# a loop is idle (with the wait before that)
+		failed = set()
+		retry = {}
+		while self.cycles < end:
+			found = self._run_watching(end - self.cycles, failed, retry)
+			if not found:
+				break
+			kind, target = found
+			if kind == 'repeat':
+				if not self._skip_idle_loop(target, end):
+					wait = min(2 * retry[target][1], 1000000) if target in retry else 10000
+					retry[target] = (self.cycles + wait, wait)
+			elif not self._skip_counting_loop(target, end):
+				failed.add(target)
+
+	def _run_watching(self, cycles, failed, retry):
+		# run() that watches the backward jumps. Returns ('repeat', target)
+		# when the machine comes back to a loop within 1000 cycles with the
+		# same D, which it does when the loop is idle, ('loop', target) when
+		# the same loop without nested loops or calls goes around a few times
+		# and is not in failed, or None when the cycles ran out.
+		rom = self.rom
+		decoded = self.decoded
+		ram = self.ram
+		base = self.cycles
+		a, d, pc = self.a, self.d, self.pc
+		visits = {}
+		last_target = None
+		streak = 0
+		found = None
+		executed = cycles
+		for cycle in range(cycles):
+			word = rom[pc]
+			if word < 0x8000:
+				a = word
+				pc = (pc + 1) & 0x7FFF
+				continue
+			function, uses_m, dest, jump = decoded[pc]
+			address = a & 0x7FFF
+			out = function(d, ram[address] if uses_m else a)
+			if dest & 1:
+				ram[address] = out
+			if dest & 4:
+				a = out
+			if dest & 2:
+				d = out
+			if jump and (jump & 4 if out & 0x8000 else jump & 2 if out == 0 else jump & 1):
+				backward = address <= pc
+				pc = address
+				if backward:
+					visit = visits.get(pc)
+					if visit and visit[0] == d and cycle - visit[1] <= 1000 and (not pc in retry or retry[pc][0] <= base + cycle):
+						found = ('repeat', pc)
+					visits[pc] = (d, cycle)
+					if pc == last_target:
+						streak += 1
+						if streak >= 3 and not pc in failed and not found:
+							found = ('loop', pc)
+					else:
+						last_target = pc
+						streak = 0
+					if found:
+						executed = cycle + 1
+						break
+			else:
+				pc = (pc + 1) & 0x7FFF
+		self.a, self.d, self.pc = a, d, pc
+		self.cycles += executed
+		return found
+
+	def _trace(self, target, limit, before = None):
+		# Runs from the current pc until the next jump to target and returns
+		# (pc, address, out) of every instruction executed, or None after
+		# limit cycles. The values the RAM words it writes had before are put
+		# in the before dict.
+		rom = self.rom
+		decoded = self.decoded
+		ram = self.ram
+		a, d, pc = self.a, self.d, self.pc
+		trace = []
+		while True:
+			if len(trace) == limit:
+				trace = None
+				break
+			word = rom[pc]
+			if word < 0x8000:
+				a = word
+				trace.append((pc, None, word))
+				pc = (pc + 1) & 0x7FFF
+				continue
+			function, uses_m, dest, jump = decoded[pc]
+			address = a & 0x7FFF
+			out = function(d, ram[address] if uses_m else a)
+			trace.append((pc, address, out))
+			if dest & 1:
+				if before is not None and not address in before:
+					before[address] = ram[address]
+				ram[address] = out
+			if dest & 4:
+				a = out
+			if dest & 2:
+				d = out
+			if jump and (jump & 4 if out & 0x8000 else jump & 2 if out == 0 else jump & 1):
+				pc = address
+				if pc == target:
+					break
+			else:
+				pc = (pc + 1) & 0x7FFF
+		self.cycles += len(trace) if trace else limit
+		self.a, self.d, self.pc = a, d, pc
+		return trace
+
+	def _skip_idle_loop(self, target, end):
+		# Runs one iteration of the loop at target. If it ends in the state it
+		# started in, the machine stays in this loop until the end (or until
+		# something outside changes the RAM), so the whole iterations up to
+		# the end are skipped. Returns False if the loop is not idle.
+		a, d = self.a, self.d
+		before = {}
+		trace = self._trace(target, min(1000, end - self.cycles), before)
+		if not trace or self.a != a or self.d != d or any(self.ram[address] != value for address, value in before.items()):
+			return False
+		periods = (end - self.cycles) // len(trace)
+		self.cycles += periods * len(trace)
+		self.skipped += periods * len(trace)
+		return True
+
+	def _affine(self, pc):
+		# Whether the ALU function of a C-instruction is x + y, x - y, x + 1,
+		# -x, !x, x, a constant and the like: on values that change by the
+		# same amount every iteration of a loop, it gives such values again.
+		# Only an & of two inputs that are not constant (0 or !0) isn't.
+		control = (self.rom[pc] >> 6) & 63
+		return control & 0x2A
+
+	def _skip_counting_loop(self, target, end):
+		# Runs three iterations of the loop at target. If they take the same
+		# path, compute only affine functions, access the same addresses and
+		# change a, d and the RAM words they write by the same amounts, every
+		# further iteration that takes the same path does too. Its jump
+		# conditions tell how many that are, and those are skipped by adding
+		# the amounts that many times. Returns False if the loop doesn't have
+		# that form.
+		heads = [(self.a, self.d)]
+		traces = []
+		for iteration in range(3):
+			limit = min(1000, end - self.cycles)
+			trace = self._trace(target, limit)
+			if not trace:
+				return limit < 1000
+			traces.append(trace)
+			heads.append((self.a, self.d))
+		first, second, third = traces
+		if len(first) != len(second) or len(second) != len(third):
+			return False
+		writes = [{}, {}, {}]
+		jumps = []
+		for position, (pc, address, out) in enumerate(third):
+			if first[position][0] != pc or second[position][0] != pc:
+				return False
+			if address is None:
+				continue
+			word = self.rom[pc]
+			if not self._affine(pc):
+				return False
+			if (word & 0x1000 or word & 8) and not (first[position][1] == second[position][1] == address):
+				return False
+			if word & 8:
+				for index, trace in enumerate(traces):
+					writes[index][address] = trace[position][2]
+			if word & 7:
+				jumps.append((out, (out - second[position][2]) & 0xFFFF))
+		# Changes from the start of one iteration to the next
+		steps = [[(heads[index + 1][0] - heads[index][0]) & 0xFFFF, (heads[index + 1][1] - heads[index][1]) & 0xFFFF] for index in range(1, 3)]
+		for address in writes[0]:
+			steps[0].append((writes[1][address] - writes[0][address]) & 0xFFFF)
+			steps[1].append((writes[2][address] - writes[1][address]) & 0xFFFF)
+		if steps[0] != steps[1]:
+			return False
+		# Iterations until a jump condition changes
+		count = (end - self.cycles) // len(third)
+		for value, step in jumps:
+			count = min(count, _iterations_same_sign(value, step))
+		if count < 1:
+			return True
+		step = steps[1]
+		self.a = (self.a + count * step[0]) & 0xFFFF
+		self.d = (self.d + count * step[1]) & 0xFFFF
+		for index, address in enumerate(writes[0]):
+			self.ram[address] = (self.ram[address] + count * step[index + 2]) & 0xFFFF
+		self.cycles += count * len(third)
+		self.skipped += count * len(third)
+		return True
+
+def _iterations_same_sign(value, step):
+	# How many times step can be added to the 16-bit value before it
+	# changes from negative to zero to positive, or back
+	value = value - 0x10000 if value & 0x8000 else value
+	step = step - 0x10000 if step & 0x8000 else step
+	if step == 0:
+		return float('inf')
+	if value == 0:
+		return 0
+	if value > 0:
+		return (value - 1) // -step if step < 0 else (32767 - value) // step
+	return (-value - 1) // step if step > 0 else (value + 32768) // -step
+
+def main(argv):
+	parser = argparse.ArgumentParser(description='Runs a .hack or .asm program on an instruction-level emulator of the Hack computer.')
+	parser.add_argument('program', help='.hack or .asm file, or directory of .jack and .vm files to build with the OS')
+	parser.add_argument('--cycles', type=int, default=1000000, help='clock cycles to run the program for')
+	parser.add_argument('--key', type=int, default=0, help='key code the keyboard reports while the program runs')
+	parser.add_argument('--ram', type=int, nargs=2, metavar=('FIRST', 'COUNT'), help='print these RAM words after the run')
+	parser.add_argument('--skip-idle', action='store_true', help='skip ahead over idle and counting loops such as Sys.halt, Sys.wait and keyboard polling')
+	args = parser.parse_args(argv)
+
+	computer = Computer(load_program(args.program))
+	computer.ram[KBD] = args.key
+	start = time.time()
+	if args.skip_idle:
+		computer.run_skipping(args.cycles)
+	else:
+		computer.run(args.cycles)
+	seconds = time.time() - start
+	print(f'{args.cycles} cycles in {seconds:.2f}s: {args.cycles / seconds:.0f} cycles/s')
+	if args.skip_idle:
+		print(f'{computer.skipped} cycles skipped in idle and counting loops')
+	if args.ram:
+		first, count = args.ram
+		for address in range(first, first + count):
+			print(f'RAM[{address}] = {computer.ram[address]}')
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,131 @@
+#!/usr/bin/python3
+
+import argparse, os, random, sys, time
+
+from CPUEmulator import CPU, KBD, PROJECTS, load_program
+from HDLSimulator import ChipLibrary, NetlistCache, Simulator, behavioral_library, default_cache_directory, flatten
+
+# Co-simulation of CPU.hdl against the instruction-level CPU model of
+# CPUEmulator.py. Every lane of the gate-level simulator runs its own
+# program; the harness plays ROM and RAM for both sides. Up to the first
+# divergence both sides fetch the same instruction and read the same M
+# value, so one memory per program serves both, and the outputs are
+# compared every cycle.
+
+PINS = ('outM', 'writeM', 'addressM', 'pc')
+
+class Lane:
+
+	def __init__(self, name, program, key = 0, reset_rate = 0):
+		self.name = name
+		self.program = program
+		self.reset_rate = reset_rate
+		self.ram = {KBD: key}
+		self.cpu = CPU()
+		self.failure = None
+
+	def instruction(self):
+		# The ROM holds the program repeated, so random programs never run
+		# off into empty ROM
+		return self.program[self.cpu.pc % len(self.program)]
+
+def random_program(rng, length):
+	# A- and C-instructions in equal measure. Most A-instructions address a
+	# few RAM words or the program itself, so loads and jumps hit something;
+	# C-instructions use all bits, including comp codes no mnemonic has.
+	program = []
+	for index in range(length):
+		if rng.random() < 0.5:
+			program.append(rng.choice([rng.randrange(16), rng.randrange(length), rng.getrandbits(15)]))
+		else:
+			program.append(0x8000 | rng.getrandbits(15))
+	return program
+
+def _describe(lane, cycle, instruction, in_m, reset, pin, actual, expected):
+	return f'{lane.name}: cycle {cycle}, instruction {instruction:016b}, inM={in_m}, reset={reset}: {pin}={actual}, expected {expected}'
+
+def cosimulate(netlist, lanes, cycles, rng):
+	# Runs all lanes for the given number of cycles. Returns the seconds
+	# spent in the gate-level simulator and in the reference model.
+	simulator = Simulator(netlist, len(lanes))
+	hdl_seconds = 0
+	model_seconds = 0
+	for cycle in range(cycles):
+		start = time.time()
+		instructions = []
+		in_ms = []
+		resets = []
+		expected = []
+		for lane in lanes:
+			instruction = lane.instruction()
+			in_m = lane.ram.get(lane.cpu.a & 0x7FFF, 0)
+			reset = int(lane.reset_rate > 0 and rng.random() < lane.reset_rate)
+			instructions.append(instruction)
+			in_ms.append(in_m)
+			resets.append(reset)
+			expected.append(lane.cpu.cycle(instruction, in_m, reset))
+		model_seconds += time.time() - start
+
+		start = time.time()
+		simulator.set('instruction', instructions)
+		simulator.set('inM', in_ms)
+		simulator.set('reset', resets)
+		simulator.evaluate()
+		actual = list(zip(*[simulator.get(pin) for pin in PINS]))
+		simulator.tick()
+		hdl_seconds += time.time() - start
+
+		for index, lane in enumerate(lanes):
+			if lane.failure:
+				continue
+			for pin, value, reference in zip(PINS, actual[index], expected[index]):
+				if pin == 'outM' and not expected[index][1]:
+					continue
+				if value != reference:
+					lane.failure = (cycle, _describe(lane, cycle, instructions[index], in_ms[index], resets[index], pin, value, reference))
+					break
+			else:
+				out_m, write_m, address_m, pc = expected[index]
+				if write_m:
+					lane.ram[address_m] = out_m
+	return hdl_seconds, model_seconds
+
+def main(argv):
+	parser = argparse.ArgumentParser(description='Runs random and real programs on CPU.hdl and on an instruction-level CPU model at once, comparing outM, writeM, addressM and pc every cycle.')
+	parser.add_argument('programs', nargs='*', default=[os.path.join(PROJECTS, '04', 'fill', 'Fill.asm')], help='.hack or .asm programs to run (default: Fill.asm)')
+	parser.add_argument('--random', type=int, default=256, help='number of random programs')
+	parser.add_argument('--length', type=int, default=256, help='instructions per random program')
+	parser.add_argument('--cycles', type=int, default=1000)
+	parser.add_argument('--reset-rate', type=float, default=0.01, help='chance per cycle that a random program is reset')
+	parser.add_argument('--keys', type=int, nargs='*', default=[0, 65], help='key codes to run every real program with, one lane each')
+	parser.add_argument('--seed', type=int, default=0)
+	parser.add_argument('--cache', default=default_cache_directory(), help='directory of the flattened chip cache')
+	parser.add_argument('--no-cache', action='store_true', help='flatten every chip from its .hdl')
+	parser.add_argument('--behavioral', action='store_true', help='simulate the registers and PC by behavioral models, after checking them against their .hdl once')
+	args = parser.parse_args(argv)
+
+	cache = NetlistCache(args.cache) if not args.no_cache else None
+	library = behavioral_library(['Register', 'PC'], cache = cache) if args.behavioral else ChipLibrary()
+	netlist = flatten(library, 'CPU', cache)
+
+	rng = random.Random(args.seed)
+	lanes = []
+	for path in args.programs:
+		program = load_program(path)
+		for key in args.keys:
+			lanes.append(Lane(f'{os.path.basename(path)} (key {key})', program, key))
+	for index in range(args.random):
+		lanes.append(Lane(f'random program {index}', random_program(rng, args.length), reset_rate = args.reset_rate))
+
+	hdl_seconds, model_seconds = cosimulate(netlist, lanes, args.cycles, rng)
+	total = args.cycles * len(lanes)
+	print(f'{len(lanes)} programs x {args.cycles} cycles on CPU.hdl ({netlist.gate_count()} gates)')
+	print(f'gates: {total / hdl_seconds:.0f} cycles/s, model: {total / model_seconds:.0f} cycles/s')
+	failures = sorted(lane.failure for lane in lanes if lane.failure)
+	if failures:
+		print(f'{len(failures)} programs diverged, first: {failures[0][1]}')
+		sys.exit(1)
+	print('no divergence')
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
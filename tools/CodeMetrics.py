@@ -0,0 +1,159 @@
+#!/usr/bin/python3
+
+import argparse, json, os, re, sys, tempfile
+
+from CPUEmulator import KBD, PROJECTS, Computer, assemble, translate
+from Profiler import Profiler
+
+# Code quality metrics of the VM translator: how many Hack instructions
+# each kind of VM command turns into, in the ROM and in a run of the
+# program.
+#
+# VMTranslator.py writes every VM command as a comment before its code,
+# so each instruction is attributed to the command (push and pop by
+# segment) and the function it was translated from. The shared call,
+# return and tail call routines count as 'call (shared)', 'return
+# (shared)' and 'tail call (shared)'; a tail call itself counts as return.
+
+COMMANDS = ['push', 'pop', 'add', 'sub', 'neg', 'eq', 'gt', 'lt', 'and', 'or', 'not', 'label', 'goto', 'if-goto', 'function', 'call', 'return']
+
+ROUTINES = {'$CALL': 'call (shared)', '$RETURN': 'return (shared)', '$TAILCALL': 'tail call (shared)', '$HALT': '(halt)'}
+
+def annotate(asm):
+	# The (command kind, function) of every instruction of the program, and
+	# the number of VM commands of every kind
+	owners = []
+	commands = {}
+	kind = '(bootstrap)'
+	function = '(bootstrap)'
+	for line in asm.splitlines():
+		line = line.strip()
+		if line.startswith('//'):
+			words = line[2:].split()
+			if words and words[0] in COMMANDS:
+				kind = ' '.join(words[:2]) if words[0] in ('push', 'pop') else words[0]
+				if words[0] == 'function':
+					function = words[1]
+				commands[kind] = commands.get(kind, 0) + 1
+			continue
+		line = re.sub(r'\s', '', re.sub('//.*', '', line))
+		if not line:
+			continue
+		if line[0] == '(':
+			if line[1:-1] in ROUTINES:
+				kind = ROUTINES[line[1:-1]]
+				function = '(shared)'
+			continue
+		owners.append((kind, function))
+	return owners, commands
+
+def measure(asm, run = False, max_cycles = 100000000, key = 0):
+	# {'kinds': {kind: counts}, 'functions': {function: counts}} with the
+	# ROM instructions and, if the program is run, the cycles of each and
+	# 'stack': the most calls running at once and the highest frame
+	descriptor, path = tempfile.mkstemp(suffix = '.asm')
+	try:
+		with os.fdopen(descriptor, 'w') as file:
+			file.write(asm)
+		program, labels = assemble(path)
+	finally:
+		os.remove(path)
+	owners, commands = annotate(asm)
+	if len(owners) != len(program):
+		raise Exception(f'Attributed {len(owners)} instructions, the assembler made {len(program)}')
+	counts = None
+	if run:
+		computer = Computer(program)
+		computer.ram[KBD] = key
+		profiler = Profiler(program, labels)
+		computer.profile(max_cycles, profiler)
+		counts = profiler.counts
+		stack = {'calls': profiler.deepest, 'frame': profiler.highest}
+
+	kinds = {}
+	functions = {}
+	for address, (kind, function) in enumerate(owners):
+		for table, name in ((kinds, kind), (functions, function)):
+			row = table.setdefault(name, {'instructions': 0, 'cycles': 0} if run else {'instructions': 0})
+			row['instructions'] += 1
+			if run:
+				row['cycles'] += counts[address]
+	for kind, row in kinds.items():
+		row['commands'] = commands.get(kind, 0)
+	if run:
+		return {'kinds': kinds, 'functions': functions, 'stack': stack}
+	return {'kinds': kinds, 'functions': functions}
+
+def _total(table, column):
+	return sum(row.get(column, 0) for row in table.values())
+
+def report(metrics, old = None):
+	# Tables by command kind and by function, sorted by name so reports of
+	# two builds line up; with old metrics, the change of every number
+	run = 'cycles' in next(iter(metrics['kinds'].values()))
+	columns = ['instructions', 'cycles'] if run else ['instructions']
+	for table, title in (('kinds', 'VM command'), ('functions', 'function')):
+		rows = metrics[table]
+		old_rows = old[table] if old else {}
+		header = f'{title:<32}' + (f'{"commands":>9} {"size":>5}' if table == 'kinds' else '')
+		for column in columns:
+			header += f' {column:>12} {"%":>6}'
+			if old:
+				header += f' {"change":>10}'
+		print(header)
+		totals = {column: _total(rows, column) for column in columns}
+		for name in sorted(set(rows) | set(old_rows)):
+			row = rows.get(name, {})
+			line = f'{name:<32}'
+			if table == 'kinds':
+				commands = row.get('commands', 0)
+				line += f'{commands:9} {row.get("instructions", 0) / commands if commands else 0:5.1f}'
+			for column in columns:
+				value = row.get(column, 0)
+				line += f' {value:12} {100 * value / totals[column] if totals[column] else 0:6.2f}'
+				if old:
+					line += f' {value - old_rows.get(name, {}).get(column, 0):+10}'
+			print(line)
+		line = f'{"total":<32}' + (' ' * 15 if table == 'kinds' else '')
+		for column in columns:
+			line += f' {totals[column]:12} {100:6.2f}'
+			if old:
+				line += f' {totals[column] - _total(old_rows, column):+10}'
+		print(line)
+		print()
+	if 'stack' in metrics:
+		stack = metrics['stack']
+		line = f'stack: {stack["calls"]} calls deep at most, the highest frame at {stack["frame"]}'
+		if old and 'stack' in old:
+			line += f' ({stack["calls"] - old["stack"]["calls"]:+} calls, {stack["frame"] - old["stack"]["frame"]:+} words)'
+		print(line)
+
+def main(argv):
+	parser = argparse.ArgumentParser(description='Breaks the Hack code of a program down by VM command kind and by function, statically and for a run.')
+	parser.add_argument('program', help='directory of .jack and .vm files to build with the OS, or .asm file written by the VM translator')
+	parser.add_argument('--os', default=os.path.join(PROJECTS, '12'), help='directory with the OS .jack files')
+	parser.add_argument('--run', action='store_true', help='also run the program and count the cycles spent per command kind')
+	parser.add_argument('--max-cycles', type=int, default=100000000, help='stop the run after this many cycles if the program has not ended')
+	parser.add_argument('--key', type=int, default=0, help='key code the keyboard reports while the program runs')
+	parser.add_argument('--static-frames', action='store_true', help='translate with static frames for the functions that are never running twice at once')
+	parser.add_argument('--json', metavar='FILE', help='write the metrics as JSON, to compare another build against')
+	parser.add_argument('--compare', metavar='FILE', help='show the changes against metrics written with --json')
+	args = parser.parse_args(argv)
+
+	if os.path.isdir(args.program):
+		asm = translate(args.program, args.os, args.static_frames)
+	else:
+		with open(args.program) as file:
+			asm = file.read()
+	metrics = measure(asm, args.run, args.max_cycles, args.key)
+	old = None
+	if args.compare:
+		with open(args.compare) as file:
+			old = json.load(file)
+	report(metrics, old)
+	if args.json:
+		with open(args.json, 'w') as file:
+			json.dump(metrics, file, indent = 2, sort_keys = True)
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
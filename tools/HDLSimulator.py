@@ -0,0 +1,1117 @@
+#!/usr/bin/python3
+
+import argparse, hashlib, json, os, random, re, struct, sys, tempfile, time
+from array import array
+from CPUEmulator import load_program
+
+# Gate-level simulator for the .hdl chips of projects/01-05.
+#
+# A chip is flattened into a netlist of Nand gates and DFFs (plus the
+# built-in ROM32K, Screen and Keyboard chips, which have no .hdl), sorted in
+# topological order. Every net holds a Python int with one bit per test
+# vector ("lane"), so one pass over the gates evaluates the whole batch.
+
+PROJECTS = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'projects')
+
+FALSE = 0    # net numbers of the constants
+TRUE = 1
+
+class HDLError(Exception):
+	pass
+
+
+# Parser
+
+class ChipDefinition:
+	def __init__(self, name):
+		self.name = name
+		self.inputs = []     # (pin, width)
+		self.outputs = []
+		self.parts = []      # (chip, [(pin, pin_range, signal, signal_range)])
+
+	def pins(self):
+		return dict(self.inputs + self.outputs)
+
+class HDLParser:
+	token_pattern = re.compile(r'\s+|//[^\n]*|/\*.*?\*/|(\.\.|[A-Za-z_][\w.]*|\d+|[{}()\[\];:,=])', re.S)
+
+	def __init__(self, filename):
+		self.filename = filename
+		with open(filename) as file:
+			text = file.read()
+		self.tokens = []
+		self.lines = []
+		position = 0
+		line = 1
+		while position < len(text):
+			match = self.token_pattern.match(text, position)
+			if not match:
+				raise HDLError(f'{filename}:{line}: unexpected character {text[position]!r}')
+			if match.group(1):
+				self.tokens.append(match.group(1))
+				self.lines.append(line)
+			line += match.group(0).count('\n')
+			position = match.end()
+		self.index = 0
+
+	def _peek(self):
+		return self.tokens[self.index] if self.index < len(self.tokens) else None
+
+	def _next(self, expected = None):
+		token = self._peek()
+		if token is None or (expected is not None and token != expected):
+			line = self.lines[min(self.index, len(self.lines) - 1)]
+			raise HDLError(f'{self.filename}:{line}: expected {expected or "more input"}, found {token}')
+		self.index += 1
+		return token
+
+	def _pin_declarations(self):
+		pins = []
+		while True:
+			name = self._next()
+			width = 1
+			if self._peek() == '[':
+				self._next('[')
+				width = int(self._next())
+				self._next(']')
+			pins.append((name, width))
+			if self._next() == ';':
+				return pins
+
+	def _range(self):
+		if self._peek() != '[':
+			return None
+		self._next('[')
+		low = int(self._next())
+		high = low
+		if self._peek() == '..':
+			self._next('..')
+			high = int(self._next())
+		self._next(']')
+		return (low, high)
+
+	def parse(self):
+		self._next('CHIP')
+		chip = ChipDefinition(self._next())
+		self._next('{')
+		while self._peek() in ('IN', 'OUT'):
+			if self._next() == 'IN':
+				chip.inputs += self._pin_declarations()
+			else:
+				chip.outputs += self._pin_declarations()
+		if self._peek() == 'BUILTIN':
+			raise HDLError(f'{self.filename}: BUILTIN chips are not supported')
+		self._next('PARTS')
+		self._next(':')
+		while self._peek() != '}':
+			name = self._next()
+			self._next('(')
+			connections = []
+			while True:
+				pin = self._next()
+				pin_range = self._range()
+				self._next('=')
+				signal = self._next()
+				signal_range = self._range()
+				connections.append((pin, pin_range, signal, signal_range))
+				if self._next() == ')':
+					break
+			self._next(';')
+			chip.parts.append((name, connections))
+		self._next('}')
+		return chip
+
+
+# Behavioral models of chips. ROM32K, Screen and Keyboard have no .hdl, the
+# others replace their gate-level netlist on request (see ChipLibrary).
+# `combinational` lists the inputs the outputs depend on within the same
+# cycle; the other inputs only matter at the clock.
+
+class Behavior:
+	inputs = []
+	outputs = []
+	combinational = []
+
+	def __init__(self, simulator, pins):
+		self.simulator = simulator
+		self.pins = pins
+
+	def evaluate(self):
+		pass
+
+	def clock(self):
+		pass
+
+class RegisterBehavior(Behavior):
+	inputs = [('in', 16), ('load', 1)]
+	outputs = [('out', 16)]
+
+	def __init__(self, simulator, pins):
+		Behavior.__init__(self, simulator, pins)
+		self.state = [0] * simulator.lanes
+
+	def evaluate(self):
+		self.simulator.scatter(self.pins['out'], self.state)
+
+	def clock(self):
+		loads = self.simulator.gather(self.pins['load'])
+		if any(loads):
+			values = self.simulator.gather(self.pins['in'])
+			self.state = [value if load else state for state, load, value in zip(self.state, loads, values)]
+
+class PCBehavior(RegisterBehavior):
+	inputs = [('in', 16), ('load', 1), ('inc', 1), ('reset', 1)]
+
+	def clock(self):
+		gather = self.simulator.gather
+		resets = gather(self.pins['reset'])
+		loads = gather(self.pins['load'])
+		increments = gather(self.pins['inc'])
+		values = gather(self.pins['in']) if any(loads) else loads
+		self.state = [0 if reset else value if load else (state + 1) & 0xFFFF if inc else state
+			for state, reset, load, inc, value in zip(self.state, resets, loads, increments, values)]
+
+class MemoryBehavior(Behavior):
+	# A RAM of `size` words per lane
+	size = 0
+	combinational = ['address']
+
+	def __init__(self, simulator, pins):
+		Behavior.__init__(self, simulator, pins)
+		self.memory = [array('H', bytes(2 * self.size)) for lane in range(simulator.lanes)]
+
+	def evaluate(self):
+		addresses = self.simulator.gather(self.pins['address'])
+		self.simulator.scatter(self.pins['out'], [memory[address] for memory, address in zip(self.memory, addresses)])
+
+	def clock(self):
+		loads = self.simulator.gather(self.pins['load'])
+		if any(loads):
+			addresses = self.simulator.gather(self.pins['address'])
+			values = self.simulator.gather(self.pins['in'])
+			for memory, load, address, value in zip(self.memory, loads, addresses, values):
+				if load:
+					memory[address] = value
+
+class RAM8(MemoryBehavior):
+	inputs = [('in', 16), ('load', 1), ('address', 3)]
+	outputs = [('out', 16)]
+	size = 8
+
+class RAM64(MemoryBehavior):
+	inputs = [('in', 16), ('load', 1), ('address', 6)]
+	outputs = [('out', 16)]
+	size = 64
+
+class RAM512(MemoryBehavior):
+	inputs = [('in', 16), ('load', 1), ('address', 9)]
+	outputs = [('out', 16)]
+	size = 512
+
+class RAM4K(MemoryBehavior):
+	inputs = [('in', 16), ('load', 1), ('address', 12)]
+	outputs = [('out', 16)]
+	size = 4096
+
+class RAM16K(MemoryBehavior):
+	inputs = [('in', 16), ('load', 1), ('address', 14)]
+	outputs = [('out', 16)]
+	size = 16384
+
+class Screen(MemoryBehavior):
+	inputs = [('in', 16), ('load', 1), ('address', 13)]
+	outputs = [('out', 16)]
+	size = 8192
+
+class ROM32K(MemoryBehavior):
+	inputs = [('address', 15)]
+	outputs = [('out', 16)]
+	size = 32768
+
+	def clock(self):
+		pass
+
+	def load(self, program, lane = None):
+		# Loads a list of instruction words into one lane, or into all of them
+		for index, memory in enumerate(self.memory):
+			if lane is None or index == lane:
+				memory[:len(program)] = array('H', program)
+
+class Keyboard(Behavior):
+	outputs = [('out', 16)]
+
+	def __init__(self, simulator, pins):
+		Behavior.__init__(self, simulator, pins)
+		self.key = 0
+
+	def evaluate(self):
+		self.simulator.scatter(self.pins['out'], self.key)
+
+behaviors = {
+	'Screen': Screen,
+	'ROM32K': ROM32K,
+	'Keyboard': Keyboard,
+	'Register': RegisterBehavior,
+	'PC': PCBehavior,
+	'RAM8': RAM8,
+	'RAM64': RAM64,
+	'RAM512': RAM512,
+	'RAM4K': RAM4K,
+	'RAM16K': RAM16K,
+}
+
+# Chips with .hdl that may be replaced by their behavior
+substitutable = ['Register', 'PC', 'RAM8', 'RAM64', 'RAM512', 'RAM4K', 'RAM16K']
+
+# Built-in chips that are equivalent to a chip of the projects
+aliases = {
+	'ARegister': 'Register',
+	'DRegister': 'Register',
+}
+
+
+class ChipLibrary:
+	def __init__(self, directories = None, behavioral = ()):
+		# behavioral: chips with .hdl that are simulated by their Behavior anyway
+		self.directories = directories or [PROJECTS]
+		self.paths = {}
+		self.definitions = {}
+		self.keys = {}
+		self.behavioral = set(behavioral)
+		for directory in self.directories:
+			for path, subdirectories, files in sorted(os.walk(directory)):
+				for file in sorted(files):
+					name, extension = os.path.splitext(file)
+					if extension == '.hdl' and not name in self.paths:
+						self.paths[name] = os.path.join(path, file)
+
+	def definition(self, name):
+		if not name in self.definitions:
+			if not name in self.paths:
+				raise HDLError('Unknown chip ' + name)
+			self.definitions[name] = HDLParser(self.paths[name]).parse()
+		return self.definitions[name]
+
+	def resolve(self, name):
+		return aliases.get(name, name)
+
+	def key(self, name):
+		# Content hash of a chip's .hdl and those of all chips it uses
+		name = self.resolve(name)
+		if not name in self.keys:
+			digest = hashlib.sha256(f'{CACHE_VERSION} {name}'.encode())
+			if name in ('Nand', 'DFF') or self.is_behavior(name):
+				digest.update(b' builtin')
+			else:
+				with open(self.paths[name], 'rb') as file:
+					digest.update(file.read())
+				for part in sorted({part for part, connections in self.definition(name).parts}):
+					digest.update(self.key(part).encode())
+			self.keys[name] = digest.hexdigest()
+		return self.keys[name]
+
+	def is_behavior(self, name):
+		return name in behaviors and (name in self.behavioral or not name in self.paths)
+
+	def interface(self, name):
+		# (inputs, outputs) of a chip as lists of (pin, width)
+		if name == 'Nand':
+			return [('a', 1), ('b', 1)], [('out', 1)]
+		if name == 'DFF':
+			return [('in', 1)], [('out', 1)]
+		if self.is_behavior(name):
+			return behaviors[name].inputs, behaviors[name].outputs
+		definition = self.definition(name)
+		return definition.inputs, definition.outputs
+
+
+# Elaboration: every chip is flattened once into a Template of Nand gates,
+# DFFs and behavioral parts over local nets, which the chips using it then
+# copy with their own nets. Nets are joined with a union-find as pins get
+# connected; a union always keeps the smaller net as the root.
+
+class Template:
+	# A flattened chip. Nets 0 and 1 are the constants, followed by the nets
+	# of the pins; pin_nets gives the net of every pin bit, inputs first, in
+	# declaration order.
+	def __init__(self):
+		self.net_count = 2
+		self.pin_nets = []
+		self.first_internal = 2
+		self.nands = array('i')     # a, b, out
+		self.dffs = array('i')      # in, out
+		self.parts = []             # (chip, {pin: [nets]})
+
+class TemplateBuilder:
+	def __init__(self):
+		self.parent = array('i', [FALSE, TRUE])
+		self.nands = array('i')
+		self.dffs = array('i')
+		self.parts = []
+
+	def new_nets(self, width):
+		start = len(self.parent)
+		self.parent.extend(range(start, start + width))
+		return list(range(start, start + width))
+
+	def find(self, net):
+		parent = self.parent
+		while parent[net] != net:
+			parent[net] = parent[parent[net]]
+			net = parent[net]
+		return net
+
+	def union(self, a, b):
+		a = self.find(a)
+		b = self.find(b)
+		if a != b:
+			if a < b:
+				a, b = b, a
+			self.parent[a] = b
+
+	def instantiate(self, template, nets):
+		# Copies a template, connecting its pins to the given nets
+		mapping = [FALSE, TRUE] + [-1] * (template.first_internal - 2)
+		for local, net in zip(template.pin_nets, nets):
+			if mapping[local] < 0:
+				mapping[local] = net
+			else:
+				self.union(mapping[local], net)
+		mapping += self.new_nets(template.net_count - template.first_internal)
+		self.nands.extend(map(mapping.__getitem__, template.nands))
+		self.dffs.extend(map(mapping.__getitem__, template.dffs))
+		for chip, pins in template.parts:
+			self.parts.append((chip, {pin: [mapping[net] for net in part_nets] for pin, part_nets in pins.items()}))
+
+	def finish(self, pin_nets):
+		# Numbers the roots densely, in order, so the pins come first
+		parent = self.parent
+		for net in range(len(parent)):
+			parent[net] = parent[parent[net]]
+		numbers = array('i', bytes(4 * len(parent)))
+		count = 0
+		for net in range(len(parent)):
+			if parent[net] == net:
+				numbers[net] = count
+				count += 1
+		number = lambda net: numbers[parent[net]]
+		template = Template()
+		template.net_count = count
+		template.pin_nets = [number(net) for net in pin_nets]
+		template.first_internal = max(template.pin_nets + [TRUE]) + 1
+		template.nands = array('i', map(number, self.nands))
+		template.dffs = array('i', map(number, self.dffs))
+		template.parts = [(chip, {pin: [number(net) for net in nets] for pin, nets in pins.items()}) for chip, pins in self.parts]
+		return template
+
+class Elaborator:
+	def __init__(self, library, cache = None):
+		self.library = library
+		self.cache = cache
+		self.templates = {}
+
+	def template(self, name, path = ()):
+		name = self.library.resolve(name)
+		if not name in self.templates and self.cache and not name in ('Nand', 'DFF'):
+			self.templates[name] = self.cache.load(name, self.library.key(name), 'template')
+		if not self.templates.get(name):
+			if name in path:
+				raise HDLError('Recursive chip ' + name)
+			inputs, outputs = self.library.interface(name)
+			builder = TemplateBuilder()
+			pins = [(pin, builder.new_nets(width)) for pin, width in inputs + outputs]
+			if name == 'Nand':
+				builder.nands.extend(net for pin, nets in pins for net in nets)
+			elif name == 'DFF':
+				builder.dffs.extend(net for pin, nets in pins for net in nets)
+			elif self.library.is_behavior(name):
+				builder.parts.append((name, dict(pins)))
+			else:
+				self._elaborate_definition(builder, self.library.definition(name), dict(pins), path + (name,))
+			self.templates[name] = builder.finish([net for pin, nets in pins for net in nets])
+			if self.cache and not name in ('Nand', 'DFF'):
+				self.cache.store(name, self.library.key(name), self.templates[name])
+		return self.templates[name]
+
+	def _elaborate_definition(self, builder, chip, pins, path):
+		signals = dict(pins)
+		chip_pins = chip.pins()
+		for part, connections in chip.parts:
+			part = self.library.resolve(part)
+			inputs, outputs = self.library.interface(part)
+			widths = dict(inputs + outputs)
+			output_pins = dict(outputs)
+			part_pins = {pin: [FALSE] * width for pin, width in inputs}
+			part_pins.update({pin: builder.new_nets(width) for pin, width in outputs})
+			for pin, pin_range, signal, signal_range in connections:
+				if not pin in widths:
+					raise HDLError(f'{chip.name}: {part} has no pin {pin}')
+				low, high = pin_range or (0, widths[pin] - 1)
+				width = high - low + 1
+				if signal in ('true', 'false'):
+					nets = [TRUE if signal == 'true' else FALSE] * width
+				else:
+					if not signal in signals:
+						if signal_range is not None:
+							raise HDLError(f'{chip.name}: sub bus of internal pin {signal}')
+						signals[signal] = builder.new_nets(width)
+					nets = signals[signal]
+					if signal_range is not None:
+						if not signal in chip_pins:
+							raise HDLError(f'{chip.name}: sub bus of internal pin {signal}')
+						nets = nets[signal_range[0]:signal_range[1] + 1]
+					if len(nets) != width:
+						raise HDLError(f'{chip.name}: width of {signal} does not match {part}.{pin}')
+				if pin in output_pins:
+					for net, part_net in zip(nets, part_pins[pin][low:high + 1]):
+						builder.union(net, part_net)
+				else:
+					part_pins[pin][low:high + 1] = nets
+			template = self.template(part, path)
+			builder.instantiate(template, [net for pin, width in inputs + outputs for net in part_pins[pin]])
+
+
+class Netlist:
+	# A flattened chip ready for simulation. Nets are numbered
+	# 0..net_count - 1, with 0 and 1 the constants. The gates are stored as
+	# three arrays in topological order; `schedule` lists (gates end, part
+	# index or -1), i.e. which behavioral part to evaluate after the gates
+	# up to `end`.
+
+	def __init__(self, name):
+		self.name = name
+		self.net_count = 2
+		self.inputs = []     # (pin, [nets])
+		self.outputs = []
+		self.gates_a = array('i')
+		self.gates_b = array('i')
+		self.gates_out = array('i')
+		self.dffs_in = array('i')
+		self.dffs_out = array('i')
+		self.parts = []      # (chip, {pin: [nets]})
+		self.schedule = []
+
+	def gate_count(self):
+		return len(self.gates_out)
+
+
+def levelize(template, name, inputs, outputs):
+	# Sorts the gates and behavioral parts of a template topologically,
+	# folds constants and removes the gates nothing depends on.
+	net_count = template.net_count
+	nands = array('i', template.nands)
+	dffs = template.dffs
+	parts = template.parts
+	gate_count = len(nands) // 3
+	node_count = gate_count + len(parts)
+	pin_nets = iter(template.pin_nets)
+	inputs = [(pin, [next(pin_nets) for bit in range(width)]) for pin, width in inputs]
+	outputs = [(pin, [next(pin_nets) for bit in range(width)]) for pin, width in outputs]
+
+	# Nodes 0..gate_count - 1 are gates, the rest behavioral parts
+	driver = array('i', [-1]) * net_count
+	node_outputs = [[out] for out in nands[2::3]]
+	node_inputs = [[a, b] for a, b in zip(nands[0::3], nands[1::3])]
+	for chip, pins in parts:
+		node_outputs.append([net for pin, width in behaviors[chip].outputs for net in pins[pin]])
+		node_inputs.append([net for pin in behaviors[chip].combinational for net in pins[pin]])
+	for node, nets in enumerate(node_outputs):
+		for net in nets:
+			driver[net] = node
+
+	# Consumers of every net, as one array with offsets per net
+	offsets = array('i', bytes(4 * (net_count + 1)))
+	waiting = array('i', bytes(4 * node_count))
+	for node, nets in enumerate(node_inputs):
+		for net in nets:
+			if driver[net] >= 0:
+				offsets[net + 1] += 1
+				waiting[node] += 1
+	for net in range(net_count):
+		offsets[net + 1] += offsets[net]
+	consumers = array('i', bytes(4 * offsets[net_count]))
+	filled = array('i', offsets)
+	for node, nets in enumerate(node_inputs):
+		for net in nets:
+			if driver[net] >= 0:
+				consumers[filled[net]] = node
+				filled[net] += 1
+
+	ready_gates = [node for node in range(gate_count) if not waiting[node]]
+	ready_parts = [node for node in range(gate_count, node_count) if not waiting[node]]
+	order = array('i')
+	while ready_gates or ready_parts:
+		# Keep gates together, so that parts split the gate list rarely
+		node = ready_gates.pop() if ready_gates else ready_parts.pop(0)
+		order.append(node)
+		for net in node_outputs[node]:
+			for consumer in consumers[offsets[net]:offsets[net + 1]]:
+				waiting[consumer] -= 1
+				if not waiting[consumer]:
+					(ready_gates if consumer < gate_count else ready_parts).append(consumer)
+	if len(order) < node_count:
+		raise HDLError(f'{name}: combinational loop')
+
+	# Constant folding: Nand(false, x) = true, Nand(true, true) = false.
+	# Undriven nets are false.
+	value = array('i', bytes(4 * net_count))
+	for net in range(net_count):
+		if driver[net] >= 0 or net == TRUE:
+			value[net] = net
+	for net in dffs[1::2]:
+		value[net] = net
+	for pin, nets in inputs:
+		for net in nets:
+			value[net] = net
+	for node in order:
+		if node < gate_count:
+			a = nands[3 * node] = value[nands[3 * node]]
+			b = nands[3 * node + 1] = value[nands[3 * node + 1]]
+			if a == FALSE or b == FALSE:
+				value[nands[3 * node + 2]] = TRUE
+			elif a == TRUE and b == TRUE:
+				value[nands[3 * node + 2]] = FALSE
+
+	# Dead gate removal, from the outputs, DFF inputs and part inputs back
+	live = bytearray(net_count)
+	for pin, nets in outputs:
+		for net in nets:
+			live[value[net]] = 1
+	for net in dffs[0::2]:
+		live[value[net]] = 1
+	for chip, pins in parts:
+		for pin, width in behaviors[chip].inputs:
+			for net in pins[pin]:
+				live[value[net]] = 1
+	kept = array('i')
+	for node in reversed(order):
+		if node < gate_count:
+			out = nands[3 * node + 2]
+			if live[out] and value[out] == out:
+				live[nands[3 * node]] = 1
+				live[nands[3 * node + 1]] = 1
+				kept.append(node)
+		else:
+			kept.append(node)
+	kept.reverse()
+
+	# Renumber the nets densely
+	numbers = array('i', [-1]) * net_count
+	numbers[FALSE] = FALSE
+	numbers[TRUE] = TRUE
+	count = 2
+	def number(net):
+		nonlocal count
+		net = value[net]
+		if numbers[net] < 0:
+			numbers[net] = count
+			count += 1
+		return numbers[net]
+	netlist = Netlist(name)
+	netlist.inputs = [(pin, [number(net) for net in nets]) for pin, nets in inputs]
+	for node in kept:
+		if node < gate_count:
+			netlist.gates_a.append(number(nands[3 * node]))
+			netlist.gates_b.append(number(nands[3 * node + 1]))
+			netlist.gates_out.append(number(nands[3 * node + 2]))
+		else:
+			chip, pins = parts[node - gate_count]
+			netlist.schedule.append((len(netlist.gates_out), len(netlist.parts)))
+			netlist.parts.append((chip, {pin: [number(net) for net in nets] for pin, nets in pins.items()}))
+	netlist.schedule.append((len(netlist.gates_out), -1))
+	for index in range(0, len(dffs), 2):
+		netlist.dffs_in.append(number(dffs[index]))
+		netlist.dffs_out.append(number(dffs[index + 1]))
+	netlist.outputs = [(pin, [number(net) for net in nets]) for pin, nets in outputs]
+	netlist.net_count = count
+	return netlist
+
+def flatten(library, name, cache = None):
+	name = library.resolve(name)
+	if cache:
+		netlist = cache.load(name, library.key(name), 'netlist')
+		if netlist:
+			return netlist
+	inputs, outputs = library.interface(name)
+	netlist = levelize(Elaborator(library, cache).template(name), name, inputs, outputs)
+	if cache:
+		cache.store(name, library.key(name), netlist)
+	return netlist
+
+
+# Cache of templates and netlists, one file per chip and content hash. A
+# file holds a JSON header with the pins and behavioral parts, followed by
+# the int arrays of the gates and DFFs.
+
+CACHE_VERSION = 1
+CACHE_MAGIC = b'HDLCACHE'
+
+def default_cache_directory():
+	return os.path.join(os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache'), 'nand2tetris', 'hdl')
+
+class NetlistCache:
+	arrays = {
+		'template': ['nands', 'dffs'],
+		'netlist': ['gates_a', 'gates_b', 'gates_out', 'dffs_in', 'dffs_out'],
+	}
+	fields = {
+		'template': ['net_count', 'pin_nets', 'first_internal', 'parts'],
+		'netlist': ['name', 'net_count', 'inputs', 'outputs', 'parts', 'schedule'],
+	}
+
+	def __init__(self, directory = None):
+		self.directory = directory or default_cache_directory()
+
+	def _path(self, name, key, kind):
+		return os.path.join(self.directory, f'{name}-{key[:32]}.{kind}')
+
+	def verified(self, name, key):
+		return os.path.exists(self._path(name, key, 'verified'))
+
+	def set_verified(self, name, key):
+		os.makedirs(self.directory, exist_ok = True)
+		open(self._path(name, key, 'verified'), 'w').close()
+
+	def load(self, name, key, kind):
+		try:
+			with open(self._path(name, key, kind), 'rb') as file:
+				data = file.read()
+		except FileNotFoundError:
+			return None
+		if data[:len(CACHE_MAGIC)] != CACHE_MAGIC:
+			return None
+		position = len(CACHE_MAGIC)
+		size, = struct.unpack_from('<I', data, position)
+		position += 4
+		header = json.loads(data[position:position + size])
+		position += size
+		item = Template() if kind == 'template' else Netlist(name)
+		for field in self.fields[kind]:
+			setattr(item, field, header[field])
+		for field in self.arrays[kind]:
+			count, = struct.unpack_from('<I', data, position)
+			position += 4
+			values = array('i')
+			values.frombytes(data[position:position + 4 * count])
+			if sys.byteorder != 'little':
+				values.byteswap()
+			setattr(item, field, values)
+			position += 4 * count
+		if kind == 'netlist':
+			item.schedule = [tuple(entry) for entry in item.schedule]
+		item.parts = [tuple(part) for part in item.parts]
+		return item
+
+	def store(self, name, key, item):
+		kind = 'template' if isinstance(item, Template) else 'netlist'
+		header = json.dumps({field: getattr(item, field) for field in self.fields[kind]}).encode()
+		chunks = [CACHE_MAGIC, struct.pack('<I', len(header)), header]
+		for field in self.arrays[kind]:
+			values = array('i', getattr(item, field))
+			if sys.byteorder != 'little':
+				values.byteswap()
+			chunks += [struct.pack('<I', len(values)), values.tobytes()]
+		os.makedirs(self.directory, exist_ok = True)
+		# Write to a temporary file first, so readers never see half a file
+		handle, temporary = tempfile.mkstemp(dir = self.directory)
+		with os.fdopen(handle, 'wb') as file:
+			file.write(b''.join(chunks))
+		os.replace(temporary, self._path(name, key, kind))
+
+
+# Runs of up to this many gates are compiled to straight-line Python code;
+# compiling longer ones takes longer than it saves.
+COMPILED_GATES = 50000
+
+def _gate_function(gates_a, gates_b, gates_out):
+	# A function evaluating the given gates on a list of net values
+	if len(gates_out) <= COMPILED_GATES:
+		lines = ['def evaluate(v, m):', '\tpass']
+		lines += [f'\tv[{out}] = m ^ (v[{a}] & v[{b}])' for a, b, out in zip(gates_a, gates_b, gates_out)]
+		namespace = {}
+		exec(compile('\n'.join(lines), '<gates>', 'exec'), namespace)
+		return namespace['evaluate']
+	def evaluate(values, mask):
+		for a, b, out in zip(gates_a, gates_b, gates_out):
+			values[out] = mask ^ (values[a] & values[b])
+	return evaluate
+
+class Simulator:
+	# Evaluates a netlist for `lanes` independent test vectors at once. Per
+	# cycle: set the inputs, evaluate(), read the outputs, tick().
+
+	def __init__(self, netlist, lanes = 1):
+		self.netlist = netlist
+		self.lanes = lanes
+		self.mask = (1 << lanes) - 1
+		self.values = [0] * netlist.net_count
+		self.values[TRUE] = self.mask
+		self.inputs = dict(netlist.inputs)
+		self.outputs = dict(netlist.outputs)
+		self.parts = [behaviors[chip](self, pins) for chip, pins in netlist.parts]
+		self.segments = []
+		start = 0
+		for end, part in netlist.schedule:
+			self.segments.append((_gate_function(netlist.gates_a[start:end], netlist.gates_b[start:end], netlist.gates_out[start:end]), self.parts[part] if part >= 0 else None))
+			start = end
+
+	def scatter(self, nets, values):
+		# Sets a bus from one value per lane, or from one value for all lanes
+		if self.lanes == 1 and not isinstance(values, int):
+			values = values[0]
+		if isinstance(values, int):
+			for bit, net in enumerate(nets):
+				self.values[net] = self.mask if values >> bit & 1 else 0
+			return
+		for bit, net in enumerate(nets):
+			self.values[net] = int(''.join('1' if value >> bit & 1 else '0' for value in reversed(values)), 2)
+
+	def gather(self, nets):
+		# The value of a bus in each lane
+		if self.lanes == 1:
+			values = self.values
+			result = 0
+			for bit, net in enumerate(nets):
+				if values[net]:
+					result |= 1 << bit
+			return [result]
+		result = [0] * self.lanes
+		for bit, net in enumerate(nets):
+			lanes = self.values[net]
+			if lanes:
+				weight = 1 << bit
+				bits = bin(lanes)[:1:-1]
+				lane = bits.find('1')
+				while lane >= 0:
+					result[lane] |= weight
+					lane = bits.find('1', lane + 1)
+		return result
+
+	def set(self, pin, values):
+		self.scatter(self.inputs[pin], values)
+
+	def get(self, pin):
+		return self.gather(self.outputs[pin])
+
+	def evaluate(self):
+		values = self.values
+		mask = self.mask
+		for gates, part in self.segments:
+			gates(values, mask)
+			if part:
+				part.evaluate()
+
+	def tick(self):
+		# Clocks the DFFs and the behavioral parts on the evaluated inputs
+		values = self.values
+		latched = [values[net] for net in self.netlist.dffs_in]
+		for part in self.parts:
+			part.clock()
+		for net, value in zip(self.netlist.dffs_out, latched):
+			values[net] = value
+
+	def part(self, chip):
+		# The first behavioral part of the given chip
+		for (name, pins), part in zip(self.netlist.parts, self.parts):
+			if name == chip:
+				return part
+		return None
+
+
+# Reference models of the chips, one lane at a time. Combinational models
+# map the input pin values to the output pin values; sequential models are
+# classes with outputs(inputs) and clock(inputs).
+
+M16 = 0xFFFF
+
+def _alu(x, y, zx, nx, zy, ny, f, no):
+	if zx:
+		x = 0
+	if nx:
+		x ^= M16
+	if zy:
+		y = 0
+	if ny:
+		y ^= M16
+	out = (x + y) & M16 if f else x & y
+	if no:
+		out ^= M16
+	return {'out': out, 'zr': int(out == 0), 'ng': out >> 15}
+
+def _demux(count, value, sel):
+	return {name: value if index == sel else 0 for index, name in enumerate('abcdefgh'[:count])}
+
+combinational = {
+	'Not': lambda i: {'out': 1 - i['in']},
+	'And': lambda i: {'out': i['a'] & i['b']},
+	'Or': lambda i: {'out': i['a'] | i['b']},
+	'Xor': lambda i: {'out': i['a'] ^ i['b']},
+	'Mux': lambda i: {'out': i['b'] if i['sel'] else i['a']},
+	'DMux': lambda i: _demux(2, i['in'], i['sel']),
+	'Not16': lambda i: {'out': i['in'] ^ M16},
+	'And16': lambda i: {'out': i['a'] & i['b']},
+	'Or16': lambda i: {'out': i['a'] | i['b']},
+	'Nand16': lambda i: {'out': (i['a'] & i['b']) ^ M16},
+	'Mux16': lambda i: {'out': i['b'] if i['sel'] else i['a']},
+	'Or8Way': lambda i: {'out': int(i['in'] != 0)},
+	'Mux4Way16': lambda i: {'out': i['abcd'[i['sel']]]},
+	'Mux8Way16': lambda i: {'out': i['abcdefgh'[i['sel']]]},
+	'DMux4Way': lambda i: _demux(4, i['in'], i['sel']),
+	'DMux8Way': lambda i: _demux(8, i['in'], i['sel']),
+	'HalfAdder': lambda i: {'sum': i['a'] ^ i['b'], 'carry': i['a'] & i['b']},
+	'FullAdder': lambda i: {'sum': (i['a'] + i['b'] + i['c']) & 1, 'carry': (i['a'] + i['b'] + i['c']) >> 1},
+	'Add16': lambda i: {'out': (i['a'] + i['b']) & M16},
+	'Inc16': lambda i: {'out': (i['in'] + 1) & M16},
+	'ALU': lambda i: _alu(**i),
+}
+
+class BitModel:
+	def __init__(self):
+		self.state = 0
+
+	def outputs(self, inputs):
+		return {'out': self.state}
+
+	def clock(self, inputs):
+		if inputs['load']:
+			self.state = inputs['in']
+
+class PCModel(BitModel):
+	def clock(self, inputs):
+		if inputs['reset']:
+			self.state = 0
+		elif inputs['load']:
+			self.state = inputs['in']
+		elif inputs['inc']:
+			self.state = (self.state + 1) & M16
+
+class RAMModel:
+	def __init__(self):
+		self.memory = {}
+
+	def outputs(self, inputs):
+		return {'out': self.memory.get(inputs['address'], 0)}
+
+	def clock(self, inputs):
+		if inputs['load']:
+			self.memory[inputs['address']] = inputs['in']
+
+sequential = {
+	'Bit': BitModel,
+	'Register': BitModel,
+	'PC': PCModel,
+	'RAM8': RAMModel,
+	'RAM64': RAMModel,
+	'RAM512': RAMModel,
+	'RAM4K': RAMModel,
+	'RAM16K': RAMModel,
+}
+
+
+# Verification against the reference models
+
+def _random_value(rng, width):
+	mask = (1 << width) - 1
+	return rng.choice([0, 1, mask, mask >> 1, 1 << (width - 1), rng.getrandbits(width), rng.getrandbits(width)]) & mask
+
+def _vectors(rng, inputs, count):
+	# Exhaustive if the inputs have at most 16 bits together. Otherwise all
+	# combinations of the narrow (control) pins, each with random values of
+	# the wide (data) pins.
+	if sum(width for pin, width in inputs) <= 16:
+		vectors = [{}]
+		for pin, width in inputs:
+			vectors = [dict(vector, **{pin: value}) for vector in vectors for value in range(1 << width)]
+		return vectors
+	controls = [(pin, width) for pin, width in inputs if width <= 3]
+	combinations = 1 << sum(width for pin, width in controls)
+	vectors = []
+	for index in range(max(count, combinations) // combinations * combinations):
+		vector = {}
+		shift = 0
+		for pin, width in inputs:
+			if (pin, width) in controls:
+				vector[pin] = (index >> shift) & ((1 << width) - 1)
+				shift += width
+			else:
+				vector[pin] = _random_value(rng, width)
+		vectors.append(vector)
+	return vectors
+
+def _describe(inputs):
+	return ', '.join(f'{pin}={value}' for pin, value in inputs.items())
+
+def _check_combinational(netlist, reference, rng, count):
+	inputs = netlist.inputs
+	vectors = _vectors(rng, [(pin, len(nets)) for pin, nets in inputs], count)
+	simulator = Simulator(netlist, len(vectors))
+	for pin, nets in inputs:
+		simulator.set(pin, [vector[pin] for vector in vectors])
+	simulator.evaluate()
+	actual = {pin: simulator.get(pin) for pin, nets in netlist.outputs}
+	for lane, vector in enumerate(vectors):
+		expected = reference(vector)
+		for pin, value in expected.items():
+			if actual[pin][lane] != value:
+				return len(vectors), f'{_describe(vector)}: {pin}={actual[pin][lane]}, expected {value}'
+	return len(vectors), None
+
+class Stimulus:
+	# Random inputs of a sequential chip for a number of lanes. Each lane
+	# uses a few addresses only, so that reads hit earlier writes.
+	def __init__(self, rng, inputs, count):
+		self.rng = rng
+		self.inputs = inputs
+		self.count = count
+		widths = dict(inputs)
+		self.addresses = [[rng.getrandbits(widths['address']) for index in range(4)] for lane in range(count)] if 'address' in widths else None
+
+	def next(self):
+		rng = self.rng
+		vectors = []
+		for lane in range(self.count):
+			vector = {}
+			for pin, width in self.inputs:
+				if pin == 'address':
+					vector[pin] = rng.choice(self.addresses[lane])
+				elif width == 1:
+					vector[pin] = int(rng.random() < (0.1 if pin == 'reset' else 0.5))
+				else:
+					vector[pin] = _random_value(rng, width)
+			vectors.append(vector)
+		return vectors
+
+	def apply(self, simulator, vectors):
+		for pin, width in self.inputs:
+			simulator.set(pin, [vector[pin] for vector in vectors])
+
+def _check_sequential(netlist, model, rng, count, cycles):
+	stimulus = Stimulus(rng, [(pin, len(nets)) for pin, nets in netlist.inputs], count)
+	simulator = Simulator(netlist, count)
+	models = [model() for lane in range(count)]
+	for cycle in range(cycles):
+		vectors = stimulus.next()
+		stimulus.apply(simulator, vectors)
+		simulator.evaluate()
+		actual = {pin: simulator.get(pin) for pin, nets in netlist.outputs}
+		for lane, vector in enumerate(vectors):
+			expected = models[lane].outputs(vector)
+			for pin, value in expected.items():
+				if actual[pin][lane] != value:
+					return f'cycle {cycle}, {_describe(vector)}: {pin}={actual[pin][lane]}, expected {value}'
+			models[lane].clock(vector)
+		simulator.tick()
+	return None
+
+def _compare(netlist, model, rng, count, cycles):
+	# Runs two netlists of the same chip on the same random inputs
+	stimulus = Stimulus(rng, [(pin, len(nets)) for pin, nets in netlist.inputs], count)
+	simulators = [Simulator(netlist, count), Simulator(model, count)]
+	for cycle in range(cycles):
+		vectors = stimulus.next()
+		results = []
+		for simulator in simulators:
+			stimulus.apply(simulator, vectors)
+			simulator.evaluate()
+			results.append({pin: simulator.get(pin) for pin, nets in netlist.outputs})
+			simulator.tick()
+		for pin in results[0]:
+			for lane, (actual, expected) in enumerate(zip(results[1][pin], results[0][pin])):
+				if actual != expected:
+					return f'cycle {cycle}, {_describe(vectors[lane])}: {pin}={actual}, gates give {expected}'
+	return None
+
+def verify_behavior(name, directories = None, cache = None, count = 64, cycles = 64, seed = 0):
+	# Randomized equivalence check of a chip's behavior against its
+	# gate-level netlist. A passing check is recorded in the cache, so every
+	# version of a chip is checked once.
+	library = ChipLibrary(directories)
+	key = library.key(name)
+	if cache and cache.verified(name, key):
+		return
+	failure = _compare(flatten(library, name, cache), flatten(ChipLibrary(directories, [name]), name), random.Random(seed), count, cycles)
+	if failure:
+		raise HDLError(f'The {name} behavior does not match {name}.hdl: {failure}')
+	if cache:
+		cache.set_verified(name, key)
+
+def behavioral_library(names, directories = None, cache = None):
+	# A library simulating the given chips by their verified behaviors
+	for name in names:
+		if not name in substitutable:
+			raise HDLError(f'No behavior for {name}')
+		verify_behavior(name, directories, cache)
+	return ChipLibrary(directories, names)
+
+def check(library, names, count, cycles, seed, cache = None):
+	failures = 0
+	for name in names:
+		if not name in combinational and not name in sequential:
+			print(f'{name}: not checked')
+			continue
+		start = time.time()
+		netlist = flatten(library, name, cache)
+		rng = random.Random(seed)
+		if name in combinational:
+			vectors, failure = _check_combinational(netlist, combinational[name], rng, count)
+			checked = f'{vectors} vectors'
+		else:
+			failure = _check_sequential(netlist, sequential[name], rng, count, cycles)
+			checked = f'{count} vectors x {cycles} cycles'
+		if failure:
+			failures += 1
+			print(f'{name}: FAILED: {failure}')
+		else:
+			print(f'{name}: ok ({checked}, {netlist.gate_count()} gates, {len(netlist.dffs_out)} DFFs, {time.time() - start:.2f}s)')
+	return failures == 0
+
+def run_computer(library, program, cycles, lanes = 1, key = 0, cache = None):
+	# Runs a program on Computer.hdl, starting with a reset cycle
+	simulator = Simulator(flatten(library, 'Computer', cache), lanes)
+	simulator.part('ROM32K').load(program)
+	simulator.part('Keyboard').key = key
+	simulator.set('reset', 1)
+	simulator.evaluate()
+	simulator.tick()
+	simulator.set('reset', 0)
+	for cycle in range(cycles):
+		simulator.evaluate()
+		simulator.tick()
+	return simulator
+
+def main(argv):
+	parser = argparse.ArgumentParser(description='Checks the .hdl chips against reference models on a batched gate-level simulator, or runs a program on Computer.hdl.')
+	parser.add_argument('chips', nargs='*', help='chips to check (default: all in projects/01-05)')
+	parser.add_argument('--vectors', type=int, default=4096, help='test vectors per chip, simulated at once')
+	parser.add_argument('--cycles', type=int, default=32, help='clock cycles per test vector of sequential chips')
+	parser.add_argument('--seed', type=int, default=0)
+	parser.add_argument('--cache', default=default_cache_directory(), help='directory of the flattened chip cache')
+	parser.add_argument('--no-cache', action='store_true', help='flatten every chip from its .hdl')
+	parser.add_argument('--behavioral', nargs='*', metavar='CHIP', help='simulate these chips (default: ' + ', '.join(substitutable) + ') by behavioral models, after checking them against their .hdl once')
+	parser.add_argument('--run', metavar='PROGRAM', help='run a .hack or .asm program on Computer.hdl instead of checking chips')
+	parser.add_argument('--run-cycles', type=int, default=100000, help='clock cycles to run the program for')
+	parser.add_argument('--lanes', type=int, default=1, help='computers to run the program on at once')
+	parser.add_argument('--key', type=int, default=0, help='key code the keyboard reports while the program runs')
+	args = parser.parse_args(argv)
+
+	cache = NetlistCache(args.cache) if not args.no_cache else None
+	if args.behavioral is not None:
+		library = behavioral_library(args.behavioral or substitutable, cache = cache)
+	else:
+		library = ChipLibrary()
+	if args.run:
+		program = load_program(args.run)
+		flatten(library, 'Computer', cache)
+		start = time.time()
+		simulator = run_computer(library, program, args.run_cycles, args.lanes, args.key, cache)
+		seconds = time.time() - start
+		screen = simulator.part('Screen').memory[0]
+		print(f'{args.run_cycles} cycles x {args.lanes} lanes in {seconds:.2f}s: {args.run_cycles * args.lanes / seconds:.0f} cycles/s')
+		print(f'{sum(1 for word in screen if word)} non-zero screen words')
+		return
+	names = [os.path.splitext(os.path.basename(chip))[0] for chip in args.chips] or sorted(library.paths)
+	if not check(library, names, args.vectors, args.cycles, args.seed, cache):
+		sys.exit(1)
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
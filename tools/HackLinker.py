@@ -0,0 +1,173 @@
+#!/usr/bin/python3
+
+import argparse, glob, hashlib, io, json, os, sys, tempfile, time
+
+from CPUEmulator import PROJECTS
+
+sys.path.insert(0, os.path.join(PROJECTS, '06'))
+sys.path.insert(0, os.path.join(PROJECTS, '08'))
+sys.path.insert(0, os.path.join(PROJECTS, '10'))
+sys.path.insert(0, os.path.join(PROJECTS, '11'))
+import HackAssembler, JackCompiler, JackParser, VMTranslator
+
+# Linker for the relocatable objects HackAssembler.py writes with --object.
+#
+# An object holds the code words of one module, the addresses of its
+# labels relative to the start of the module, the words holding such an
+# address (relocations) and the words referring to symbols it doesn't
+# define (references). Linking places the modules one after the other,
+# adds the start of its module to every relocated word and fills in every
+# reference with the label of another module of that name. The remaining
+# symbols are variables, allocated from address 16 in the order they are
+# first used, just like the assembler does for a single .asm file: linking
+# the objects of some .asm files gives the same words as assembling them
+# joined into one file.
+#
+# build() uses this to link a Jack program with objects of the OS classes
+# that are compiled, translated and assembled once and then kept in a
+# cache, keyed by the contents of the class and of the toolchain.
+
+def assemble_object(asm):
+	# The object of the assembly code of one module
+	symbol_table = HackAssembler.SymbolTable()
+	writer = HackAssembler.ObjectWriter(symbol_table)
+	HackAssembler.Parser(writer, symbol_table).parse_lines(asm.splitlines())
+	return writer.object()
+
+def load_object(path):
+	with open(path) as file:
+		module = json.load(file)
+	if module.get('format') != 'hack-object' or module.get('version') != HackAssembler.OBJECT_VERSION:
+		raise Exception(f'{path} is not a Hack object of version {HackAssembler.OBJECT_VERSION}')
+	return module
+
+def link(modules):
+	# The instruction words of the linked modules and the addresses of all
+	# labels
+	labels = {}
+	starts = []
+	size = 0
+	for module in modules:
+		starts.append(size)
+		for label, address in module['labels'].items():
+			if label in labels:
+				raise Exception(f'Label {label} is defined by two modules')
+			labels[label] = size + address
+		size += len(module['code'])
+	if size > 32768:
+		raise Exception(f'The program has {size} instructions, the ROM only 32768')
+
+	words = []
+	variables = {}
+	for module, start in zip(modules, starts):
+		code = list(module['code'])
+		for address in module['relocations']:
+			code[address] += start
+		uses = sorted((address, symbol) for symbol, addresses in module['references'].items() for address in addresses)
+		for address, symbol in uses:
+			if symbol in labels:
+				code[address] = labels[symbol]
+			else:
+				if not symbol in variables:
+					variables[symbol] = 16 + len(variables)
+				code[address] = variables[symbol]
+		words += code
+	return words, labels
+
+def translate_module(name, vm):
+	# The assembly code of one .vm file of a program, using the shared call
+	# and return routines of the bootstrap module
+	output = io.StringIO()
+	writer = VMTranslator.CodeWriter(output)
+	writer.shared_routines = True
+	writer.write_comment('file ' + name)
+	VMTranslator.Parser(writer).parse_lines(name, vm.splitlines())
+	return output.getvalue()
+
+def bootstrap_module():
+	# SP = 256, call Sys.init and the shared call and return routines
+	output = io.StringIO()
+	VMTranslator.CodeWriter(output).write_init()
+	return assemble_object(output.getvalue())
+
+def compile_module(name, jack):
+	output = io.StringIO()
+	JackCompiler.CompilationEngine(JackCompiler.JackTokenizer(None, jack), output).compile()
+	return assemble_object(translate_module(name + '.vm', output.getvalue()))
+
+def default_cache_directory():
+	return os.path.join(os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache'), 'nand2tetris', 'obj')
+
+class ObjectCache:
+	# Objects of Jack classes, one file per class and content hash
+
+	def __init__(self, directory = None):
+		self.directory = directory or default_cache_directory()
+		digest = hashlib.sha256(str(HackAssembler.OBJECT_VERSION).encode())
+		for module in (JackParser, JackCompiler, VMTranslator, HackAssembler):
+			with open(module.__file__, 'rb') as file:
+				digest.update(file.read())
+		self.toolchain = digest.digest()
+
+	def module(self, path):
+		# The object of a .jack file, from the cache if it was built before
+		name = os.path.splitext(os.path.basename(path))[0]
+		with open(path) as file:
+			jack = file.read()
+		key = hashlib.sha256(self.toolchain + jack.encode()).hexdigest()
+		cached = os.path.join(self.directory, f'{name}-{key[:32]}.hobj')
+		try:
+			return load_object(cached)
+		except (FileNotFoundError, ValueError):
+			pass
+		module = compile_module(name, jack)
+		os.makedirs(self.directory, exist_ok = True)
+		# Write to a temporary file first, so readers never see half a file
+		handle, temporary = tempfile.mkstemp(dir = self.directory)
+		with os.fdopen(handle, 'w') as file:
+			json.dump(module, file)
+		os.replace(temporary, cached)
+		return module
+
+def build(directory, os_directory = os.path.join(PROJECTS, '12'), cache = None):
+	# The instruction words and labels of the .jack and .vm files of a
+	# directory, linked with the bootstrap code and the objects of the OS
+	# classes it doesn't define itself
+	modules = [bootstrap_module()]
+	classes = set()
+	for path in sorted(glob.glob(os.path.join(directory, '*.jack')) + glob.glob(os.path.join(directory, '*.vm'))):
+		name, extension = os.path.splitext(os.path.basename(path))
+		classes.add(name)
+		with open(path) as file:
+			source = file.read()
+		if extension == '.jack':
+			modules.append(compile_module(name, source))
+		else:
+			modules.append(assemble_object(translate_module(name + '.vm', source)))
+	cache = cache or ObjectCache()
+	for path in sorted(glob.glob(os.path.join(os_directory, '*.jack'))):
+		if not os.path.splitext(os.path.basename(path))[0] in classes:
+			modules.append(cache.module(path))
+	return link(modules)
+
+def main(argv):
+	parser = argparse.ArgumentParser(description='Links relocatable Hack objects into a .hack file, or builds a Jack program from a directory with cached OS objects.')
+	parser.add_argument('inputs', nargs='+', help='.hobj files written by HackAssembler.py --object, or one directory of .jack and .vm files')
+	parser.add_argument('-o', '--output', help='.hack file to write (default: the first input with .hack)')
+	parser.add_argument('--os', default=os.path.join(PROJECTS, '12'), help='directory with the OS .jack files')
+	parser.add_argument('--cache', help='directory of the OS objects (default: ~/.cache/nand2tetris/obj)')
+	args = parser.parse_args(argv)
+
+	start = time.time()
+	if os.path.isdir(args.inputs[0]):
+		words, labels = build(args.inputs[0], args.os, ObjectCache(args.cache))
+		output = args.output or os.path.join(args.inputs[0], os.path.basename(os.path.normpath(args.inputs[0])) + '.hack')
+	else:
+		words, labels = link([load_object(path) for path in args.inputs])
+		output = args.output or os.path.splitext(args.inputs[0])[0] + '.hack'
+	with open(output, 'w') as file:
+		file.write(''.join(f'{word:016b}\n' for word in words))
+	print(f'{output}: {len(words)} instructions, linked in {time.time() - start:.3f}s')
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,271 @@
+#!/usr/bin/python3
+
+import argparse, glob, hashlib, json, multiprocessing, os, shutil, sys, tempfile
+from array import array
+
+from CPUEmulator import KBD, PROJECTS, SCREEN, Computer, assemble, build, load_program
+
+# Headless runs of interactive Jack programs: a script of timed key events
+# is fed into the keyboard register while the program runs on the Hack
+# emulator (times in cycles) or on the VM emulator (times in VM steps).
+#
+# A script has one event per line; lines starting with '#' are comments:
+#   5000000 press a       hold down a key (a character, a key code or a
+#                         name: newline, backspace, left, up, right, down,
+#                         home, end, pageup, pagedown, insert, delete, esc,
+#                         f1 to f12, space)
+#   +200000 release       let go of the key, 200000 after the last event
+#   +1000000 type 42\n    press and release every character of the text
+#                         in turn, each held down for --hold and followed
+#                         by --gap before the next (\n is newline, \b
+#                         backspace, \\ a backslash)
+#
+# --record writes the run to a session file: the program (relative to the
+# session file) with a hash of its build, the emulator, the key events with
+# their exact times and a hash of the screen and of the RAM at every event
+# and at the end. --replay runs session files again, in parallel, and fails
+# if the program changed or any hash differs.
+
+KEYS = {
+	'newline': 128, 'backspace': 129, 'left': 130, 'up': 131, 'right': 132, 'down': 133,
+	'home': 134, 'end': 135, 'pageup': 136, 'pagedown': 137, 'insert': 138, 'delete': 139,
+	'esc': 140, 'space': 32,
+}
+KEYS.update({f'f{number}': 140 + number for number in range(1, 13)})
+
+ESCAPES = {'n': 128, 'b': 129, '\\': ord('\\')}
+
+SESSION_VERSION = 2
+
+def key_code(name):
+	if name.lower() in KEYS:
+		return KEYS[name.lower()]
+	if len(name) == 1:
+		return ord(name)
+	if name.isdigit():
+		return int(name)
+	raise Exception(f'Unknown key {name}')
+
+def _text_codes(text):
+	codes = []
+	index = 0
+	while index < len(text):
+		if text[index] == '\\' and index + 1 < len(text) and text[index + 1] in ESCAPES:
+			codes.append(ESCAPES[text[index + 1]])
+			index += 2
+		else:
+			codes.append(ord(text[index]))
+			index += 1
+	return codes
+
+def parse_script(text, hold = 100000, gap = 100000):
+	# The (time, key code) events of a script, in order of time; key code 0
+	# is no key pressed
+	events = []
+	time = 0
+	for number, line in enumerate(text.splitlines(), 1):
+		line = line.strip()
+		if not line or line[0] == '#':
+			continue
+		words = line.split(None, 2)
+		if len(words) < 2:
+			raise Exception(f'Line {number}: expected a time and an action')
+		time = time + int(words[0][1:]) if words[0][0] == '+' else int(words[0])
+		action = words[1]
+		if action == 'press' and len(words) == 3:
+			events.append((time, key_code(words[2])))
+		elif action == 'release' and len(words) == 2:
+			events.append((time, 0))
+		elif action == 'type' and len(words) == 3:
+			for code in _text_codes(words[2]):
+				events.append((time, code))
+				events.append((time + hold, 0))
+				time += hold + gap
+			time -= gap
+		else:
+			raise Exception(f'Line {number}: unknown action {line}')
+	events.sort(key = lambda event: event[0])
+	return events
+
+def _halt_ranges(labels):
+	# The ROM ranges a program only runs in once it halted: the loop of the
+	# bootstrap code after Sys.init returns, and Sys.halt
+	ranges = []
+	if '$HALT' in labels:
+		ranges.append((labels['$HALT'], labels['$HALT'] + 2))
+	if 'Sys.halt' in labels:
+		start = labels['Sys.halt']
+		end = min([address for name, address in labels.items() if address > start and not name.startswith('Sys.halt$')], default = 32768)
+		ranges.append((start, end))
+	return ranges
+
+class HackMachine:
+	# A program on the Hack emulator; time is in cycles, idle loops are
+	# skipped. Halting is only detected in programs with labels, that is
+	# not in .hack files.
+
+	def __init__(self, program):
+		if os.path.isdir(program):
+			words, labels = build(program)
+		elif os.path.splitext(program)[1] == '.asm':
+			words, labels = assemble(program)
+		else:
+			words, labels = load_program(program), {}
+		self.digest = hashlib.sha256(array('H', words).tobytes()).hexdigest()
+		self.halts = _halt_ranges(labels)
+		self.computer = Computer(words)
+		self.ram = self.computer.ram
+
+	def time(self):
+		return self.computer.cycles
+
+	def halted(self):
+		return any(start <= self.computer.pc < end for start, end in self.halts)
+
+	def run(self, time):
+		# Runs until the given time; returns False if the program halted
+		if not self.halted():
+			self.computer.run_skipping(time - self.computer.cycles)
+		return not self.halted()
+
+class VMMachine:
+	# A .vm file or a directory of .jack and .vm files on the VM emulator,
+	# with the OS classes of projects/12 it doesn't define itself, like
+	# CPUEmulator.translate() builds them; time is in steps
+
+	def __init__(self, program, os_directory = os.path.join(PROJECTS, '12')):
+		import VMEmulator
+		sys.path.insert(0, os.path.join(PROJECTS, '11'))
+		from JackCompiler import compile_file
+
+		if os.path.isdir(program):
+			files = glob.glob(os.path.join(program, '*.jack')) + glob.glob(os.path.join(program, '*.vm'))
+		elif os.path.splitext(program)[1] == '.vm':
+			files = [program]
+		else:
+			raise Exception(f'{program} is neither a .vm file nor a directory')
+		if not files:
+			raise Exception(f'No .jack or .vm files in {program}')
+		build_directory = tempfile.mkdtemp()
+		try:
+			for file in files:
+				shutil.copy(file, build_directory)
+			classes = [os.path.splitext(os.path.basename(file))[0] for file in files]
+			for file in glob.glob(os.path.join(os_directory, '*.jack')):
+				if not os.path.splitext(os.path.basename(file))[0] in classes:
+					shutil.copy(file, build_directory)
+			for file in glob.glob(os.path.join(build_directory, '*.jack')):
+				compile_file(file)
+			digest = hashlib.sha256()
+			for file in sorted(glob.glob(os.path.join(build_directory, '*.vm'))):
+				with open(file, 'rb') as vm_file:
+					digest.update(os.path.basename(file).encode() + b'\0' + vm_file.read())
+			self.digest = digest.hexdigest()
+			self.vm = VMEmulator.VMEmulator(VMEmulator.load_program(build_directory))
+		finally:
+			shutil.rmtree(build_directory)
+		self.ram = self.vm.ram
+
+	def time(self):
+		return self.vm.steps
+
+	def run(self, time):
+		return not self.vm.run(time - self.vm.steps)
+
+def _hashes(ram):
+	return {
+		'screen': hashlib.sha256(array('H', ram[SCREEN:KBD]).tobytes()).hexdigest(),
+		'ram': hashlib.sha256(array('H', ram).tobytes()).hexdigest(),
+	}
+
+def play(machine, events, time):
+	# Runs the machine until the given time, pressing and releasing keys as
+	# the events say. Returns the events that took place (before the end or
+	# a halt) with the hashes of the state just before each, and the hashes
+	# at the end.
+	played = []
+	running = True
+	for event_time, key in events:
+		if event_time >= time:
+			break
+		running = machine.run(event_time)
+		if not running:
+			break
+		played.append({'time': event_time, 'key': key, **_hashes(machine.ram)})
+		machine.ram[KBD] = key
+	if running and machine.time() < time:
+		machine.run(time)
+	return played, {'time': machine.time(), **_hashes(machine.ram)}
+
+def _machine(program, emulator):
+	return VMMachine(program) if emulator == 'vm' else HackMachine(program)
+
+def record(program, emulator, events, time, path):
+	# The program is stored relative to the session file, so sessions can be
+	# replayed from another checkout
+	machine = _machine(program, emulator)
+	played, end = play(machine, events, time)
+	relative = os.path.relpath(os.path.abspath(program), os.path.dirname(os.path.abspath(path)))
+	session = {'version': SESSION_VERSION, 'program': relative, 'program hash': machine.digest, 'emulator': emulator, 'events': played, 'end': end}
+	with open(path, 'w') as file:
+		json.dump(session, file, indent = 1)
+	return session
+
+def replay(path):
+	# None if the session plays out the same again, otherwise what differs
+	with open(path) as file:
+		session = json.load(file)
+	if session.get('version') != SESSION_VERSION:
+		return f'{path}: not a session file of version {SESSION_VERSION}'
+	program = os.path.join(os.path.dirname(os.path.abspath(path)), session['program'])
+	if not os.path.exists(program):
+		return f'{path}: the program {program} does not exist'
+	machine = _machine(program, session['emulator'])
+	if machine.digest != session['program hash']:
+		return f'{path}: the program {session["program"]} changed since the session was recorded'
+	events = [(event['time'], event['key']) for event in session['events']]
+	played, end = play(machine, events, session['end']['time'])
+	for expected, actual in zip(session['events'] + [session['end']], played + [end]):
+		for what in ('time', 'screen', 'ram'):
+			if expected[what] != actual[what]:
+				return f'{path}: the {what} differs at time {expected["time"]}'
+	if len(played) != len(session['events']):
+		return f'{path}: {len(played)} of {len(session["events"])} key events took place'
+	return None
+
+def main(argv):
+	parser = argparse.ArgumentParser(description='Runs an interactive Hack or VM program headless, feeding it key events from a script, and records or replays such runs.')
+	parser.add_argument('program', nargs='?', help='.hack or .asm file, or .vm file or directory of .jack and .vm files, built with the OS (--vm for the VM emulator)')
+	parser.add_argument('--script', metavar='FILE', help='key events to feed the program')
+	parser.add_argument('--vm', action='store_true', help='run on the VM emulator; times are in VM steps instead of cycles')
+	parser.add_argument('--time', type=int, default=100000000, help='cycles (or steps) to run the program for')
+	parser.add_argument('--hold', type=int, default=100000, help='how long type holds down each key')
+	parser.add_argument('--gap', type=int, default=100000, help='time between the keys type presses')
+	parser.add_argument('--record', metavar='SESSION', help='write the run to this session file')
+	parser.add_argument('--replay', nargs='+', metavar='SESSION', help='replay these session files and check that they play out the same')
+	parser.add_argument('--jobs', type=int, default=os.cpu_count(), help='sessions to replay at once')
+	args = parser.parse_args(argv)
+
+	if args.replay:
+		with multiprocessing.Pool(args.jobs) as pool:
+			failures = [failure for failure in pool.map(replay, args.replay) if failure]
+		for failure in failures:
+			print(failure)
+		print(f'{len(args.replay) - len(failures)} of {len(args.replay)} sessions replayed the same')
+		sys.exit(1 if failures else 0)
+	if not args.program:
+		parser.error('a program or --replay is required')
+	events = []
+	if args.script:
+		with open(args.script) as file:
+			events = parse_script(file.read(), args.hold, args.gap)
+	emulator = 'vm' if args.vm else 'hack'
+	if args.record:
+		session = record(args.program, emulator, events, args.time, args.record)
+		played, end = session['events'], session['end']
+	else:
+		played, end = play(_machine(args.program, emulator), events, args.time)
+	print(f'{len(played)} of {len(events)} key events, ended at {end["time"]}, screen {end["screen"][:16]}')
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,345 @@
+#!/usr/bin/python3
+
+import argparse, glob, os, random, shutil, sys, tempfile
+
+# Native Python replacements for the hottest projects/12 OS functions.
+#
+# Each native takes the machine it runs on and the (unsigned 16-bit) call
+# arguments, and returns the (unsigned 16-bit) result. A machine provides
+# `ram`, a list of 32K unsigned 16-bit words, and `static_address(name)`,
+# which maps a VM static such as 'Memory.1' to its RAM address. Natives
+# must have exactly the same effect on RAM as the Jack version they
+# replace; run this file to check that they do.
+
+class Halt(Exception):
+	pass
+
+class SysError(Exception):
+	# Raised by a native where its Jack version calls Sys.error; the
+	# machine makes that call instead, which prints ERR<code> and halts
+	def __init__(self, code):
+		Exception.__init__(self, f'Sys.error({code})')
+		self.code = code
+
+def to_signed(value):
+	return value - 0x10000 if value & 0x8000 else value
+
+def _divide_positive(x, y):
+	if y > x or y < 0:
+		return 0
+	if y == 0:
+		# Math.dividePositive calls Sys.error(3)
+		raise SysError(3)
+	return x // y
+
+def _divide(x, y):
+	# Signed 16-bit division as done by Math.divide
+	if x < 0:
+		if y < 0:
+			return _divide_positive(to_signed(-x & 0xFFFF), to_signed(-y & 0xFFFF))
+		else:
+			return -_divide_positive(to_signed(-x & 0xFFFF), y)
+	else:
+		if y < 0:
+			return -_divide_positive(x, to_signed(-y & 0xFFFF))
+		else:
+			return _divide_positive(x, y)
+
+def math_multiply(machine, x, y):
+	return (x * y) & 0xFFFF
+
+def math_divide(machine, x, y):
+	return _divide(to_signed(x), to_signed(y)) & 0xFFFF
+
+def math_sqrt(machine, x):
+	x = to_signed(x)
+	y = 0
+	for i in range(7, -1, -1):
+		j = y + (1 << i)
+		square = to_signed((j * j) & 0xFFFF)
+		if not square > x and square > 0:
+			y = j
+	return y
+
+def math_abs(machine, x):
+	return -x & 0xFFFF if x & 0x8000 else x
+
+def math_min(machine, a, b):
+	return a if to_signed(a) < to_signed(b) else b
+
+def math_max(machine, a, b):
+	return a if to_signed(a) > to_signed(b) else b
+
+def memory_peek(machine, address):
+	return machine.ram[address]
+
+def memory_poke(machine, address, value):
+	machine.ram[address] = value
+	return 0
+
+# Heap blocks start and end with their size, negated while allocated. Free
+# blocks are kept in 8 doubly linked lists by size class (see Memory.jack).
+
+def _size_class(size):
+	bin = 0
+	limit = 8
+	while bin < 7 and not size < limit:
+		bin += 1
+		limit += limit
+	return bin
+
+def _release(ram, bins, block, size):
+	ram[block] = size
+	ram[block + size - 1] = size
+	bin = bins + _size_class(size)
+	first = ram[bin]
+	ram[block + 1] = first
+	ram[block + 2] = 0
+	if to_signed(first) > 0:
+		ram[first + 2] = block
+	ram[bin] = block
+
+def _unlink(ram, bins, block, bin):
+	next = ram[block + 1]
+	prev = ram[block + 2]
+	if prev == 0:
+		ram[bins + bin] = next
+	else:
+		ram[prev + 1] = next
+	if to_signed(next) > 0:
+		ram[next + 2] = prev
+
+def memory_alloc(machine, size):
+	ram = machine.ram
+	bins = ram[machine.static_address('Memory.1')]
+	need = to_signed((size + 2) & 0xFFFF)
+	if need < 4:
+		need = 4
+	bin = _size_class(need)
+	while bin < 8:
+		block = ram[bins + bin]
+		while to_signed(block) > 0:
+			block_size = to_signed(ram[block])
+			if not block_size < need:
+				_unlink(ram, bins, block, bin)
+				if block_size - need > 3:
+					_release(ram, bins, block + need, block_size - need)
+					block_size = need
+				ram[block] = -block_size & 0xFFFF
+				ram[block + block_size - 1] = -block_size & 0xFFFF
+				return block + 1
+			block = ram[block + 1]
+		bin += 1
+	return 0
+
+def memory_dealloc(machine, o):
+	ram = machine.ram
+	bins = ram[machine.static_address('Memory.1')]
+	heap_base = ram[machine.static_address('Memory.2')]
+	heap_end = ram[machine.static_address('Memory.3')]
+	block = (o - 1) & 0xFFFF
+	size = to_signed(-ram[block] & 0xFFFF)
+	neighbour = block + size
+	if neighbour < heap_end and to_signed(ram[neighbour]) > 0:
+		_unlink(ram, bins, neighbour, _size_class(ram[neighbour]))
+		size += ram[neighbour]
+	if block > heap_base and to_signed(ram[block - 1]) > 0:
+		block -= ram[block - 1]
+		_unlink(ram, bins, block, _size_class(ram[block]))
+		size += ram[block]
+	_release(ram, bins, block, size)
+	return 0
+
+def screen_draw_horizontal_line(machine, x1, x2, y):
+	# Fills the words of the span, masking the partial words at both ends
+	ram = machine.ram
+	screen = ram[machine.static_address('Screen.1')]
+	color = ram[machine.static_address('Screen.2')]
+	row = screen + 32 * y
+	first = row + (x1 >> 4)
+	last = row + (x2 >> 4)
+	left_mask = 0xFFFF << (x1 & 15) & 0xFFFF
+	right_mask = 0xFFFF >> (15 - (x2 & 15))
+	if first == last:
+		left_mask &= right_mask
+	for address, mask in ((first, left_mask), (last, right_mask)):
+		if color:
+			ram[address] |= mask
+		else:
+			ram[address] &= ~mask & 0xFFFF
+		if first == last:
+			break
+	ram[first + 1:last] = [0xFFFF if color else 0] * (last - first - 1)
+	return 0
+
+def sys_halt(machine):
+	raise Halt()
+
+def sys_wait(machine, duration):
+	return 0
+
+natives = {
+	'Math.multiply': math_multiply,
+	'Math.divide': math_divide,
+	'Math.sqrt': math_sqrt,
+	'Math.abs': math_abs,
+	'Math.min': math_min,
+	'Math.max': math_max,
+	'Memory.peek': memory_peek,
+	'Memory.poke': memory_poke,
+	'Memory.alloc': memory_alloc,
+	'Memory.deAlloc': memory_dealloc,
+	'Screen.drawHorizontalLine': screen_draw_horizontal_line,
+	'Sys.halt': sys_halt,
+	'Sys.wait': sys_wait,
+}
+
+def select(disabled = None):
+	# Registry without the given functions; None disables all of them
+	if disabled is None:
+		return {}
+	for name in disabled:
+		if not name in natives:
+			raise Exception('Unknown native function ' + name)
+	return {name: native for name, native in natives.items() if not name in disabled}
+
+
+# Conformance check: runs the same calls through the Jack version (on the
+# VM emulator) and through the native version, and compares the results,
+# the statics and the heap and screen after every call. The stack and the
+# temp segment are scratch space and may differ.
+
+def _random_word(rng):
+	return rng.choice([0, 1, 2, 15, 16, 181, 182, 32767, -1, -2, -16, -32767, -32768, rng.randint(-32768, 32767), rng.randint(-200, 200)])
+
+def _check_cases(name, rng, cases):
+	if name in ('Math.multiply', 'Math.min', 'Math.max'):
+		return [[(name, [_random_word(rng), _random_word(rng)])] for i in range(cases)]
+	if name == 'Math.divide':
+		# With y = 0 now and then, which halts with ERR3
+		return [[(name, [_random_word(rng), _random_word(rng)])] for i in range(cases)]
+	if name in ('Math.sqrt', 'Math.abs'):
+		return [[(name, [_random_word(rng)])] for i in range(cases)]
+	if name == 'Memory.peek':
+		return [[(name, [rng.randint(0, 24576)])] for i in range(cases)]
+	if name == 'Memory.poke':
+		return [[(name, [rng.randint(2048, 24575), _random_word(rng)])] for i in range(cases)]
+	if name == 'Screen.drawHorizontalLine':
+		sequence = []
+		for i in range(cases):
+			x1 = rng.randint(0, 511)
+			sequence.append([('Screen.setColor', [rng.choice([0, -1])]), (name, [x1, rng.randint(x1, 511), rng.randint(0, 255)])])
+		return sequence
+	if name in ('Memory.alloc', 'Memory.deAlloc'):
+		# Allocation churn; None stands for the address of a live block
+		sequence = []
+		for i in range(cases):
+			if rng.random() < 0.6:
+				sequence.append([('Memory.alloc', [rng.randint(1, 64)])])
+			else:
+				sequence.append([('Memory.deAlloc', [None])])
+		return sequence
+	return None
+
+def _caller(function):
+	# Main function calling a native function, so that it runs as it would
+	# in a program
+	return 'Main.' + function.replace('.', '_')
+
+def _invoke(vm, function, args):
+	# The result of a call, or None if it halted
+	if function in natives:
+		function = _caller(function)
+	registers = vm.ram[0:5]
+	result = vm.invoke(function, args, 10000000)
+	if result is None:
+		# Drop the frames the call left on the stack
+		vm.ram[0:5] = registers
+	return result
+
+def _show(result):
+	return 'halted' if result is None else str(to_signed(result))
+
+def check(os_directory, names, cases, seed):
+	sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+	sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'projects', '11'))
+	from JackCompiler import compile_file
+	from VMEmulator import VMEmulator, load_program
+	# The natives of the module VMEmulator imports, so that it catches the
+	# exceptions they raise when this file runs as a script
+	import NativeOS
+
+	directory = tempfile.mkdtemp()
+	try:
+		for file in glob.glob(os.path.join(os_directory, '*.jack')):
+			shutil.copy(file, directory)
+			compile_file(os.path.join(directory, os.path.basename(file)))
+		with open(os.path.join(directory, 'Main.vm'), 'w') as main_file:
+			main_file.write('function Main.main 0\npush constant 0\nreturn\n')
+			for function, native in natives.items():
+				count = native.__code__.co_argcount - 1
+				main_file.write(f'function {_caller(function)} 0\n')
+				main_file.write(''.join(f'push argument {i}\n' for i in range(count)))
+				main_file.write(f'call {function} {count}\nreturn\n')
+		program = load_program(directory)
+	finally:
+		shutil.rmtree(directory)
+
+	failures = 0
+	for name in names:
+		rng = random.Random(seed)
+		sequence = _check_cases(name, rng, cases)
+		if sequence is None:
+			print(f'{name}: not checked')
+			continue
+		# Sys.halt is native in both, so that a call halting ends
+		jack = VMEmulator(program, {'Sys.halt': NativeOS.sys_halt})
+		native = VMEmulator(program, {name: NativeOS.natives[name], 'Sys.halt': NativeOS.sys_halt})
+		for vm in (jack, native):
+			for init in ('Memory.init', 'Math.init', 'Screen.init', 'Output.init'):
+				vm.invoke(init, [])
+		live = []
+		failure = None
+		for calls in sequence:
+			for function, args in calls:
+				if args == [None]:
+					if not live:
+						continue
+					args = [live.pop(rng.randrange(len(live)))]
+				expected = _invoke(jack, function, args)
+				actual = _invoke(native, function, args)
+				if function == 'Memory.alloc' and expected:
+					live.append(expected)
+				if expected != actual:
+					failure = f'{function}({", ".join(str(to_signed(arg & 0xFFFF)) for arg in args)}) returned {_show(actual)}, Jack returned {_show(expected)}'
+				elif jack.ram[16:256] != native.ram[16:256] or jack.ram[2048:] != native.ram[2048:]:
+					address = next(a for a in list(range(16, 256)) + list(range(2048, len(jack.ram))) if jack.ram[a] != native.ram[a])
+					failure = f'{function}({", ".join(str(to_signed(arg & 0xFFFF)) for arg in args)}) left RAM[{address}] = {native.ram[address]}, Jack left {jack.ram[address]}'
+				if failure:
+					break
+			if failure:
+				break
+		if failure:
+			failures += 1
+			print(f'{name}: FAILED: {failure}')
+		else:
+			print(f'{name}: ok ({len(sequence)} cases)')
+	return failures == 0
+
+def main(argv):
+	parser = argparse.ArgumentParser(description='Checks the native OS functions against their Jack versions.')
+	parser.add_argument('functions', nargs='*', help='functions to check (default: all)')
+	parser.add_argument('--os', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'projects', '12'), help='directory with the OS .jack files')
+	parser.add_argument('--cases', type=int, default=200, help='number of calls per function')
+	parser.add_argument('--seed', type=int, default=0)
+	args = parser.parse_args(argv)
+
+	names = args.functions or list(natives)
+	for name in names:
+		if not name in natives:
+			raise Exception('Unknown native function ' + name)
+	if not check(args.os, names, args.cases, args.seed):
+		sys.exit(1)
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,164 @@
+#!/usr/bin/python3
+
+import argparse, os, sys, time
+
+from CPUEmulator import KBD, PROJECTS, Computer, assemble, build
+
+# Profiler for Hack programs built by JackCompiler.py and VMTranslator.py,
+# run on the instruction-level emulator of CPUEmulator.py.
+#
+# Every executed instruction is attributed to the VM function whose code
+# contains it, found by the function labels VMTranslator.py emits (the
+# labels with a '.' and without a '$'). The shared call and return
+# routines and the bootstrap code show up under their own labels.
+#
+# On top of that the profiler follows the calls: a jump to a function
+# label is a call, whose return address is in the new frame at LCL-5, and
+# a jump to the return address of the innermost call is its return. A
+# tail call reuses the frame of the function making it, so the new frame
+# saves the same LCL as the innermost one, which it replaces. This
+# gives the call counts, the instructions spent inside each function
+# including its callees, and the cycles spent per call stack.
+
+def _is_function(label):
+	return '.' in label and not '$' in label
+
+class Profiler:
+
+	def __init__(self, program, labels):
+		self.entries = {address: label for label, address in labels.items() if _is_function(label)}
+		self.names = ['(bootstrap)']
+		# Shared routines, but not the labels inside them
+		regions = sorted((address, label) for label, address in labels.items() if _is_function(label) or label.startswith('$') and not '$' in label[1:])
+		self.owners = [0] * 32768
+		for index, (address, label) in enumerate(regions):
+			end = regions[index + 1][0] if index + 1 < len(regions) else 32768
+			self.names.append(label)
+			self.owners[address:end] = [len(self.names) - 1] * (end - address)
+		self.counts = [0] * 32768
+		self.watched = set(self.entries)
+		self.stack = []
+		self.calls = {}
+		self.total = {}
+		self.edges = {}
+		self.stacks = {}
+		self.last = 0
+		self.halt = labels.get('Sys.halt')
+		# The most calls running at once and the highest frame (its LCL)
+		self.deepest = 0
+		self.highest = 0
+
+	def _account(self, cycle):
+		# Cycles since the last call or return, to the current call stack
+		path = tuple(frame[0] for frame in self.stack)
+		self.stacks[path] = self.stacks.get(path, 0) + cycle - self.last
+		self.last = cycle
+
+	def jump(self, target, cycle, ram):
+		if target in self.entries:
+			self._account(cycle)
+			function = self.entries[target]
+			caller = self.stack[-1][0] if self.stack else None
+			return_address = ram[(ram[1] - 5) & 0x7FFF]
+			saved_lcl = ram[(ram[1] - 4) & 0x7FFF]
+			if self.stack and self.stack[-1][3] == saved_lcl:
+				self._return(cycle)
+			self.stack.append((function, return_address, cycle, saved_lcl, caller))
+			self.deepest = max(self.deepest, len(self.stack))
+			self.highest = max(self.highest, ram[1])
+			self.watched.add(return_address)
+			self.calls[function] = self.calls.get(function, 0) + 1
+			edge = self.edges.setdefault((caller, function), [0, 0])
+			edge[0] += 1
+			return target == self.halt
+		if self.stack and target == self.stack[-1][1]:
+			self._account(cycle)
+			self._return(cycle)
+			return not self.stack
+		return False
+
+	def _return(self, cycle):
+		function, return_address, start, saved_lcl, caller = self.stack.pop()
+		# Recursive calls are already counted in the outermost one
+		if not any(frame[0] == function for frame in self.stack):
+			self.total[function] = self.total.get(function, 0) + cycle - start
+		if not any(frame[0] == function and frame[4] == caller for frame in self.stack):
+			self.edges[(caller, function)][1] += cycle - start
+
+	def finish(self, cycle):
+		# Ends the calls still running when the program stopped
+		self._account(cycle)
+		while self.stack:
+			self._return(cycle)
+
+	def flat(self):
+		# (name, self instructions, calls, total instructions) per function
+		own = [0] * len(self.names)
+		for owner, count in zip(self.owners, self.counts):
+			own[owner] += count
+		rows = [(name, own[index], self.calls.get(name, 0), self.total.get(name, own[index])) for index, name in enumerate(self.names) if own[index]]
+		return sorted(rows, key = lambda row: -row[1])
+
+	def report(self, limit = None):
+		rows = self.flat()
+		cycles = sum(row[1] for row in rows)
+		print(f'{"% self":>7} {"cumul %":>7} {"self":>11} {"calls":>9} {"self/call":>9} {"total":>11} {"% total":>7}  function')
+		cumulative = 0
+		for name, own, calls, total in rows[:limit]:
+			cumulative += own
+			per_call = f'{own / calls:.1f}' if calls else ''
+			print(f'{100 * own / cycles:7.2f} {100 * cumulative / cycles:7.2f} {own:11} {calls or "":>9} {per_call:>9} {total:11} {100 * total / cycles:7.2f}  {name}')
+
+	def call_graph(self, limit = None):
+		functions = sorted(self.total, key = lambda function: -self.total[function])
+		for function in functions[:limit]:
+			print(f'{function}: {self.calls[function]} calls, {self.total[function]} instructions in total')
+			for (caller, callee), (calls, total) in sorted(self.edges.items(), key = lambda item: -item[1][1]):
+				if callee == function:
+					print(f'    called by {caller or "(bootstrap)"}: {calls} calls, {total} instructions')
+			for (caller, callee), (calls, total) in sorted(self.edges.items(), key = lambda item: -item[1][1]):
+				if caller == function:
+					print(f'    calls {callee}: {calls} calls, {total} instructions')
+
+	def write_collapsed(self, file):
+		# One 'caller;callee;... cycles' line per call stack, the input format
+		# of flamegraph.pl and compatible tools
+		for path, cycles in sorted(self.stacks.items()):
+			if cycles:
+				file.write(';'.join(('(bootstrap)',) + path) + f' {cycles}\n')
+
+def main(argv):
+	parser = argparse.ArgumentParser(description='Runs a Jack program on the Hack emulator and reports where its instructions are spent, per VM function.')
+	parser.add_argument('program', help='directory of .jack and .vm files to build with the OS, or .asm file translated from VM code')
+	parser.add_argument('--os', default=os.path.join(PROJECTS, '12'), help='directory with the OS .jack files')
+	parser.add_argument('--max-cycles', type=int, default=100000000, help='stop after this many cycles if the program has not ended')
+	parser.add_argument('--key', type=int, default=0, help='key code the keyboard reports while the program runs')
+	parser.add_argument('--top', type=int, help='report only the top functions')
+	parser.add_argument('--call-graph', action='store_true', help='report callers and callees of every function')
+	parser.add_argument('--collapsed', metavar='FILE', help='write collapsed call stacks for flame graphs to this file')
+	args = parser.parse_args(argv)
+
+	if os.path.isdir(args.program):
+		program, labels = build(args.program, args.os)
+	else:
+		program, labels = assemble(args.program)
+	computer = Computer(program)
+	computer.ram[KBD] = args.key
+	profiler = Profiler(program, labels)
+	start = time.time()
+	cycles = computer.profile(args.max_cycles, profiler)
+	seconds = time.time() - start
+	profiler.finish(cycles)
+	ended = 'program ended' if cycles < args.max_cycles else 'program did not end'
+	print(f'{cycles} cycles in {seconds:.2f}s ({cycles / seconds:.0f} cycles/s), {ended}')
+	print(f'{profiler.deepest} calls deep at most, the highest frame at {profiler.highest}')
+	profiler.report(args.top)
+	if args.call_graph:
+		print()
+		profiler.call_graph(args.top)
+	if args.collapsed:
+		with open(args.collapsed, 'w') as file:
+			profiler.write_collapsed(file)
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
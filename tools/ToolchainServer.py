@@ -0,0 +1,280 @@
+#!/usr/bin/python3
+
+import argparse, concurrent.futures, glob, inspect, io, json, os, socket, socketserver, sys, threading
+
+PROJECTS = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'projects')
+sys.path.insert(0, os.path.join(PROJECTS, '06'))
+sys.path.insert(0, os.path.join(PROJECTS, '08'))
+sys.path.insert(0, os.path.join(PROJECTS, '11'))
+import HackAssembler, JackCompiler, VMTranslator
+
+# A long-lived process serving the Jack toolchain over JSON-RPC 2.0, one
+# request or response object per line, on standard input and output or on
+# a Unix socket. Editors and test runners pay for starting Python and
+# importing the toolchain once instead of per file, and the OS classes of
+# projects/12 are compiled once and kept until their .jack files change.
+#
+# Methods (file paths are on the server's file system):
+#   compile    {"path": file or directory} writes .vm files like JackCompiler.py
+#              {"source": text} returns {"vm": text}
+#   translate  {"path": file or directory} writes the .asm like VMTranslator.py
+#              {"files": {name: VM text}, "bootstrap": true} returns {"asm": text}
+#   assemble   {"path": .asm file} writes the .hack like HackAssembler.py
+#              {"source": text} returns {"hack": text}
+#   build      {"path": directory} or {"files": {name: Jack or VM text}}, with
+#              the OS classes the program doesn't define itself, returns
+#              {"hack": text} or writes it to "output"
+#   ping, shutdown
+
+# JSON-RPC 2.0 error codes
+PARSE_ERROR = -32700
+INVALID_REQUEST = -32600
+METHOD_NOT_FOUND = -32601
+INVALID_PARAMS = -32602
+SERVER_ERROR = -32000
+
+class RequestError(Exception):
+	def __init__(self, message, code = INVALID_PARAMS):
+		Exception.__init__(self, message)
+		self.code = code
+
+def compile_source(source):
+	output = io.StringIO()
+	JackCompiler.CompilationEngine(JackCompiler.JackTokenizer(None, source), output).compile()
+	return output.getvalue()
+
+def translate_sources(files, bootstrap = True):
+	# files: {file name: VM code}, translated in order of name
+	output = io.StringIO()
+	writer = VMTranslator.CodeWriter(output)
+	if bootstrap:
+		writer.write_init()
+	parser = VMTranslator.Parser(writer)
+	for name in sorted(files):
+		writer.write_comment('file ' + name)
+		parser.parse_lines(name, files[name].splitlines())
+	return output.getvalue()
+
+def assemble_source(source):
+	output = io.StringIO()
+	symbol_table = HackAssembler.SymbolTable()
+	HackAssembler.Parser(HackAssembler.CodeWriter(output, symbol_table), symbol_table).parse_lines(source.splitlines())
+	return output.getvalue()
+
+def require_path(path, alternative):
+	if not isinstance(path, str):
+		raise RequestError(f'path or {alternative} is required')
+
+class OSCache:
+	# The VM code of the OS classes, recompiled when a .jack file changes
+
+	def __init__(self, directory):
+		self.directory = directory
+		self.classes = {}
+		self.lock = threading.Lock()
+
+	def vm_files(self):
+		# {'Class.vm': VM code} of all OS classes
+		with self.lock:
+			files = {}
+			for path in glob.glob(os.path.join(self.directory, '*.jack')):
+				status = os.stat(path)
+				stamp = (status.st_mtime_ns, status.st_size)
+				name = os.path.splitext(os.path.basename(path))[0] + '.vm'
+				if not name in self.classes or self.classes[name][0] != stamp:
+					with open(path) as file:
+						self.classes[name] = (stamp, compile_source(file.read()))
+				files[name] = self.classes[name][1]
+			return files
+
+class Toolchain:
+
+	def __init__(self, os_directory):
+		self.os = OSCache(os_directory)
+		self.stopping = threading.Event()
+
+	def call(self, method, params):
+		handler = getattr(self, 'rpc_' + method, None)
+		if not handler:
+			raise RequestError(f'Unknown method {method}', METHOD_NOT_FOUND)
+		try:
+			inspect.signature(handler).bind(**params)
+		except TypeError as error:
+			raise RequestError(str(error))
+		# Errors of the handler itself are not about the params
+		return handler(**params)
+
+	def rpc_ping(self):
+		return 'pong'
+
+	def rpc_shutdown(self):
+		self.stopping.set()
+		return None
+
+	def rpc_compile(self, path = None, source = None):
+		if source is not None:
+			return {'vm': compile_source(source)}
+		require_path(path, 'source')
+		files = glob.glob(os.path.join(path, '*.jack')) if os.path.isdir(path) else [path]
+		for file in files:
+			JackCompiler.compile_file(file)
+		return {'files': [os.path.splitext(file)[0] + '.vm' for file in files]}
+
+	def rpc_translate(self, path = None, files = None, bootstrap = True):
+		if files is not None:
+			return {'asm': translate_sources(files, bootstrap)}
+		require_path(path, 'files')
+		if os.path.isdir(path):
+			VMTranslator.translate_directory(path)
+			return {'file': os.path.join(path, os.path.basename(path) + '.asm')}
+		VMTranslator.translate_file(path)
+		return {'file': os.path.splitext(path)[0] + '.asm'}
+
+	def rpc_assemble(self, path = None, source = None):
+		if source is not None:
+			return {'hack': assemble_source(source)}
+		require_path(path, 'source')
+		HackAssembler.translate_file(path)
+		return {'file': os.path.splitext(path)[0] + '.hack'}
+
+	def rpc_build(self, path = None, files = None, output = None):
+		if files is None:
+			require_path(path, 'files')
+			files = {}
+			for file in glob.glob(os.path.join(path, '*.jack')) + glob.glob(os.path.join(path, '*.vm')):
+				with open(file) as source:
+					files[os.path.basename(file)] = source.read()
+		vm_files = {}
+		for name, source in files.items():
+			if name.endswith('.jack'):
+				vm_files[name[:-5] + '.vm'] = compile_source(source)
+			elif name.endswith('.vm'):
+				vm_files[name] = source
+			else:
+				raise RequestError(f'{name} is neither a .jack nor a .vm file')
+		for name, source in self.os.vm_files().items():
+			vm_files.setdefault(name, source)
+		hack = assemble_source(translate_sources(vm_files))
+		if output:
+			with open(output, 'w') as file:
+				file.write(hack)
+			return {'file': output, 'instructions': hack.count('\n')}
+		return {'hack': hack, 'instructions': hack.count('\n')}
+
+	def handle(self, line):
+		# The response line to a request line, or None for a notification
+		request_id = None
+		notification = False
+		try:
+			try:
+				request = json.loads(line)
+			except json.JSONDecodeError as error:
+				raise RequestError(str(error), PARSE_ERROR)
+			if not isinstance(request, dict):
+				raise RequestError('A request must be an object', INVALID_REQUEST)
+			request_id = request.get('id')
+			notification = not 'id' in request
+			if not isinstance(request.get('method'), str):
+				raise RequestError('A request must name its method', INVALID_REQUEST)
+			params = request.get('params', {})
+			if not isinstance(params, dict):
+				raise RequestError('params must be an object')
+			response = {'jsonrpc': '2.0', 'id': request_id, 'result': self.call(request['method'], params)}
+		except RequestError as error:
+			response = {'jsonrpc': '2.0', 'id': request_id, 'error': {'code': error.code, 'message': str(error)}}
+		except Exception as error:
+			response = {'jsonrpc': '2.0', 'id': request_id, 'error': {'code': SERVER_ERROR, 'message': str(error)}}
+		# Notifications get no response, not even an error
+		if notification:
+			return None
+		return json.dumps(response) + '\n'
+
+def is_shutdown(line):
+	try:
+		request = json.loads(line)
+	except json.JSONDecodeError:
+		return False
+	return isinstance(request, dict) and request.get('method') == 'shutdown'
+
+def serve_stdio(toolchain, workers):
+	# Requests are handled by a pool of threads; responses are written as
+	# they finish, so they may come in a different order than the requests
+	lock = threading.Lock()
+
+	def respond(line):
+		response = toolchain.handle(line)
+		if response:
+			with lock:
+				sys.stdout.write(response)
+				sys.stdout.flush()
+
+	with concurrent.futures.ThreadPoolExecutor(workers) as pool:
+		for line in sys.stdin:
+			if not line.strip():
+				continue
+			if is_shutdown(line):
+				# Handled here, so the loop stops before reading another line;
+				# leaving the pool waits for the requests still running
+				respond(line)
+				if toolchain.stopping.is_set():
+					break
+			else:
+				pool.submit(respond, line)
+
+def serve_socket(toolchain, path):
+	# One thread per connection, each answering its requests in order
+	class Handler(socketserver.StreamRequestHandler):
+		def handle(self):
+			for line in self.rfile:
+				if line.strip():
+					response = toolchain.handle(line)
+					if response:
+						self.wfile.write(response.encode())
+				if toolchain.stopping.is_set():
+					threading.Thread(target = server.shutdown).start()
+					break
+
+	class Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+		daemon_threads = True
+
+	if os.path.exists(path):
+		os.remove(path)
+	server = Server(path, Handler)
+	try:
+		server.serve_forever()
+	finally:
+		server.server_close()
+		os.remove(path)
+
+def request(path, method, params = None):
+	# Sends one request to a server on a Unix socket and returns the result
+	with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+		connection.connect(path)
+		connection.sendall((json.dumps({'jsonrpc': '2.0', 'id': 1, 'method': method, 'params': params or {}}) + '\n').encode())
+		response = json.loads(connection.makefile().readline())
+	if 'error' in response:
+		raise Exception(response['error']['message'])
+	return response['result']
+
+def main(argv):
+	parser = argparse.ArgumentParser(description='Serves the Jack compiler, VM translator and assembler over JSON-RPC, on standard input and output or on a Unix socket.')
+	parser.add_argument('--socket', metavar='PATH', help='listen on this Unix socket instead of standard input')
+	parser.add_argument('--os', default=os.path.join(PROJECTS, '12'), help='directory with the OS .jack files')
+	parser.add_argument('--workers', type=int, default=4, help='threads handling requests from standard input')
+	parser.add_argument('--call', nargs='+', metavar=('METHOD', 'PARAMS'), help='send one request with JSON params to the server on --socket and print the result')
+	args = parser.parse_args(argv)
+
+	if args.call:
+		if not args.socket:
+			parser.error('--call needs --socket')
+		params = json.loads(args.call[1]) if len(args.call) > 1 else {}
+		print(json.dumps(request(args.socket, args.call[0], params), indent = 2))
+		return
+	toolchain = Toolchain(args.os)
+	if args.socket:
+		serve_socket(toolchain, args.socket)
+	else:
+		serve_stdio(toolchain, args.workers)
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,466 @@
+#!/usr/bin/python3
+
+import argparse, hashlib, importlib.util, os, re, sys, tempfile, time
+
+from NativeOS import Halt
+from VMEmulator import ADD, AND, CALL, EQ, FUNCTION, GOTO, GT, IF_GOTO, LT, NEG, NOT, OR, POP_ADDR, POP_SEG, PUSH_ADDR, PUSH_CONST, PUSH_SEG, RETURN, SUB, load_program
+
+# Ahead-of-time compiler of VM code to Python. Every VM function becomes a
+# Python function, with its arguments and locals as Python locals and the
+# this and that pointers as two more arguments, since a call saves and
+# restores them. Statics and temp stay in a RAM list, so programs see the
+# same memory as on the VM emulator, apart from the stack, which is the
+# Python stack. Calls are Python calls.
+#
+# The VM stack of a function is evaluated at compile time into Python
+# expressions, all values are kept in 0..65535 and the comparisons are
+# signed like the VM's. The labels and gotos of the if and while
+# statements JackCompiler.py makes become if/else and while loops. A
+# function whose jumps don't have that form runs in a loop dispatching on
+# its basic blocks. A loop that does nothing at all, like Sys.halt, raises
+# Halt.
+#
+# The generated module is cached in ~/.cache/nand2tetris/py, keyed by the
+# VM code and this file.
+
+COMPILER_VERSION = 1
+
+ARGUMENT = 2
+THIS = 3
+THAT = 4
+
+class Irreducible(Exception):
+	pass
+
+class Value:
+	# A value on the compile-time stack: Python code, the names of what it
+	# reads ('ram' or a variable), and for comparisons a Python bool instead
+	# of 0/65535, possibly negated
+	def __init__(self, code, reads = frozenset(), boolean = False, negated = False):
+		self.code = code
+		self.reads = reads
+		self.boolean = boolean
+		self.negated = negated
+
+	def constant(self):
+		return None if self.boolean or not self.code.isdigit() else int(self.code)
+
+	def word(self):
+		# Code of the value as 0..65535
+		if not self.boolean:
+			return self.code
+		return f'(0 if {self.code} else 65535)' if self.negated else f'(65535 if {self.code} else 0)'
+
+	def condition(self):
+		# Code of the value as a Python truth value
+		if self.boolean and self.negated:
+			return f'not ({self.code})'
+		return self.code
+
+def _python_name(function):
+	return 'f_' + re.sub(r'\W', '_', function)
+
+class FunctionCompiler:
+
+	def __init__(self, program, function, start, end, parameters, labels):
+		self.program = program
+		self.function = function
+		self.parameters = parameters
+		# ('label', name) and (op, a, b) items of the function body
+		self.items = []
+		for index in range(start + 1, end + 1):
+			for label in labels.get(index, ()):
+				self.items.append(('label', label, None))
+			if index < end:
+				self.items.append(program.commands[index])
+		self.positions = {item[1]: index for index, item in enumerate(self.items) if item[0] == 'label'}
+		self.locals = program.commands[start][1]
+
+	def compile(self):
+		try:
+			body = self._compile(self._structured)
+		except Irreducible:
+			body = self._compile(self._dispatched)
+		parameters = ''.join(f', a{index} = 0' for index in range(self.parameters))
+		lines = [f'def {_python_name(self.function)}(this, that{parameters}):', f'\t# {self.function}']
+		if self.locals:
+			lines.append('\t' + ' = '.join(f'l{index}' for index in range(self.locals)) + ' = 0')
+		return lines + body
+
+	def _compile(self, generate):
+		self.lines = []
+		self.depth = 1
+		self.stack = []
+		self.temporaries = 0
+		generate()
+		return self.lines
+
+	def _emit(self, line):
+		self.lines.append('\t' * self.depth + line)
+
+	def _temporary(self, value):
+		self.temporaries += 1
+		name = f't{self.temporaries}'
+		self._emit(f'{name} = {value.code}')
+		return Value(name, frozenset(), value.boolean, value.negated)
+
+	def _flush(self, written):
+		# Computes the stack values that read what is about to be written
+		for index, value in enumerate(self.stack):
+			if value.reads & written:
+				self.stack[index] = self._temporary(value)
+
+	def _pop(self):
+		if not self.stack:
+			raise Exception(f'{self.function}: pop from an empty stack')
+		return self.stack.pop()
+
+	def _variable(self, op, a, b):
+		# Python code and name (for _flush) of a memory location
+		if op in (PUSH_SEG, POP_SEG):
+			if a == 1:
+				return f'l{b}', f'l{b}'
+			if a == ARGUMENT:
+				return f'a{b}', f'a{b}'
+			pointer = 'this' if a == THIS else 'that'
+			return (f'ram[{pointer} + {b}]' if b else f'ram[{pointer}]'), 'ram'
+		if a == THIS:
+			return 'this', 'this'
+		if a == THAT:
+			return 'that', 'that'
+		return f'ram[{a}]', 'ram'
+
+	def _command(self, op, a, b):
+		# Straight-line VM commands; returns False for jumps
+		stack = self.stack
+		if op == PUSH_CONST:
+			stack.append(Value(str(a)))
+		elif op in (PUSH_SEG, PUSH_ADDR):
+			code, name = self._variable(op, a, b)
+			reads = {name} | ({'this' if a == THIS else 'that'} if op == PUSH_SEG and a in (THIS, THAT) else set())
+			stack.append(Value(code, frozenset(reads)))
+		elif op in (POP_SEG, POP_ADDR):
+			value = self._pop()
+			code, name = self._variable(op, a, b)
+			self._flush({name})
+			self._emit(f'{code} = {value.word()}')
+		elif op in (ADD, SUB, AND, OR, EQ, LT, GT):
+			y = self._pop()
+			x = self._pop()
+			stack.append(self._binary(op, x, y))
+		elif op == NEG:
+			x = self._pop()
+			constant = x.constant()
+			stack.append(Value(str(-constant & 0xFFFF)) if constant is not None else Value(f'(-{x.word()} & 65535)', x.reads))
+		elif op == NOT:
+			x = self._pop()
+			constant = x.constant()
+			if x.boolean:
+				stack.append(Value(x.code, x.reads, True, not x.negated))
+			elif constant is not None:
+				stack.append(Value(str(constant ^ 0xFFFF)))
+			else:
+				stack.append(Value(f'({x.code} ^ 65535)', x.reads))
+		elif op == CALL:
+			self._flush({'ram'})
+			arguments = [self._pop().word() for index in range(b)][::-1]
+			self.stack.append(self._temporary(Value(f'{_python_name(a)}(this, that{"".join(", " + argument for argument in arguments)})')))
+		elif op == RETURN:
+			self._emit(f'return {self._pop().word()}')
+			self.stack = []
+		else:
+			return False
+		return True
+
+	def _binary(self, op, x, y):
+		reads = x.reads | y.reads
+		cx, cy = x.constant(), y.constant()
+		if op in (AND, OR) and x.boolean and y.boolean:
+			operator = ' and ' if op == AND else ' or '
+			return Value(f'({x.condition()}{operator}{y.condition()})', reads, True)
+		if cx is not None and cy is not None:
+			signed_x = cx - 0x10000 if cx & 0x8000 else cx
+			signed_y = cy - 0x10000 if cy & 0x8000 else cy
+			result = {ADD: cx + cy, SUB: cx - cy, AND: cx & cy, OR: cx | cy,
+				EQ: -(cx == cy), LT: -(signed_x < signed_y), GT: -(signed_x > signed_y)}[op]
+			return Value(str(result & 0xFFFF))
+		wx, wy = x.word(), y.word()
+		if op == ADD:
+			return Value(f'(({wx} + {wy}) & 65535)', reads)
+		if op == SUB:
+			return Value(f'(({wx} - {wy}) & 65535)', reads)
+		if op == AND:
+			return Value(f'({wx} & {wy})', reads)
+		if op == OR:
+			return Value(f'({wx} | {wy})', reads)
+		if op == EQ:
+			return Value(f'{wx} == {wy}', reads, True)
+		# Signed comparison of 16-bit words
+		sx = str(cx ^ 0x8000) if cx is not None else f'({wx} ^ 32768)'
+		sy = str(cy ^ 0x8000) if cy is not None else f'({wy} ^ 32768)'
+		return Value(f'{sx} {"<" if op == LT else ">"} {sy}', reads, True)
+
+	def _check_empty(self):
+		if self.stack:
+			raise Exception(f'{self.function}: values left on the stack at a jump or label')
+
+	# Structured control flow: while loops and if/else
+
+	def _structured(self):
+		self._block(0, len(self.items), [])
+		if not self.lines or not self._jumped():
+			self._emit('return 0')
+
+	def _block(self, start, end, loops):
+		# Compiles items[start:end]; loops are the (head, exit) labels of the
+		# enclosing while loops, innermost last
+		index = start
+		while index < end:
+			item = self.items[index]
+			op, a, b = item
+			if op == 'label':
+				self._check_empty()
+				back = [position for position in range(index + 1, end) if self.items[position][0] == GOTO and self.items[position][1] == a]
+				if back:
+					# while loop: label head ... goto head [label exit]
+					last = back[-1]
+					following = self.items[last + 1] if last + 1 < end else None
+					exit = following[1] if following and following[0] == 'label' else None
+					self._emit('while True:')
+					lines = len(self.lines)
+					self.depth += 1
+					self._block(index + 1, last, loops + [(a, exit)])
+					if not self._statements(lines):
+						# Nothing in the loop can ever change: Sys.halt
+						del self.lines[lines:]
+						self._emit('raise Halt()')
+					self.depth -= 1
+					index = last + 1
+					continue
+				index += 1
+			elif op == IF_GOTO:
+				condition = self._pop()
+				self._check_empty()
+				constant = condition.constant()
+				target = self.positions.get(a)
+				if target is None:
+					raise Exception(f'{self.function}: unknown label {a}')
+				if constant == 0 or self._loop_jump(a, loops, condition.condition() if constant is None else 'True'):
+					index += 1
+					continue
+				if target <= index or target > end:
+					raise Irreducible()
+				if constant is not None and constant:
+					index = target
+					continue
+				previous = self.items[target - 1]
+				else_end = self.positions.get(previous[1]) if previous[0] == GOTO else None
+				if else_end is not None and target < else_end <= end and not any(previous[1] in loop for loop in loops):
+					then_end = target - 1
+				else:
+					then_end, else_end = target, None
+				if constant is not None:
+					self._block(index + 1, then_end, loops)
+				else:
+					self._emit(f'if not ({condition.condition()}):' if not condition.boolean or not condition.negated else f'if {condition.code}:')
+					self._branch(index + 1, then_end, loops)
+					if else_end is not None:
+						self._emit('else:')
+						lines = len(self.lines)
+						self._branch(target, else_end, loops)
+						if not self._statements(lines):
+							del self.lines[lines - 1:]
+				index = else_end if else_end is not None else target
+			elif op == GOTO:
+				self._check_empty()
+				if not self._loop_jump(a, loops, 'True'):
+					raise Irreducible()
+				index += 1
+			else:
+				self._command(op, a, b)
+				index += 1
+
+	def _branch(self, start, end, loops):
+		self.depth += 1
+		lines = len(self.lines)
+		self._block(start, end, loops)
+		self._check_empty()
+		if len(self.lines) == lines:
+			self._emit('pass')
+		self.depth -= 1
+
+	def _statements(self, lines):
+		return any(line.strip() != 'pass' for line in self.lines[lines:])
+
+	def _loop_jump(self, label, loops, condition):
+		# A jump to the head or the exit of the innermost loop becomes continue
+		# or break; returns False for other jumps
+		if not loops or not label in loops[-1]:
+			return False
+		statement = 'continue' if label == loops[-1][0] else 'break'
+		if condition == 'True':
+			self._emit(statement)
+		else:
+			self._emit(f'if {condition}:')
+			self.depth += 1
+			self._emit(statement)
+			self.depth -= 1
+		return True
+
+	# Any control flow: a loop over the basic blocks
+
+	def _dispatched(self):
+		# Block 0 starts the function, every run of labels starts another
+		blocks = {}
+		for index, item in enumerate(self.items):
+			if item[0] == 'label' and (not index or self.items[index - 1][0] != 'label'):
+				blocks[index] = len(blocks) + 1
+		numbers = {}
+		current = 0
+		for index, item in enumerate(self.items):
+			current = blocks.get(index, current)
+			if item[0] == 'label':
+				numbers[item[1]] = current
+		self._emit('block = 0')
+		self._emit('while True:')
+		self.depth += 1
+		self._emit('if block == 0:')
+		self.depth += 1
+		current = 0
+		statements = len(self.lines)
+		for index, item in enumerate(self.items):
+			op, a, b = item
+			if index in blocks:
+				self._check_empty()
+				current = blocks[index]
+				if not self._jumped():
+					self._emit(f'block = {current}')
+				self.depth -= 1
+				self._emit(f'if block == {current}:')
+				self.depth += 1
+				statements = len(self.lines)
+			elif op == GOTO:
+				self._check_empty()
+				if numbers[a] == current and len(self.lines) == statements:
+					# Nothing in the loop can ever change: Sys.halt
+					self._emit('raise Halt()')
+				else:
+					self._emit(f'block = {numbers[a]}')
+					self._emit('continue')
+			elif op == IF_GOTO:
+				condition = self._pop()
+				self._check_empty()
+				self._emit(f'if {condition.condition()}:')
+				self.depth += 1
+				self._emit(f'block = {numbers[a]}')
+				self._emit('continue')
+				self.depth -= 1
+			elif op != 'label':
+				self._command(op, a, b)
+		if not self._jumped():
+			self._emit('return 0')
+		self.depth -= 2
+
+	def _jumped(self):
+		# Whether the last statement emitted at this depth never falls through
+		last = self.lines[-1]
+		return last.startswith('\t' * self.depth) and last.strip().split(' ')[0] in ('continue', 'return', 'raise')
+
+def generate(program):
+	# Python source of a module with make(ram, Halt), which returns the
+	# compiled functions by VM function name
+	starts = sorted((start, function) for function, start in program.functions.items())
+	labels = {}
+	for label, index in program.labels.items():
+		labels.setdefault(index, []).append(label)
+	parameters = {function: 0 for function in program.functions}
+	for op, a, b in program.commands:
+		if op == CALL:
+			if not a in parameters:
+				raise Exception(f'Call of unknown function {a}')
+			parameters[a] = max(parameters[a], b)
+	current = None
+	for index, (op, a, b) in enumerate(program.commands):
+		if op == FUNCTION:
+			current = b
+		elif op in (PUSH_SEG, POP_SEG) and a == ARGUMENT:
+			parameters[current] = max(parameters[current], b + 1)
+	lines = [f'# Generated by tools/VMCompiler.py from {len(starts)} VM functions', '', 'def make(ram, Halt):']
+	for number, (start, function) in enumerate(starts):
+		end = starts[number + 1][0] if number + 1 < len(starts) else len(program.commands)
+		# Labels at the end of a function belong to it
+		function_labels = {index: [label for label in names if label.startswith(function + '$')] for index, names in labels.items() if start < index <= end}
+		lines += ['\t' + line for line in FunctionCompiler(program, function, start, end, parameters[function], function_labels).compile()]
+		lines.append('')
+	lines.append('\treturn {' + ', '.join(f'{function!r}: {_python_name(function)}' for start, function in starts) + '}')
+	return '\n'.join(lines) + '\n'
+
+def default_cache_directory():
+	return os.path.join(os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache'), 'nand2tetris', 'py')
+
+def load(program, cache_directory = None):
+	# The compiled module of a Program of VMEmulator.py, generated if it is
+	# not in the cache yet
+	digest = hashlib.sha256(str(COMPILER_VERSION).encode())
+	with open(os.path.abspath(__file__), 'rb') as file:
+		digest.update(file.read())
+	digest.update(repr((sorted(program.functions.items()), sorted(program.labels.items()), program.commands)).encode())
+	directory = cache_directory or default_cache_directory()
+	path = os.path.join(directory, f'vm_{digest.hexdigest()[:32]}.py')
+	if not os.path.exists(path):
+		os.makedirs(directory, exist_ok = True)
+		# Write to a temporary file first, so readers never see half a file
+		handle, temporary = tempfile.mkstemp(dir = directory, suffix = '.py')
+		with os.fdopen(handle, 'w') as file:
+			file.write(generate(program))
+		os.replace(temporary, path)
+	specification = importlib.util.spec_from_file_location(os.path.splitext(os.path.basename(path))[0], path)
+	module = importlib.util.module_from_spec(specification)
+	specification.loader.exec_module(module)
+	return module
+
+class CompiledProgram:
+
+	def __init__(self, program, cache_directory = None):
+		self.program = program
+		self.ram = [0] * 32768
+		self.functions = load(program, cache_directory).make(self.ram, Halt)
+
+	def static_address(self, name):
+		return self.program.statics[name]
+
+	def invoke(self, function, args):
+		return self.functions[function](0, 0, *[arg & 0xFFFF for arg in args])
+
+	def run(self):
+		# Calls Sys.init like the bootstrap code does; returns True if the
+		# program halted (Sys.halt), False if Sys.init returned
+		limit = sys.getrecursionlimit()
+		sys.setrecursionlimit(max(limit, 100000))
+		try:
+			self.functions['Sys.init'](0, 0)
+		except Halt:
+			return True
+		finally:
+			sys.setrecursionlimit(limit)
+		return False
+
+def main(argv):
+	parser = argparse.ArgumentParser(description='Compiles .vm files to Python and runs them.')
+	parser.add_argument('path', help='<filename>.vm | <directory>')
+	parser.add_argument('--cache', help='directory of the compiled modules (default: ~/.cache/nand2tetris/py)')
+	parser.add_argument('--source', action='store_true', help='print the generated Python code instead of running it')
+	args = parser.parse_args(argv)
+
+	program = load_program(args.path)
+	if args.source:
+		sys.stdout.write(generate(program))
+		return
+	start = time.time()
+	compiled = CompiledProgram(program, args.cache)
+	loaded = time.time()
+	halted = compiled.run()
+	print(f'loaded in {loaded - start:.2f}s, {"halted" if halted else "returned"} after {time.time() - loaded:.2f}s')
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
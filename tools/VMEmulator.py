@@ -0,0 +1,424 @@
+#!/usr/bin/python3
+
+import argparse, glob, os, sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'projects', '08'))
+from VMTranslator import Parser
+from NativeOS import Halt, SysError, natives, select
+
+# Opcodes of the pre-resolved command list
+PUSH_CONST = 0
+PUSH_ADDR = 1    # static, temp and pointer: fixed RAM address
+PUSH_SEG = 2     # local, argument, this and that: segment register + offset
+POP_ADDR = 3
+POP_SEG = 4
+ADD = 5
+SUB = 6
+NEG = 7
+EQ = 8
+GT = 9
+LT = 10
+AND = 11
+OR = 12
+NOT = 13
+GOTO = 14
+IF_GOTO = 15
+CALL = 16
+CALL_NATIVE = 17
+FUNCTION = 18
+RETURN = 19
+HALT = 20
+
+SEGMENT_REGISTERS = {'local': 1, 'argument': 2, 'this': 3, 'that': 4}
+
+# Collects the commands of one or more .vm files. Implements the CodeWriter
+# interface of projects/08/VMTranslator.py, so the translator's Parser feeds
+# it the exact same command set. Labels are scoped per function and statics
+# are allocated from address 16 in order of first use, like the assembler does.
+class Program:
+
+	def __init__(self):
+		self.commands = []
+		self.functions = {}
+		self.labels = {}
+		self.statics = {}
+		self.function = ''
+		self.static_prefix = ''
+
+	def load_file(self, filename):
+		Parser(self).parseFile(filename)
+
+	def load_directory(self, directory):
+		for file in sorted(glob.glob(os.path.join(directory, '*.vm'))):
+			self.load_file(file)
+
+	def static_address(self, name):
+		if not name in self.statics:
+			self.statics[name] = 16 + len(self.statics)
+		return self.statics[name]
+
+	def _add(self, op, a = None, b = None):
+		self.commands.append((op, a, b))
+
+	def _address(self, segment, address):
+		if segment == 'pointer':
+			return 3 + int(address)
+		elif segment == 'temp':
+			return 5 + int(address)
+		elif segment == 'static':
+			return self.static_address(self.static_prefix + address)
+		return None
+
+	def set_filename(self, filename):
+		self.static_prefix = os.path.splitext(os.path.basename(filename))[0] + '.'
+
+	def write_comment(self, text):
+		pass
+
+	def write_push(self, segment, address):
+		if segment == 'constant':
+			self._add(PUSH_CONST, int(address))
+		elif segment in SEGMENT_REGISTERS:
+			self._add(PUSH_SEG, SEGMENT_REGISTERS[segment], int(address))
+		else:
+			fixed = self._address(segment, address)
+			if fixed is None:
+				raise Exception('Unknown push segment ' + segment)
+			self._add(PUSH_ADDR, fixed)
+
+	def write_pop(self, segment, address):
+		if segment in SEGMENT_REGISTERS:
+			self._add(POP_SEG, SEGMENT_REGISTERS[segment], int(address))
+		else:
+			fixed = self._address(segment, address)
+			if fixed is None:
+				raise Exception('Unknown pop segment ' + segment)
+			self._add(POP_ADDR, fixed)
+
+	def write_add(self):
+		self._add(ADD)
+
+	def write_sub(self):
+		self._add(SUB)
+
+	def write_neg(self):
+		self._add(NEG)
+
+	def write_eq(self):
+		self._add(EQ)
+
+	def write_gt(self):
+		self._add(GT)
+
+	def write_lt(self):
+		self._add(LT)
+
+	def write_and(self):
+		self._add(AND)
+
+	def write_or(self):
+		self._add(OR)
+
+	def write_not(self):
+		self._add(NOT)
+
+	def write_label(self, label):
+		self.labels[self.function + '$' + label] = len(self.commands)
+
+	def write_goto(self, label):
+		self._add(GOTO, self.function + '$' + label)
+
+	def write_if(self, label):
+		self._add(IF_GOTO, self.function + '$' + label)
+
+	def write_compare_if(self, comparison, negate, label):
+		# The translator's Parser fuses these; keep them as separate steps
+		{'eq': self.write_eq, 'lt': self.write_lt, 'gt': self.write_gt}[comparison]()
+		if negate:
+			self.write_not()
+		self.write_if(label)
+
+	def write_call(self, function, arg_count):
+		self._add(CALL, function, arg_count)
+
+	def write_tail_call(self, function, arg_count):
+		self.write_call(function, arg_count)
+		self.write_return()
+
+	def write_function(self, function, local_count):
+		self.function = function
+		self.functions[function] = len(self.commands)
+		self._add(FUNCTION, local_count, function)
+
+	def write_return(self):
+		self._add(RETURN)
+
+	def function_at(self, index):
+		# Name of the function containing the given command index
+		name = ''
+		if index >= len(self.commands):
+			return name
+		for function, start in self.functions.items():
+			if start <= index and (not name or start > self.functions[name]):
+				name = function
+		return name
+
+
+# Number of calls and inclusive steps per function
+class FunctionStats:
+	def __init__(self):
+		self.calls = {}
+		self.steps = {}
+		self.stack = []
+		self.active = {}
+
+	def enter(self, function, steps):
+		self.calls[function] = self.calls.get(function, 0) + 1
+		self.active[function] = self.active.get(function, 0) + 1
+		self.stack.append((function, steps))
+
+	def leave(self, steps):
+		function, start = self.stack.pop()
+		self.active[function] -= 1
+		if not self.active[function]:
+			# Count the steps of recursive calls only once
+			self.steps[function] = self.steps.get(function, 0) + steps - start
+
+	def native(self, function):
+		self.calls[function] = self.calls.get(function, 0) + 1
+		self.steps[function] = self.steps.get(function, 0) + 1
+
+	def report(self, file = sys.stdout):
+		file.write(f'{"function":40} {"calls":>10} {"steps":>12} {"steps/call":>10}\n')
+		for function in sorted(self.calls, key = lambda f: -self.steps.get(f, 0)):
+			calls = self.calls[function]
+			steps = self.steps.get(function, 0)
+			file.write(f'{function:40} {calls:10} {steps:12} {steps / calls:10.1f}\n')
+
+
+class VMEmulator:
+	def __init__(self, program, natives = natives, stats = None):
+		self.program = program
+		self.natives = natives
+		self.stats = stats
+		self.ram = [0] * 32768
+		self.steps = 0
+		self.halted = False
+		self._link()
+		self.reset()
+
+	def _link(self):
+		# Resolve labels and function names into command indexes
+		program = self.program
+		self.code = []
+		self.function_names = {index: function for function, index in program.functions.items()}
+		self.native_names = {native: function for function, native in self.natives.items()}
+		for index, (op, a, b) in enumerate(program.commands):
+			if op == GOTO or op == IF_GOTO:
+				if not a in program.labels:
+					raise Exception('Unknown label ' + a)
+				a = program.labels[a]
+			elif op == CALL:
+				if a in self.natives:
+					op, a = CALL_NATIVE, self.natives[a]
+				elif a in program.functions:
+					a = program.functions[a]
+				else:
+					raise Exception('Unknown function ' + a)
+			elif op == FUNCTION:
+				b = [0] * a
+			self.code.append((op, a, b))
+		self.code.append((HALT, None, None))
+
+	def reset(self):
+		self.ram[0] = 256
+		self.steps = 0
+		self.halted = False
+		if 'Sys.init' in self.program.functions:
+			# Bootstrap: call Sys.init, returning to the final HALT command
+			self.ram[1] = self.ram[2] = 256
+			self.pc = len(self.code) - 1
+			self.call('Sys.init', [])
+		else:
+			self.pc = 0
+
+	def call(self, function, args):
+		# Push arguments and a frame as the call command would, and jump
+		ram = self.ram
+		sp = ram[0]
+		for arg in args:
+			ram[sp] = arg & 0xFFFF
+			sp += 1
+		ram[sp] = self.pc
+		ram[sp + 1] = ram[1]
+		ram[sp + 2] = ram[2]
+		ram[sp + 3] = ram[3]
+		ram[sp + 4] = ram[4]
+		ram[2] = sp - len(args)
+		ram[0] = ram[1] = sp + 5
+		self.pc = self.program.functions[function]
+		if self.stats is not None:
+			self.stats.enter(function, self.steps)
+
+	def invoke(self, function, args, max_steps = None):
+		# Call a function from the top level, run it until it returns and
+		# pop its return value
+		self.pc = len(self.code) - 1
+		self.halted = False
+		self.call(function, args)
+		if not self.run(max_steps):
+			raise Exception(f'{function} did not return within {max_steps} steps')
+		if self.pc != len(self.code) - 1:
+			# Halted before returning
+			return None
+		self.ram[0] -= 1
+		return self.ram[self.ram[0]]
+
+	def static_address(self, name):
+		return self.program.statics[name]
+
+	def run(self, max_steps = None):
+		ram = self.ram
+		code = self.code
+		pc = self.pc
+		sp = ram[0]
+		steps = self.steps
+		stats = self.stats
+		limit = steps + max_steps if max_steps is not None else float('inf')
+		try:
+			while steps < limit:
+				op, a, b = code[pc]
+				pc += 1
+				steps += 1
+				if op == PUSH_CONST:
+					ram[sp] = a
+					sp += 1
+				elif op == PUSH_SEG:
+					ram[sp] = ram[ram[a] + b]
+					sp += 1
+				elif op == PUSH_ADDR:
+					ram[sp] = ram[a]
+					sp += 1
+				elif op == POP_SEG:
+					sp -= 1
+					ram[ram[a] + b] = ram[sp]
+				elif op == POP_ADDR:
+					sp -= 1
+					ram[a] = ram[sp]
+				elif op == ADD:
+					sp -= 1
+					ram[sp - 1] = (ram[sp - 1] + ram[sp]) & 0xFFFF
+				elif op == SUB:
+					sp -= 1
+					ram[sp - 1] = (ram[sp - 1] - ram[sp]) & 0xFFFF
+				elif op == IF_GOTO:
+					sp -= 1
+					if ram[sp]:
+						pc = a
+				elif op == GOTO:
+					pc = a
+				elif op == NOT:
+					ram[sp - 1] ^= 0xFFFF
+				elif op == LT:
+					sp -= 1
+					ram[sp - 1] = 0xFFFF if (ram[sp - 1] ^ 0x8000) < (ram[sp] ^ 0x8000) else 0
+				elif op == GT:
+					sp -= 1
+					ram[sp - 1] = 0xFFFF if (ram[sp - 1] ^ 0x8000) > (ram[sp] ^ 0x8000) else 0
+				elif op == EQ:
+					sp -= 1
+					ram[sp - 1] = 0xFFFF if ram[sp - 1] == ram[sp] else 0
+				elif op == AND:
+					sp -= 1
+					ram[sp - 1] &= ram[sp]
+				elif op == OR:
+					sp -= 1
+					ram[sp - 1] |= ram[sp]
+				elif op == NEG:
+					ram[sp - 1] = -ram[sp - 1] & 0xFFFF
+				elif op == CALL:
+					ram[sp] = pc
+					ram[sp + 1] = ram[1]
+					ram[sp + 2] = ram[2]
+					ram[sp + 3] = ram[3]
+					ram[sp + 4] = ram[4]
+					ram[2] = sp - b
+					sp += 5
+					ram[1] = sp
+					pc = a
+					if stats is not None:
+						stats.enter(self.function_names[a], steps)
+				elif op == FUNCTION:
+					ram[sp:sp + a] = b
+					sp += a
+				elif op == RETURN:
+					frame = ram[1]
+					arg = ram[2]
+					pc = ram[frame - 5]
+					ram[arg] = ram[sp - 1]
+					sp = arg + 1
+					ram[1] = ram[frame - 4]
+					ram[2] = ram[frame - 3]
+					ram[3] = ram[frame - 2]
+					ram[4] = ram[frame - 1]
+					if stats is not None:
+						stats.leave(steps)
+				elif op == CALL_NATIVE:
+					ram[0] = sp
+					sp -= b
+					try:
+						ram[sp] = a(self, *ram[sp:sp + b]) & 0xFFFF
+					except SysError as error:
+						# Call Sys.error as the Jack version would
+						if not 'Sys.error' in self.program.functions:
+							raise Halt()
+						self.pc = pc
+						ram[0] = sp
+						self.call('Sys.error', [error.code])
+						pc, sp = self.pc, ram[0]
+						continue
+					sp += 1
+					if stats is not None:
+						stats.native(self.native_names[a])
+				elif op == HALT:
+					pc -= 1
+					steps -= 1
+					self.halted = True
+					break
+				else:
+					raise Exception('Unknown opcode ' + str(op))
+		except Halt:
+			self.halted = True
+		self.pc = pc
+		self.steps = steps
+		ram[0] = sp
+		return self.halted
+
+
+def load_program(path):
+	program = Program()
+	if os.path.isdir(path):
+		program.load_directory(path)
+	else:
+		program.load_file(path)
+	return program
+
+def main(argv):
+	parser = argparse.ArgumentParser(description='Executes .vm files without translating them to assembly.')
+	parser.add_argument('path', help='<filename>.vm | <directory>')
+	parser.add_argument('--max-steps', type=int, help='stop after executing this many VM commands')
+	parser.add_argument('--no-native', nargs='*', metavar='FUNCTION', help='execute these OS functions (default: all) as VM code instead of natively')
+	parser.add_argument('--stats', action='store_true', help='report calls and steps per function')
+	args = parser.parse_args(argv)
+
+	program = load_program(args.path)
+	stats = FunctionStats() if args.stats else None
+	vm = VMEmulator(program, select(args.no_native or None) if args.no_native is not None else natives, stats)
+	halted = vm.run(args.max_steps)
+	state = 'halted' if halted else 'stopped'
+	print(f'{state} after {vm.steps} steps in {program.function_at(vm.pc) or "(top level)"}')
+	if stats:
+		stats.report()
+
+if __name__ == '__main__':
+    main(sys.argv[1:])